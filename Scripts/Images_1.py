@@ -3,7 +3,6 @@ import requests
 from PIL import Image
 from datetime import datetime
 import subprocess
-import boto3
 from botocore.exceptions import NoCredentialsError
 import sys
 import json
@@ -14,6 +13,10 @@ import shutil
 from dotenv import load_dotenv
 import logging
 import traceback
+from tiling import tile_image
+from downloader import fetch_bytes
+import http_cache
+import s3_publisher
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -22,14 +25,6 @@ logger = logging.getLogger(__name__)
 # Load environment variables from .env file
 load_dotenv()
 
-# Initialize the boto3 S3 client using environment variables
-s3 = boto3.client(
-    's3',
-    aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-    region_name='us-east-2'
-)
-
 # Base folder constants – must match the settings in your JSX script
 BASE_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # Go up one level to root
 DOWNLOAD_BASE_FOLDER = os.path.join(BASE_FOLDER, 'Download')
@@ -39,6 +34,13 @@ BAGS_FOLDER = os.path.join(BASE_FOLDER, 'Bags & Tissues')
 TEMPLATE_IMAGES_FOLDER = os.path.join(BASE_FOLDER, 'Templateimages')
 BUCKET_NAME = 'compoundfoundry'
 
+# Conditional-GET download cache shared with images.py (see http_cache.py)
+HTTP_CACHE_FOLDER = os.path.join(BASE_FOLDER, 'HttpCache')
+HTTP_CACHE_MAX_BYTES = 10 * 1024 ** 3
+
+# Tiles are built from the downloaded bytes; set to also save <filename>.png
+KEEP_ORIGINAL_DOWNLOADS = False
+
 # Create dated subfolders (naming format: YYYY-MM-DD_HH-MM-SS)
 current_date = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
 download_folder = os.path.join(DOWNLOAD_BASE_FOLDER, current_date)
@@ -55,36 +57,36 @@ def download_and_tile_image(url, filename, tile_size, max_retries=3):
     for attempt in range(max_retries):
         try:
             logger.info(f"Downloading image from {url} (attempt {attempt+1}/{max_retries})")
-            response = requests.get(url, timeout=30)  # Increased timeout
-            response.raise_for_status()
-            
-            original_file_path = os.path.join(download_folder, f"{filename}.png")
-            
-            with open(original_file_path, 'wb') as f:
-                f.write(response.content)
-            logger.info(f"Image saved to {original_file_path}")
+            # Revalidates against the download cache; a 304 reads the cached copy.
+            # A transfer that breaks off is kept in the .part file, so the next
+            # attempt only requests the missing bytes.
+            data = fetch_bytes(url, timeout=30, cache_dir=HTTP_CACHE_FOLDER, cache_max_bytes=HTTP_CACHE_MAX_BYTES,
+                               part_path=os.path.join(download_folder, f"{filename}.png.part"))
             
-            # Verify the file exists and is a valid image
+            # Decode straight from the response buffer; nothing is written
+            # until we know it is a valid image
             try:
-                original_image = Image.open(original_file_path)
-                width, height = original_image.size
+                original_image = Image.open(io.BytesIO(data))
+                original_image.load()
                 
                 # Create the tiled image
-                tiled_image = Image.new('RGB', (width * tile_size, height * tile_size))
-                for i in range(tile_size):
-                    for j in range(tile_size):
-                        tiled_image.paste(original_image, (i * width, j * height))
+                tiled_image = tile_image(original_image, tile_size, mode='RGB')
                 
                 tiled_filename = f"{filename}_{tile_size}.png"
                 tiled_file_path = os.path.join(download_folder, tiled_filename)
                 tiled_image.save(tiled_file_path)
                 logger.info(f"Tiled image saved to {tiled_file_path}")
+                
+                if KEEP_ORIGINAL_DOWNLOADS:
+                    original_file_path = os.path.join(download_folder, f"{filename}.png")
+                    with open(original_file_path, 'wb') as f:
+                        f.write(data)
+                    logger.info(f"Image saved to {original_file_path}")
                 return tiled_file_path
             except Exception as e:
                 logger.error(f"Error processing downloaded image: {e}")
-                # If we can't open it as an image, remove the file and retry
-                if os.path.exists(original_file_path):
-                    os.remove(original_file_path)
+                # Drop the cached copy so the retry really downloads it again
+                http_cache.forget(HTTP_CACHE_FOLDER, url)
                 raise
                 
         except requests.exceptions.RequestException as e:
@@ -119,22 +121,12 @@ def upload_to_s3_and_make_public(local_file, bucket_name, s3_key, max_retries=3)
         try:
             logger.info(f"Uploading {local_file} to S3 bucket {bucket_name}... (attempt {attempt+1}/{max_retries})")
             content_type = 'image/png' if local_file.lower().endswith('.png') else 'application/octet-stream'
-            extra_args = {'ACL': 'public-read', 'ContentType': content_type}
-            
-            s3.upload_file(local_file, bucket_name, s3_key, ExtraArgs=extra_args)
             
-            # Verify the upload was successful by checking if the object exists
-            try:
-                s3.head_object(Bucket=bucket_name, Key=s3_key)
-                location = s3.get_bucket_location(Bucket=bucket_name)['LocationConstraint']
-                if location is None:
-                    location = 'us-east-1'
-                url = f"https://{bucket_name}.s3-{location}.amazonaws.com/{s3_key}"
-                logger.info(f"Uploaded to {url}")
-                return url
-            except Exception as e:
-                logger.error(f"Upload verification failed: {e}")
-                raise
+            # The upload is checked against its Content-MD5 / ETag, so no
+            # separate HEAD request is needed to confirm it
+            url = s3_publisher.upload_file(local_file, bucket_name, s3_key, content_type=content_type)
+            logger.info(f"Uploaded to {url}")
+            return url
                 
         except Exception as e:
             logger.error(f"Upload error (attempt {attempt+1}): {e}")
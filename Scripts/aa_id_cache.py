@@ -0,0 +1,95 @@
+"""
+Handle -> AA id cache shared by the pipeline stages.
+
+images.py, illustrator_process.py (once per PDF) and process_products.py
+all need the AA id (custom.basesku) of the same handles within minutes of
+each other.  The answers are kept in a small SQLite file so only the first
+stage of a run asks Shopify.  AA ids never change once assigned, so found
+ids are kept for a long time; "no AA id yet" is kept only briefly, because
+process_products.py or the storefront may assign one at any moment.
+process_products.py writes the ids it assigns straight into the cache.
+
+Every call opens (and closes) its own connection, so the cache can be used
+from several threads and processes at once (SQLite serialises the writes).
+"""
+
+import logging
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 30 * 24 * 3600      # found AA ids: 30 days
+DEFAULT_NEGATIVE_TTL = 3600       # handles without one: 1 hour
+
+
+class AaIdCache:
+    """Handle -> AA id (or None) with separate TTLs for hits and misses."""
+
+    def __init__(self, path, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connect() as db, db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS aa_ids '
+                       '(handle TEXT PRIMARY KEY, aa_id TEXT, fetched_at REAL NOT NULL)')
+
+    def _connect(self):
+        """A connection that closes at the end of the with block.  Use it as
+        ``with self._connect() as db, db:`` so the writes are committed too."""
+        return closing(sqlite3.connect(self.path, timeout=30))
+
+    def _fresh(self, aa_id, fetched_at, now):
+        return now - fetched_at < (self.ttl if aa_id else self.negative_ttl)
+
+    def get_many(self, handles):
+        """Fresh entries for *handles*: dict of handle -> AA id or None.
+        Handles without a fresh entry are left out."""
+        handles = list(dict.fromkeys(handles))
+        found, now = {}, time.time()
+        try:
+            with self._connect() as db, db:
+                # Stay below SQLite's limit on bound parameters
+                for start in range(0, len(handles), 500):
+                    batch = handles[start:start + 500]
+                    rows = db.execute(f"SELECT handle, aa_id, fetched_at FROM aa_ids "
+                                      f"WHERE handle IN ({','.join('?' * len(batch))})", batch)
+                    found.update((handle, aa_id) for handle, aa_id, fetched_at in rows
+                                 if self._fresh(aa_id, fetched_at, now))
+        except sqlite3.Error as e:
+            logger.warning(f"AA id cache {self.path} unreadable: {e}")
+        return found
+
+    def put_many(self, aa_ids):
+        """Store a dict of handle -> AA id (None: the handle has none)."""
+        now = time.time()
+        try:
+            with self._connect() as db, db:
+                db.executemany('INSERT OR REPLACE INTO aa_ids (handle, aa_id, fetched_at) VALUES (?, ?, ?)',
+                               [(handle, aa_id, now) for handle, aa_id in aa_ids.items()])
+        except sqlite3.Error as e:
+            logger.warning(f"Could not write AA id cache {self.path}: {e}")
+
+    def put(self, handle, aa_id):
+        self.put_many({handle: aa_id})
+
+    def lookup(self, handle, fetch):
+        """
+        AA id of *handle*, from the cache or else from fetch(handle), whose
+        answer is then cached.  A fetch that raises is logged and gives
+        None without caching anything.
+        """
+        cached = self.get_many([handle])
+        if handle in cached:
+            return cached[handle]
+        try:
+            aa_id = fetch(handle)
+        except Exception as e:
+            logger.warning(f"AA id lookup for {handle} failed: {e}")
+            return None
+        self.put(handle, aa_id)
+        return aa_id
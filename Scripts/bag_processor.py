@@ -2,8 +2,11 @@ import os
 import sys
 import subprocess
 import logging
-from PIL import Image
 from pathlib import Path
+from config import (TILE_CACHE_FOLDER, TILE_CACHE_MAX_BYTES, INTERMEDIATE_ENCODE_PROFILE,
+                    TILING_WORKERS, TILING_WORKER_MAX_BYTES)
+from tiling import bag_tile_specs, create_tile_set
+from tile_pool import default_workers, tile_pool
 
 # Set up logging
 logging.basicConfig(
@@ -16,6 +19,7 @@ def create_bag_tiles(download_folder):
     """
     Create 3x3 and 4x4 tiled versions of images for bag processing.
     Uses smaller, more manageable tile sizes to avoid memory issues.
+    Tiles already written by images.py are reused as-is.
     """
     logger.info(f"Creating bag tiles from images in: {download_folder}")
     
@@ -28,45 +32,45 @@ def create_bag_tiles(download_folder):
     logger.info(f"Found {len(original_files)} original images to process")
     
     created_tiles = []
+    jobs = []
     for original_file in original_files:
         try:
-            # Open the original image
-            with Image.open(original_file) as img:
-                # Resize original image to manageable size first to avoid memory issues
-                max_dimension = 1000  # Limit individual tile to 1000px max
-                if img.width > max_dimension or img.height > max_dimension:
-                    ratio = min(max_dimension / img.width, max_dimension / img.height)
-                    new_size = (int(img.width * ratio), int(img.height * ratio))
-                    img = img.resize(new_size, Image.Resampling.LANCZOS)
-                
-                width, height = img.size
-                base_name = os.path.splitext(os.path.basename(original_file))[0]
-                
-                # Create 3x3 tiled version (for Bags 1, 3, 7)
-                tiled_3x3 = Image.new(img.mode, (width * 3, height * 3))
-                for i in range(3):
-                    for j in range(3):
-                        tiled_3x3.paste(img, (i * width, j * height))
-                
-                tiled_3x3_file = os.path.join(download_folder, f"{base_name}_3.png")
-                tiled_3x3.save(tiled_3x3_file, optimize=True)
-                created_tiles.append(tiled_3x3_file)
-                logger.info(f"Created 3x3 tile: {tiled_3x3_file}")
-                
-                # Create 4x4 tiled version (for Bags 4, 5, 6)
-                tiled_4x4 = Image.new(img.mode, (width * 4, height * 4))
-                for i in range(4):
-                    for j in range(4):
-                        tiled_4x4.paste(img, (i * width, j * height))
-                
-                tiled_4x4_file = os.path.join(download_folder, f"{base_name}_4.png")
-                tiled_4x4.save(tiled_4x4_file, optimize=True)
-                created_tiles.append(tiled_4x4_file)
-                logger.info(f"Created 4x4 tile: {tiled_4x4_file}")
+            base_name = os.path.splitext(os.path.basename(original_file))[0]
+            specs = bag_tile_specs(download_folder, base_name, INTERMEDIATE_ENCODE_PROFILE)
+            
+            # images.py normally writes the bag tiles in the same pass as the
+            # 6x6 tile; only build the ones that are still missing.
+            missing = [spec for spec in specs if not os.path.exists(spec['path'])]
+            for spec in specs:
+                if spec not in missing:
+                    created_tiles.append(spec['path'])
+                    logger.info(f"Using existing {spec['cols']}x{spec['rows']} tile: {spec['path']}")
+            
+            if missing:
+                jobs.append((original_file, missing))
                 
         except Exception as e:
             logger.error(f"Error creating tiles for {original_file}: {e}")
     
+    if not jobs:
+        return created_tiles
+    
+    # Each job resizes its original to the 1000px cap once and writes both
+    # grids from that buffer; the originals are tiled in parallel.
+    workers = min(TILING_WORKERS or default_workers(), len(jobs))
+    with tile_pool(workers, TILING_WORKER_MAX_BYTES) as pool:
+        futures = [
+            (original_file, pool.submit(create_tile_set, original_file, missing,
+                                        cache_dir=TILE_CACHE_FOLDER,
+                                        cache_max_bytes=TILE_CACHE_MAX_BYTES))
+            for original_file, missing in jobs
+        ]
+        for original_file, future in futures:
+            try:
+                created_tiles.extend(future.result())
+            except Exception as e:
+                logger.error(f"Error creating tiles for {original_file}: {e}")
+    
     return created_tiles
 
 def run_bag_jsx():
@@ -174,7 +178,7 @@ def process_bags():
             logger.warning("No tiles were created - checking for existing tiles")
             # Check if tiles already exist
             existing_tiles = [f for f in os.listdir(most_recent_folder) 
-                            if f.endswith('_3.png') or f.endswith('_4.png')]
+                            if f.endswith(('_3.png', '_4.png', '_3.tif', '_4.tif'))]
             if not existing_tiles:
                 logger.error("No bag tiles found")
                 return False
@@ -1,9 +1,11 @@
 import os
-import boto3
 import logging
 from pathlib import Path
 import re
 
+import s3_publisher
+from output_index import BAG_TYPES, files_of, index_outputs
+
 # Set up logging
 logging.basicConfig(
     level=logging.INFO,
@@ -12,13 +14,8 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 def get_s3_client():
-    """Get S3 client using your existing credentials"""
-    return boto3.client(
-        's3',
-        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-        region_name='us-east-2'  # Your existing region
-    )
+    """Get the shared S3 client (see s3_publisher.py)"""
+    return s3_publisher.get_client()
 
 def extract_product_id_from_filename(filename):
     """
@@ -79,7 +76,7 @@ def find_product_by_name(products_data, filename):
     logger.warning(f"No product data found for filename: {filename}")
     return None
 
-def upload_bag_files_to_s3(output_folder, products_data, bucket_name='aspenarlo'):
+def upload_bag_files_to_s3(output_folder, products_data, bucket_name='aspenarlo', manifest=None):
     """
     Upload bag files to S3 with proper SKU naming and folder structure.
     
@@ -87,19 +84,18 @@ def upload_bag_files_to_s3(output_folder, products_data, bucket_name='aspenarlo'
         output_folder: Path to the timestamped output folder containing bag files
         products_data: List of product dictionaries with name and shopify SKU info
         bucket_name: S3 bucket name
+        manifest: Output index from output_index.index_outputs(); the folder
+                  is scanned when it is not given
     """
     try:
-        s3_client = get_s3_client()
         uploaded_files = []
         
         logger.info(f"Scanning for bag files in: {output_folder}")
         
         # Find all bag files in the output folder
-        bag_files = []
-        for root, dirs, files in os.walk(output_folder):
-            for file in files:
-                if file.endswith(('_bag1.png', '_bag2.png', '_bag3.png', '_bag4.png', '_bag5.png', '_bag6.png', '_bag7.png')):
-                    bag_files.append(os.path.join(root, file))
+        if manifest is None:
+            manifest = index_outputs(output_folder)
+        bag_files = files_of(manifest, BAG_TYPES)
         
         logger.info(f"Found {len(bag_files)} bag files to upload")
         
@@ -150,29 +146,10 @@ def upload_bag_files_to_s3(output_folder, products_data, bucket_name='aspenarlo'
                 
                 logger.info(f"Uploading {filename} as {s3_key} (base SKU: {base_sku})")
                 
-                # Upload to S3 with public-read ACL
-                extra_args = {
-                    'ACL': 'public-read',
-                    'ContentType': 'image/png'
-                }
-                
-                s3_client.upload_file(
-                    bag_file_path,
-                    bucket_name,
-                    s3_key,
-                    ExtraArgs=extra_args
-                )
-                
-                # Verify upload and get URL
+                # Upload to S3 with public-read ACL; the upload is checked
+                # against its Content-MD5 / ETag, so no HEAD request follows
                 try:
-                    s3_client.head_object(Bucket=bucket_name, Key=s3_key)
-                    
-                    # Generate the public URL
-                    location = s3_client.get_bucket_location(Bucket=bucket_name)['LocationConstraint']
-                    if location is None:
-                        location = 'us-east-1'
-                    
-                    public_url = f"https://{bucket_name}.s3-{location}.amazonaws.com/{s3_key}"
+                    public_url = s3_publisher.upload_file(bag_file_path, bucket_name, s3_key, content_type='image/png')
                     
                     uploaded_files.append({
                         'original_file': filename,
@@ -180,6 +157,7 @@ def upload_bag_files_to_s3(output_folder, products_data, bucket_name='aspenarlo'
                         'base_sku': base_sku,
                         'product_name': product_data.get('name', ''),
                         'bag_type': bag_type,
+                        'bucket': bucket_name,
                         's3_key': s3_key,
                         'public_url': public_url,
                         'local_path': bag_file_path
@@ -187,8 +165,8 @@ def upload_bag_files_to_s3(output_folder, products_data, bucket_name='aspenarlo'
                     
                     logger.info(f"Successfully uploaded: {public_url}")
                     
-                except Exception as verify_error:
-                    logger.error(f"Upload verification failed for {s3_key}: {verify_error}")
+                except Exception as upload_error:
+                    logger.error(f"Upload failed for {s3_key}: {upload_error}")
                 
             except Exception as file_error:
                 logger.error(f"Error uploading {bag_file_path}: {file_error}")
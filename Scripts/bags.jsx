@@ -57,13 +57,16 @@ var bagTemplatePaths = [
     { path: scriptDir.parent + "/Bags & Tissues/Bag 7.psd", name: "bag7", tileType: "3x3" }
 ];
 
-// Look for pattern files
-var patternFiles = Folder(downloadFolder).getFiles("*.png");
+// Look for pattern files (bag tiles may be written as uncompressed TIFF,
+// see INTERMEDIATE_ENCODE_PROFILE in config.py)
+var patternFiles = Folder(downloadFolder).getFiles(function(file) {
+    return file instanceof File && /\.(png|tif)$/i.test(file.name);
+});
 
 // Process each pattern file with appropriate bag templates
 for (var i = 0; i < patternFiles.length; i++) {
     var patternFile = patternFiles[i];
-    var baseName = patternFile.name.replace(".png", "");
+    var baseName = patternFile.name.replace(/\.(png|tif)$/i, "");
     
     // Process with different bag templates based on tile requirements
     for (var j = 0; j < bagTemplatePaths.length; j++) {
@@ -22,6 +22,78 @@ TILE_SIZES = [2, 3, 4]  # Different tile sizes for image processing
 MAX_IMAGE_SIZE = (3000, 3000)  # Maximum dimensions for processed images
 SUPPORTED_FORMATS = ['.png', '.jpg', '.jpeg']
 
+# Encode profile for intermediate tiles only Photoshop reads (bag 3x3/4x4):
+# 'fast', 'default', 'optimized' or 'tiff' (see ENCODE_PROFILES in tiling.py)
+INTERMEDIATE_ENCODE_PROFILE = 'fast'
+
+# Content-addressed tile cache shared across runs (see tile_cache.py)
+TILE_CACHE_FOLDER = os.path.join(BASE_FOLDER, 'TileCache')
+TILE_CACHE_MAX_BYTES = 20 * 1024 ** 3  # 20 GB, least-recently-used entries go first
+
+# Write raw raster sidecars (<file>.png.raster, see raster_sidecar.py) for the
+# downloads and main tiles so later Python stages skip the PNG decode
+RASTER_SIDECARS = True
+
+# Worker threads per images.py pipeline stage (see pipeline.py); the tile
+# stage uses TILING_WORKERS
+LOOKUP_WORKERS = 2  # Shopify AA-ID lookups
+UPLOAD_WORKERS = 4  # S3 uploads of the main tile
+
+# Photoshop output uploads (see s3_publisher.py).  Files at or above the
+# threshold go up as multipart uploads with S3_MAX_CONCURRENCY parts in
+# flight; keep S3_OUTPUT_UPLOAD_WORKERS x S3_MAX_CONCURRENCY within the
+# client's 32 pooled connections.
+S3_OUTPUT_UPLOAD_WORKERS = 8
+S3_MULTIPART_THRESHOLD = 16 * 1024 ** 2  # 16 MB
+S3_MULTIPART_CHUNKSIZE = 16 * 1024 ** 2  # 16 MB
+S3_MAX_CONCURRENCY = 4
+
+# Skip uploads whose bytes S3 already holds under the same key, tracked in a
+# local (key, size, MD5/ETag) manifest (see upload_manifest.py)
+SKIP_UNCHANGED_UPLOADS = True
+S3_UPLOAD_MANIFEST = os.path.join(BASE_FOLDER, 'S3Manifest', 'uploads.json')
+
+# Publish tiles and Photoshop outputs under content-hashed keys
+# (name.<hash>.png) that browsers and CDNs cache for a year, instead of
+# overwriting one key and adding ?v=<timestamp> to its URL.  The plain key
+# is still updated as an alias.
+IMMUTABLE_S3_KEYS = True
+
+# Handle -> AA id answers shared by images.py, illustrator_process.py and
+# process_products.py (see aa_id_cache.py)
+AA_ID_CACHE_PATH = os.path.join(BASE_FOLDER, 'Cache', 'aa_ids.sqlite')
+AA_ID_CACHE_TTL = 30 * 24 * 3600          # AA ids never change once assigned
+AA_ID_CACHE_NEGATIVE_TTL = 3600           # "no AA id yet" is re-checked after an hour
+
+# Upload Photoshop outputs as they land in Output/<ts> instead of after every
+# processor has finished (see output_watcher.py).  Needs the upload manifest,
+# which lets the end-of-run step confirm them instead of sending them again.
+WATCH_OUTPUTS = True
+OUTPUT_WATCH_INTERVAL = 2.0  # seconds between polls; a file is stable after two
+
+# Concurrent source downloads in images.py (see downloader.py)
+DOWNLOAD_CONCURRENCY = 16
+DOWNLOAD_CONNECTIONS_PER_HOST = 8
+
+# Conditional-GET cache for source downloads (see http_cache.py)
+HTTP_CACHE_FOLDER = os.path.join(BASE_FOLDER, 'HttpCache')
+HTTP_CACHE_MAX_BYTES = 10 * 1024 ** 3  # 10 GB, least-recently-used entries go first
+
+# Broken downloads keep their bytes here, named after the URL, so a retry or
+# the next run only fetches the rest (see partial_download.py).  Kept out of
+# HTTP_CACHE_FOLDER so the cache's size limit never evicts a resumable download.
+PARTIAL_DOWNLOAD_FOLDER = os.path.join(BASE_FOLDER, 'PartialDownloads')
+DOWNLOAD_ATTEMPTS = 3  # per source in images.py, resuming each time
+
+# Save each downloaded original as Download/<ts>/<handle>.png.  Tiles are
+# built straight from the downloaded bytes; the original is only re-read by
+# bag_processor.py when its bag tiles are missing.
+KEEP_ORIGINAL_DOWNLOADS = False
+
+# Tiling worker processes (see tile_pool.py); None means one per CPU core
+TILING_WORKERS = None
+TILING_WORKER_MAX_BYTES = 4 * 1024 ** 3  # 4 GB per worker, None for no cap
+
 # Photoshop configuration
 PHOTOSHOP_SCRIPT_PATH = os.path.join(BASE_FOLDER, 'Scripts', 'source3.jsx')
 
@@ -0,0 +1,145 @@
+"""
+HTTP download helpers for the image pipeline.
+
+All downloads share one requests session, so connections to the same host
+are kept alive and reused.  Each host gets its own connection pool, capped at
+``connections_per_host``; with ``pool_block`` set, extra requests to a busy
+host wait for a free connection instead of opening more.
+"""
+
+import io
+import logging
+import os
+import threading
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+
+import http_cache
+import partial_download
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# Hosts whose connection pools are kept around at once
+_POOLED_HOSTS = 32
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def make_session(connections_per_host=8):
+    """A requests.Session with keep-alive pools capped per host."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=_POOLED_HOSTS, pool_maxsize=connections_per_host, pool_block=True)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session(connections_per_host=8):
+    """Process-wide shared session (created on first use)."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = make_session(connections_per_host)
+        return _session
+
+
+def normalize_url(url):
+    """
+    Canonical form of *url* for spotting repeated sources: surrounding
+    whitespace, the fragment and a default port are dropped and the scheme
+    and host lower-cased.  The path and query are kept as they are.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and (scheme, parts.port) not in (('http', 80), ('https', 443)):
+        host = f"{host}:{parts.port}"
+    if '@' in parts.netloc:
+        host = f"{parts.netloc.rsplit('@', 1)[0]}@{host}"
+    return urlunsplit((scheme, host, parts.path or '/', parts.query, ''))
+
+
+def download_file(url, path, session=None, timeout=DEFAULT_TIMEOUT, chunk_size=DEFAULT_CHUNK_SIZE,
+                  cache_dir=None, cache_max_bytes=None):
+    """
+    Stream *url* to *path*.
+
+    Args:
+        url: Source URL
+        path: Destination file; replaced only once the body has been received
+        session: Session to use (defaults to the shared one)
+        timeout: Connect/read timeout in seconds
+        chunk_size: Bytes written per read
+        cache_dir: Conditional-GET cache folder (see http_cache.py); None
+                   always downloads
+        cache_max_bytes: Size limit for the cache
+
+    Returns:
+        *path*
+
+    Raises:
+        requests.exceptions.RequestException: On HTTP or connection errors
+    """
+    session = session or get_session()
+    if cache_dir:
+        http_cache.download(session, url, path, cache_dir, cache_max_bytes, timeout, chunk_size)
+        return path
+
+    tmp = f"{path}.download"
+    try:
+        with session.get(url, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            with open(tmp, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return path
+
+
+def fetch_bytes(url, session=None, timeout=DEFAULT_TIMEOUT, chunk_size=DEFAULT_CHUNK_SIZE,
+                cache_dir=None, cache_max_bytes=None, part_path=None):
+    """
+    Like download_file, but return the body in memory instead of writing it.
+
+    Broken transfers are resumed with Range requests, and the body is checked
+    against the announced size / MD5 (see partial_download.py).  When the
+    transfer cannot finish, the bytes received are kept at *part_path* and
+    the next call for the same URL continues from there.
+    """
+    session = session or get_session()
+    if cache_dir:
+        return http_cache.fetch(session, url, cache_dir, cache_max_bytes, timeout, chunk_size, part_path)
+
+    with partial_download.open_response(session, url, part_path, timeout=timeout) as response:
+        response.raise_for_status()
+        return partial_download.read_body(session, url, response, part_path, timeout, chunk_size)
+
+
+def verify_image(data):
+    """
+    Check that *data* is an image Pillow can read, without decoding the
+    pixels (Image.verify checks structure and, for PNG, chunk CRCs).
+
+    Returns:
+        (format, size) of the image
+
+    Raises:
+        ValueError: If the bytes are not a readable image
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            info = (img.format, img.size)
+            img.verify()
+        return info
+    except Exception as e:
+        raise ValueError(f"Downloaded data is not a valid image: {e}") from e
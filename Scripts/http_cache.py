@@ -0,0 +1,183 @@
+"""
+Persistent conditional-GET cache for source artwork downloads.
+
+Each URL's last response body is kept with its ETag / Last-Modified.  The
+next request for that URL sends If-None-Match / If-Modified-Since; on a 304
+the cached body is hard-linked into the run folder instead of downloaded
+again.  Responses without either validator are not cached.  The cache is
+trimmed least-recently-used first once it grows past its size limit (entries
+are touched on every hit).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+
+import partial_download
+import tile_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3  # 10 GB
+
+
+def _entry_paths(cache_dir, url):
+    key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+    base = os.path.join(cache_dir, key[:2], key)
+    return f"{base}.body", f"{base}.json"
+
+
+def _load_entry(cache_dir, url):
+    body, meta = _entry_paths(cache_dir, url)
+    try:
+        with open(meta, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if entry.get('url') != url or not os.path.exists(body):
+        return None
+    return entry
+
+
+def forget(cache_dir, url):
+    """Drop the cached copy of *url* (e.g. when it turned out not to decode)."""
+    for path in _entry_paths(cache_dir, url):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _touch(*paths):
+    now = time.time()
+    for path in paths:
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+
+
+def _request_headers(entry):
+    headers = {}
+    if entry:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+
+def _write_meta(meta_path, url, response, size):
+    tmp = f"{meta_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'url': url, 'etag': response.headers.get('ETag'),
+                   'last_modified': response.headers.get('Last-Modified'),
+                   'size': size, 'stored': time.time()}, f)
+    os.replace(tmp, meta_path)
+
+
+def _cacheable(response):
+    return bool(response.headers.get('ETag') or response.headers.get('Last-Modified'))
+
+
+def download(session, url, path, cache_dir, max_bytes=None, timeout=30, chunk_size=1024 * 1024):
+    """
+    Fetch *url* into *path*, revalidating against the cached copy.
+
+    Args:
+        session: requests.Session to use
+        url: Source URL
+        path: Destination file (replaced on success)
+        cache_dir: Cache folder
+        max_bytes: Size limit enforced after storing a new body
+        timeout: Connect/read timeout in seconds
+        chunk_size: Bytes written per read
+
+    Returns:
+        True when the body came from the cache (304), False when downloaded
+
+    Raises:
+        requests.exceptions.RequestException: On HTTP or connection errors
+    """
+    body_path, meta_path = _entry_paths(cache_dir, url)
+    entry = _load_entry(cache_dir, url)
+
+    tmp = f"{body_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with session.get(url, headers=_request_headers(entry), stream=True, timeout=timeout) as response:
+            if response.status_code == 304 and entry:
+                try:
+                    tile_cache.link_or_copy(body_path, path)
+                except FileNotFoundError:
+                    # Evicted since we looked; fetch it unconditionally
+                    forget(cache_dir, url)
+                    return download(session, url, path, cache_dir, max_bytes, timeout, chunk_size)
+                _touch(body_path, meta_path)
+                logger.info(f"HTTP cache: {url} not modified, using cached copy")
+                return True
+
+            response.raise_for_status()
+            os.makedirs(os.path.dirname(body_path), exist_ok=True)
+            with open(tmp, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+
+            if not _cacheable(response):
+                os.replace(tmp, path)
+                return False
+
+            os.replace(tmp, body_path)
+            _write_meta(meta_path, url, response, os.path.getsize(body_path))
+        tile_cache.link_or_copy(body_path, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    tile_cache.evict(cache_dir, max_bytes or DEFAULT_MAX_BYTES)
+    return False
+
+
+def fetch(session, url, cache_dir, max_bytes=None, timeout=30, chunk_size=1024 * 1024, part_path=None):
+    """
+    Like download(), but return the body as bytes instead of writing it to a
+    run folder.  New bodies are still stored in the cache.  *part_path* keeps
+    a partial body between attempts (see partial_download.py).
+    """
+    body_path, meta_path = _entry_paths(cache_dir, url)
+    entry = _load_entry(cache_dir, url)
+
+    response = partial_download.open_response(session, url, part_path, _request_headers(entry), timeout)
+    with response:
+        if response.status_code == 304 and entry:
+            try:
+                with open(body_path, 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                forget(cache_dir, url)
+                return fetch(session, url, cache_dir, max_bytes, timeout, chunk_size, part_path)
+            _touch(body_path, meta_path)
+            if part_path:
+                partial_download.discard(part_path)
+            logger.info(f"HTTP cache: {url} not modified, using cached copy")
+            return data
+
+        response.raise_for_status()
+        data = partial_download.read_body(session, url, response, part_path, timeout, chunk_size)
+
+        if not _cacheable(response):
+            return data
+        try:
+            os.makedirs(os.path.dirname(body_path), exist_ok=True)
+            tmp = f"{body_path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, body_path)
+            _write_meta(meta_path, url, response, len(data))
+        except OSError as e:
+            logger.warning(f"Could not add {url} to HTTP cache: {e}")
+
+    tile_cache.evict(cache_dir, max_bytes or DEFAULT_MAX_BYTES)
+    return data
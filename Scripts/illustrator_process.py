@@ -3,7 +3,6 @@ import os
 import subprocess
 import time
 from datetime import datetime
-import boto3
 from botocore.exceptions import NoCredentialsError
 import sys
 import json
@@ -13,22 +12,27 @@ import logging
 import re
 import requests
 
+import s3_publisher
+from aa_id_cache import AaIdCache
+from shopify_client import ShopifyClient
+from shopify_lookup import fetch_aa_id
+from config import SKIP_UNCHANGED_UPLOADS, S3_UPLOAD_MANIFEST
+from config import AA_ID_CACHE_PATH, AA_ID_CACHE_TTL, AA_ID_CACHE_NEGATIVE_TTL
+
 # Load environment variables
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
 
-# AWS S3 Configuration using environment variables
-s3 = boto3.client(
-    's3',
-    aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-    region_name=os.getenv('AWS_REGION', 'us-east-2')
-)
-
 # Constants
 BUCKET_NAME = 'aspenarlo'
 BASE_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 BASE_OUTPUT_FOLDER = os.path.join(BASE_FOLDER, 'printpanels', 'output')
 
+# Re-runs only upload PDFs whose bytes changed (see upload_manifest.py)
+upload_manifest = s3_publisher.enable_upload_manifest(S3_UPLOAD_MANIFEST) if SKIP_UNCHANGED_UPLOADS else None
+
+# AA ids images.py already looked up this run (see aa_id_cache.py)
+aa_id_cache = AaIdCache(AA_ID_CACHE_PATH, AA_ID_CACHE_TTL, AA_ID_CACHE_NEGATIVE_TTL)
+
 # Load Shopify credentials from environment variables
 SHOPIFY_API_KEY = os.getenv('SHOPIFY_API_KEY')
 SHOPIFY_PASSWORD = os.getenv('SHOPIFY_PASSWORD')
@@ -39,11 +43,8 @@ SHOPIFY_API_VERSION = os.getenv('SHOPIFY_API_VERSION', '2025-01')  # Default to
 if not all([SHOPIFY_API_KEY, SHOPIFY_PASSWORD, SHOPIFY_STORE_NAME]):
     raise RuntimeError("Missing one or more required Shopify environment variables: SHOPIFY_API_KEY, SHOPIFY_PASSWORD, SHOPIFY_STORE")
 
-SHOPIFY_API_BASE = f"https://{SHOPIFY_STORE_NAME}.myshopify.com/admin/api/{SHOPIFY_API_VERSION}"
-SHOPIFY_HEADERS = {
-    'X-Shopify-Access-Token': SHOPIFY_PASSWORD,
-    'Content-Type': 'application/json'
-}
+# Pooled, rate-limited client for every Shopify call (see shopify_client.py)
+shopify = ShopifyClient(SHOPIFY_STORE_NAME, SHOPIFY_PASSWORD, SHOPIFY_API_VERSION)
 
 # Setup logging
 logging.basicConfig(
@@ -157,13 +158,13 @@ def process_csv(csv_path):
                         
                         # 3. If we have S3 URL, extract filename from it
                         if url and 'wrappingpaper/new_uploads/' in url:
-                            s3_filename = url.split('/')[-1]  # Get filename from URL
+                            s3_filename = s3_publisher.stable_key(url.split('?')[0]).split('/')[-1]  # Get filename from URL, without any content hash
                             base_name = os.path.splitext(s3_filename)[0]  # Remove .png extension
                             possible_names.append(base_name)
                             
                         # 4. Try to get AA ID from Shopify
                         try:
-                            aa_id = _fetch_aa_id(handle)
+                            aa_id = _get_aa_id_for_handle(handle)
                             if aa_id:
                                 possible_names.append(aa_id)
                                 possible_names.append(f"{aa_id}06")
@@ -323,12 +324,7 @@ def upload_to_s3(local_file, bucket_name, s3_key):
     """Upload a file to S3 and make it public."""
     try:
         logging.info(f"Uploading {local_file} to S3 bucket {bucket_name}...")
-        extra_args = {'ACL': 'public-read', 'ContentType': 'application/pdf'}
-        s3.upload_file(local_file, bucket_name, s3_key, ExtraArgs=extra_args)
-        location = s3.get_bucket_location(Bucket=bucket_name)['LocationConstraint']
-        if location is None:
-            location = 'us-east-1'
-        url = f"https://{bucket_name}.s3-{location}.amazonaws.com/{s3_key}"
+        url = s3_publisher.upload_file(local_file, bucket_name, s3_key, content_type='application/pdf')
         logging.info(f"Uploaded successfully to {url}")
         return url
     except FileNotFoundError:
@@ -377,46 +373,9 @@ def process_and_upload_files(output_folder):
                     })
     return uploaded_files
 
-def _fetch_aa_id(handle: str) -> str | None:
-    try:
-        url = f"{SHOPIFY_API_BASE}/products.json?handle={handle}"
-        r = requests.get(url, timeout=10)
-        r.raise_for_status()
-        products = r.json().get('products', [])
-        if not products:
-            return None
-        pid = products[0]['id']
-        mf_url = f"{SHOPIFY_API_BASE}/products/{pid}/metafields.json"
-        mfr = requests.get(mf_url, timeout=10)
-        mfr.raise_for_status()
-        for mf in mfr.json().get('metafields', []):
-            if mf.get('namespace') == 'custom' and mf.get('key') in ('basesku', 'base_sku'):
-                val = mf.get('value', '').strip().upper()
-                if val.startswith('AA') and val[2:].isdigit():
-                    return val
-        return None
-    except Exception:
-        return None
-
 def _get_aa_id_for_handle(handle: str) -> str | None:
     """Return AA###### from custom.basesku or None."""
-    try:
-        resp = requests.get(f"{SHOPIFY_API_BASE}/products.json?handle={handle}", headers=SHOPIFY_HEADERS, timeout=15)
-        resp.raise_for_status()
-        products = resp.json().get('products', [])
-        if not products:
-            return None
-        product_id = products[0]['id']
-        mf_resp = requests.get(f"{SHOPIFY_API_BASE}/products/{product_id}/metafields.json", headers=SHOPIFY_HEADERS, timeout=15)
-        mf_resp.raise_for_status()
-        for mf in mf_resp.json().get('metafields', []):
-            if mf.get('namespace') == 'custom' and mf.get('key') in ('basesku', 'base_sku'):
-                val = mf.get('value', '').strip().upper()
-                if val.startswith('AA') and val[2:].isdigit():
-                    return val
-        return None
-    except Exception:
-        return None
+    return aa_id_cache.lookup(handle, lambda h: fetch_aa_id(shopify, h))
 
 def main():
     if len(sys.argv) < 2:
@@ -440,6 +399,9 @@ def main():
         logging.info("PDF generation completed successfully")
         # Upload PDFs to S3 PrintFiles folder
         process_and_upload_files(output_folder)
+        if upload_manifest:
+            logging.info(upload_manifest.summary())
+        shopify.log_stats()
         sys.exit(0)
     else:
         logging.error("PDF generation failed")
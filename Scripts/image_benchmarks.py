@@ -0,0 +1,292 @@
+"""
+Micro-benchmarks for the image pipeline helpers.
+
+Usage:
+    python image_benchmarks.py tiling [--size 1000] [--repeat 3]
+    python image_benchmarks.py stream [--size 1500] [--grid 6]
+    python image_benchmarks.py encode [--size 1000] [--repeat 3] [--noise]
+    python image_benchmarks.py downscale [--size 8000] [--cap 1000]
+    python image_benchmarks.py sidecar [--size 2000] [--grid 6]
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+
+import numpy as np
+from PIL import Image
+
+import raster_sidecar
+from tile_writer import write_tiled_png
+from tiling import _MAPPED_MODES, ENCODE_PROFILES, _target_size, load_at_size, tile_image
+
+GRIDS = [(1, 3), (3, 3), (4, 4), (6, 6)]
+MODES = ['RGB', 'RGBA', 'P']
+
+
+def make_source(size, mode):
+    """Build a noisy test pattern so encoders cannot cheat on flat colour."""
+    rng = np.random.default_rng(1234)
+    pixels = rng.integers(0, 256, (size, size, 4), dtype=np.uint8)
+    img = Image.fromarray(pixels, 'RGBA')
+    if mode == 'P':
+        return img.convert('RGB').quantize(colors=256)
+    return img.convert(mode)
+
+
+def paste_tile(img, cols, rows):
+    """The nested paste loop the tile producers used before tiling.py."""
+    width, height = img.size
+    tiled_img = Image.new(img.mode, (width * cols, height * rows))
+    if img.mode == 'P':
+        tiled_img.putpalette(img.getpalette())
+    for y in range(rows):
+        for x in range(cols):
+            tiled_img.paste(img, (x * width, y * height))
+    return tiled_img
+
+
+def best_of(repeat, func, *args):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def best_of_pair(repeat, first, second):
+    """
+    best_of() for two competing calls: both are warmed up once, then run
+    in alternating order so neither always pays for a cold cache.
+    Returns ((time, result), (time, result)).
+    """
+    funcs = (first, second)
+    best = [None, None]
+    results = [func() for func in funcs]  # warm-up
+    for i in range(repeat):
+        for j in ((0, 1) if i % 2 == 0 else (1, 0)):
+            start = time.perf_counter()
+            results[j] = funcs[j]()
+            elapsed = time.perf_counter() - start
+            best[j] = elapsed if best[j] is None else min(best[j], elapsed)
+    return (best[0], results[0]), (best[1], results[1])
+
+
+def bench_tiling(args):
+    print(f"Tiling benchmark: {args.size}x{args.size} source, best of {args.repeat}")
+    print(f"{'mode':<6}{'grid':<7}{'paste (s)':>12}{'tiling (s)':>12}{'speedup':>10}  path    identical")
+    for mode in MODES:
+        src = make_source(args.size, mode)
+        src.load()
+        for cols, rows in GRIDS:
+            (paste_time, expected), (tiling_time, actual) = best_of_pair(
+                args.repeat, lambda: paste_tile(src, cols, rows), lambda: tile_image(src, cols, rows))
+            identical = expected.tobytes() == actual.tobytes()
+            path = 'numpy' if mode in _MAPPED_MODES else 'paste'
+            # Both columns run the same paste loop here; a ratio would be noise
+            if path == 'paste':
+                speedup = f"{'n/a':>10}"
+            else:
+                speedup = f"{paste_time / tiling_time if tiling_time else float('inf'):>9.1f}x"
+            print(f"{mode:<6}{f'{cols}x{rows}':<7}{paste_time:>12.3f}{tiling_time:>12.3f}{speedup}  {path:<8}{identical}")
+    print("RGB (every product tile) is tiled by the paste loop as before, so it gets no speedup here.")
+
+
+def make_pattern(size, mode):
+    """Smooth gradient pattern; compresses like real artwork rather than noise."""
+    yy, xx = np.mgrid[0:size, 0:size]
+    pixels = np.stack([(xx // 3) % 256, (yy // 2) % 256, ((xx + yy) // 5) % 256, 255 - (xx % 256)], axis=-1)
+    return Image.fromarray(pixels.astype(np.uint8), 'RGBA').convert(mode)
+
+
+def png_scanlines(path):
+    """Decompressed IDAT stream (filter bytes + filtered rows) of a PNG."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    pos, idat = 8, b''
+    while pos < len(data):
+        length, chunk_type = struct.unpack('>I4s', data[pos:pos + 8])
+        if chunk_type == b'IDAT':
+            idat += data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+    return zlib.decompress(idat)
+
+
+def bench_stream(args):
+    print(f"Streaming PNG benchmark: {args.size}x{args.size} source, {args.grid}x{args.grid} grid")
+    print(f"{'mode':<6}{'optimize':<10}{'in-memory (s)':>14}{'canvas MB':>11}{'stream (s)':>12}{'peak MB':>9}"
+          f"  pixels  scanlines  bytes")
+    mismatches = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ('L', 'LA', 'RGB', 'RGBA'):
+            src = make_pattern(args.size, mode)
+            src.load()
+            for optimize in (False, True):
+                expected_path = os.path.join(tmp, 'in_memory.png')
+                actual_path = os.path.join(tmp, 'streamed.png')
+
+                start = time.perf_counter()
+                tiled = tile_image(src, args.grid)
+                tiled.save(expected_path, optimize=optimize)
+                memory_time = time.perf_counter() - start
+                # Pillow keeps every mode but L at 4 bytes per pixel internally
+                canvas_mb = tiled.width * tiled.height * (1 if mode == 'L' else 4) / 1e6
+                del tiled
+
+                tracemalloc.start()
+                start = time.perf_counter()
+                write_tiled_png(src, actual_path, args.grid, optimize=optimize)
+                stream_time = time.perf_counter() - start
+                peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+                tracemalloc.stop()
+
+                with Image.open(expected_path) as a, Image.open(actual_path) as b:
+                    pixels = np.array_equal(np.asarray(a), np.asarray(b))
+                scanlines = png_scanlines(expected_path) == png_scanlines(actual_path)
+                with open(expected_path, 'rb') as a, open(actual_path, 'rb') as b:
+                    identical = a.read() == b.read()
+                mismatches += not identical
+                print(f"{mode:<6}{str(optimize):<10}{memory_time:>14.2f}{canvas_mb:>11.0f}{stream_time:>12.2f}"
+                      f"{peak_mb:>9.0f}  {str(pixels):<8}{str(scanlines):<11}{identical}")
+    if mismatches:
+        sys.exit(f"{mismatches} streamed PNGs differ from Image.save output")
+
+
+def bench_encode(args):
+    print(f"Encode profile benchmark: {args.size}x{args.size} pattern (bag tile cap), best of {args.repeat}")
+    print(f"{'profile':<11}{'grid':<6}{'mode':<6}{'save (s)':>10}{'size MB':>10}{'read (s)':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ('RGB', 'RGBA'):
+            src = (make_source if args.noise else make_pattern)(args.size, mode)
+            for n in (3, 4):
+                tiled = tile_image(src, n)
+                for name, profile in ENCODE_PROFILES.items():
+                    path = os.path.join(tmp, f"tile_{n}{profile['ext']}")
+                    save_time, _ = best_of(args.repeat, lambda: tiled.save(path, **profile['save']))
+                    size_mb = os.path.getsize(path) / 1e6
+                    read_time, _ = best_of(args.repeat, lambda: Image.open(path).load())
+                    print(f"{name:<11}{f'{n}x{n}':<6}{mode:<6}{save_time:>10.3f}{size_mb:>10.1f}{read_time:>10.3f}")
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def _downscale_once(method, path, max_dimension):
+    """One load + downscale in a fresh process; returns (seconds, RSS growth MB, pixels)."""
+    baseline = _peak_rss_mb()
+    start = time.perf_counter()
+    if method == 'full decode + LANCZOS':
+        img = Image.open(path)
+        img.load()
+        img = img.resize(_target_size(img.size, max_dimension), Image.Resampling.LANCZOS)
+    else:
+        img = load_at_size(path, max_dimension)
+    elapsed = time.perf_counter() - start
+    peak = _peak_rss_mb()
+    growth = peak - baseline if peak is not None else None
+    return elapsed, growth, np.asarray(img.convert('RGB'))
+
+
+def _psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def bench_downscale(args):
+    print(f"Downscale benchmark: {args.size}x{args.size * 3 // 4} source to a {args.cap}px cap")
+    print(f"{'format':<7}{'method':<24}{'time (s)':>10}{'peak MB':>9}{'PSNR dB':>9}")
+    methods = ('full decode + LANCZOS', 'load_at_size')
+    with tempfile.TemporaryDirectory() as tmp:
+        pattern = make_pattern(args.size, 'RGB').crop((0, 0, args.size, args.size * 3 // 4))
+        for fmt, ext in (('PNG', '.png'), ('JPEG', '.jpg')):
+            path = os.path.join(tmp, f"source{ext}")
+            pattern.save(path, quality=90) if fmt == 'JPEG' else pattern.save(path)
+            results = {}
+            for method in methods:
+                # A new process per run so the peak RSS belongs to this run alone
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    results[method] = pool.submit(_downscale_once, method, path, args.cap).result()
+            reference = results[methods[0]][2]
+            for method in methods:
+                elapsed, growth, pixels = results[method]
+                peak = f"{growth:.0f}" if growth is not None else 'n/a'
+                print(f"{fmt:<7}{method:<24}{elapsed:>10.3f}{peak:>9}{_psnr(reference, pixels):>9.1f}")
+    print("PSNR is against the full decode + LANCZOS result; above ~40 dB is visually identical.")
+
+
+def bench_sidecar(args):
+    Image.MAX_IMAGE_PIXELS = None  # as in the PDF generator; 6x6 tiles are large
+    print(f"Raster sidecar benchmark: {args.size}x{args.size} source")
+    print(f"{'file':<10}{'mode':<6}{'PNG decode (s)':>15}{'sidecar (s)':>13}{'sidecar MB':>12}  identical")
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ('RGB', 'RGBA'):
+            src = make_pattern(args.size, mode)
+            for label, grid in (('original', 1), (f'{args.grid}x{args.grid}', args.grid)):
+                path = os.path.join(tmp, f"{label}.png")
+                write_tiled_png(src, path, grid)
+                raster_sidecar.write_sidecar(path, src, grid, grid)
+
+                def decode_png():
+                    img = Image.open(path)
+                    img.load()
+                    return img
+                png_time, expected = best_of(1, decode_png)
+                sidecar_time, actual = best_of(1, raster_sidecar.load_sidecar, path)
+                identical = expected.tobytes() == actual.tobytes()
+                size_mb = os.path.getsize(raster_sidecar.sidecar_path(path)) / 1e6
+                print(f"{label:<10}{mode:<6}{png_time:>15.2f}{sidecar_time:>13.2f}{size_mb:>12.0f}  {identical}")
+                del expected, actual
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark image pipeline helpers.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    tiling = sub.add_parser('tiling', help="Paste loop vs NumPy tiling per grid size and mode.")
+    tiling.add_argument('--size', type=int, default=1000, help="Source tile edge in pixels.")
+    tiling.add_argument('--repeat', type=int, default=3, help="Runs per measurement (best is kept).")
+    tiling.set_defaults(func=bench_tiling)
+
+    stream = sub.add_parser('stream', help="In-memory canvas + save vs strip-streaming PNG writer; fails unless the bytes match.")
+    stream.add_argument('--size', type=int, default=1500, help="Source tile edge in pixels.")
+    stream.add_argument('--grid', type=int, default=6, help="Tiles per side.")
+    stream.set_defaults(func=bench_stream)
+
+    encode = sub.add_parser('encode', help="Save time and file size per encode profile.")
+    encode.add_argument('--size', type=int, default=1000, help="Source tile edge in pixels.")
+    encode.add_argument('--repeat', type=int, default=3, help="Runs per measurement (best is kept).")
+    encode.add_argument('--noise', action='store_true', help="Use a noise source (worst case for deflate).")
+    encode.set_defaults(func=bench_encode)
+
+    downscale = sub.add_parser('downscale', help="Full decode + LANCZOS vs load_at_size (draft + reduce).")
+    downscale.add_argument('--size', type=int, default=8000, help="Source width in pixels (height is 3/4 of it).")
+    downscale.add_argument('--cap', type=int, default=1000, help="Longest edge after downscaling.")
+    downscale.set_defaults(func=bench_downscale)
+
+    sidecar = sub.add_parser('sidecar', help="PNG decode vs raw raster sidecar load.")
+    sidecar.add_argument('--size', type=int, default=2000, help="Source tile edge in pixels.")
+    sidecar.add_argument('--grid', type=int, default=6, help="Tiles per side of the tiled file.")
+    sidecar.set_defaults(func=bench_sidecar)
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.func(args)
+    sys.exit(0)
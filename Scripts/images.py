@@ -1,10 +1,8 @@
 #!C:\Program Files\Python313\python.exe
 import os
 import requests
-from PIL import Image
 from datetime import datetime
 import subprocess
-import boto3
 from botocore.exceptions import NoCredentialsError
 import sys
 import json
@@ -16,61 +14,93 @@ import logging
 import tempfile
 from pathlib import Path
 from botocore.exceptions import ClientError
-from config import BASE_FOLDER, DOWNLOAD_BASE_FOLDER, OUTPUT_BASE_FOLDER, BUCKET_NAME
-import shutil
+from config import BASE_FOLDER, DOWNLOAD_BASE_FOLDER, OUTPUT_BASE_FOLDER, BUCKET_NAME, TILE_CACHE_FOLDER, TILE_CACHE_MAX_BYTES, INTERMEDIATE_ENCODE_PROFILE
+from config import TILING_WORKERS, TILING_WORKER_MAX_BYTES, RASTER_SIDECARS
+from config import DOWNLOAD_CONCURRENCY, DOWNLOAD_CONNECTIONS_PER_HOST, HTTP_CACHE_FOLDER, HTTP_CACHE_MAX_BYTES
+from config import PARTIAL_DOWNLOAD_FOLDER, DOWNLOAD_ATTEMPTS
+from config import KEEP_ORIGINAL_DOWNLOADS, LOOKUP_WORKERS, UPLOAD_WORKERS
+from config import AA_ID_CACHE_PATH, AA_ID_CACHE_TTL, AA_ID_CACHE_NEGATIVE_TTL
+from config import S3_OUTPUT_UPLOAD_WORKERS, S3_MULTIPART_THRESHOLD, S3_MULTIPART_CHUNKSIZE, S3_MAX_CONCURRENCY
+from config import SKIP_UNCHANGED_UPLOADS, S3_UPLOAD_MANIFEST, WATCH_OUTPUTS, OUTPUT_WATCH_INTERVAL, IMMUTABLE_S3_KEYS
 import re
 from bag_s3_uploader import upload_bag_files_to_s3
 from tissue_s3_uploader import upload_tissue_files_to_s3
 from tablerunner_s3_uploader import upload_tablerunner_files_to_s3  # NEW: Added table runner uploader import
+from output_index import classify, index_outputs
+from output_watcher import OutputWatcher
+from tiling import create_tile_set, product_tile_specs
+from tile_cache import hash_bytes, hash_file, link_or_copy
+from raster_sidecar import remove_sidecar, sidecar_path
+from tile_pool import default_workers, tile_pool
+from pipeline import SharedWork, Stage, run_pipeline
+from functools import partial
+import s3_publisher
+from downloader import fetch_bytes, get_session, normalize_url, verify_image
+import partial_download
+from shopify_client import ShopifyClient
+from shopify_lookup import fetch_aa_id, parse_aa_id, resolve_aa_ids
+from aa_id_cache import AaIdCache
 import traceback
 
-# Load environment variables
-load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
-
-# Initialize the boto3 S3 client using environment variables
-s3 = boto3.client(
-    's3',
-    aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-    region_name=os.getenv('AWS_REGION', 'us-east-2')
-)
-
-# Create dated subfolders (naming format: YYYY-MM-DD_HH-MM-SS)
-current_date = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-download_folder = os.path.join(DOWNLOAD_BASE_FOLDER, current_date)
-output_folder = os.path.join(OUTPUT_BASE_FOLDER, current_date)
-os.makedirs(download_folder, exist_ok=True)
-os.makedirs(output_folder, exist_ok=True)
-
-print(f"Download folder: {download_folder}")
-print(f"Output folder: {output_folder}")
-
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout)
-    ]
-)
-
 logger = logging.getLogger(__name__)
 
-# Load Shopify credentials from environment variables to avoid committing secrets
-SHOPIFY_API_KEY = os.getenv('SHOPIFY_API_KEY')
-SHOPIFY_PASSWORD = os.getenv('SHOPIFY_PASSWORD')
-SHOPIFY_STORE_NAME = os.getenv('SHOPIFY_STORE')
-SHOPIFY_API_VERSION = os.getenv('SHOPIFY_API_VERSION', '2025-01')  # Default to 2025-01
+# Multipart settings for the tile and Photoshop output uploads
+s3_transfer = s3_publisher.transfer_config(S3_MULTIPART_THRESHOLD, S3_MULTIPART_CHUNKSIZE, S3_MAX_CONCURRENCY)
+
+# Set by setup_run(): this run's folders, the AA id cache, the upload
+# manifest and the Shopify client
+current_date = download_folder = output_folder = None
+aa_id_cache = upload_manifest = shopify = None
+
+def setup_run():
+    """
+    Load the environment and create this run's folders, caches and Shopify
+    client.  Only the entry point calls this: tiling workers re-import this
+    module on Windows, and must neither register a second upload manifest
+    (whose atexit save would overwrite the parent's) nor start a run of their own.
+    """
+    global current_date, download_folder, output_folder, aa_id_cache, upload_manifest, shopify
+
+    # Load environment variables
+    load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+    # Set up logging
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+
+    # AA ids already looked up by this or an earlier run (see aa_id_cache.py)
+    aa_id_cache = AaIdCache(AA_ID_CACHE_PATH, AA_ID_CACHE_TTL, AA_ID_CACHE_NEGATIVE_TTL)
+
+    # Re-runs only upload files whose bytes changed (see upload_manifest.py)
+    upload_manifest = s3_publisher.enable_upload_manifest(S3_UPLOAD_MANIFEST) if SKIP_UNCHANGED_UPLOADS else None
 
-# Construct the base URL only if all variables are present
-if not all([SHOPIFY_API_KEY, SHOPIFY_PASSWORD, SHOPIFY_STORE_NAME]):
-    raise RuntimeError("Missing one or more required Shopify environment variables: SHOPIFY_API_KEY, SHOPIFY_PASSWORD, SHOPIFY_STORE")
+    # Create dated subfolders (naming format: YYYY-MM-DD_HH-MM-SS).
+    # AA_RUN_TIMESTAMP lets a caller pick the run folder.
+    current_date = os.environ.setdefault('AA_RUN_TIMESTAMP', datetime.now().strftime('%Y-%m-%d_%H-%M-%S'))
+    download_folder = os.path.join(DOWNLOAD_BASE_FOLDER, current_date)
+    output_folder = os.path.join(OUTPUT_BASE_FOLDER, current_date)
+    os.makedirs(download_folder, exist_ok=True)
+    os.makedirs(output_folder, exist_ok=True)
 
-SHOPIFY_API_BASE = f"https://{SHOPIFY_STORE_NAME}.myshopify.com/admin/api/{SHOPIFY_API_VERSION}"
-SHOPIFY_HEADERS = {
-    'X-Shopify-Access-Token': SHOPIFY_PASSWORD,
-    'Content-Type': 'application/json'
-}
+    print(f"Download folder: {download_folder}")
+    print(f"Output folder: {output_folder}")
+
+    # Load Shopify credentials from environment variables to avoid committing secrets
+    shopify_api_key = os.getenv('SHOPIFY_API_KEY')
+    shopify_password = os.getenv('SHOPIFY_PASSWORD')
+    shopify_store_name = os.getenv('SHOPIFY_STORE')
+    shopify_api_version = os.getenv('SHOPIFY_API_VERSION', '2025-01')  # Default to 2025-01
+
+    if not all([shopify_api_key, shopify_password, shopify_store_name]):
+        raise RuntimeError("Missing one or more required Shopify environment variables: SHOPIFY_API_KEY, SHOPIFY_PASSWORD, SHOPIFY_STORE")
+
+    # Pooled, rate-limited client for every Shopify call (see shopify_client.py)
+    shopify = ShopifyClient(shopify_store_name, shopify_password, shopify_api_version, pool_size=LOOKUP_WORKERS)
 
 # --------------------------------------------------------------
 # Helper: derive Shopify-style handle from a product name
@@ -156,32 +186,39 @@ def run_photoshop_jsx():
     finally:
         ensure_photoshop_closed()
 
-def download_and_tile_image(url, name, tile_size):
-    """Download and tile an image with proper error handling."""
+def download_image(url, name):
+    """
+    Download the source artwork and check that it is a readable image before
+    anything is written.  Returns the encoded bytes, or the path of the saved
+    original when KEEP_ORIGINAL_DOWNLOADS is set; None on failure.
+    """
     try:
         print(f"Downloading image from {url}")
-        response = requests.get(url, stream=True, timeout=30)
-        response.raise_for_status()
+        os.makedirs(PARTIAL_DOWNLOAD_FOLDER, exist_ok=True)
+        for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
+            try:
+                # Unchanged artwork is revalidated (ETag / Last-Modified) and
+                # served from the download cache instead of fetched again; a
+                # broken transfer resumes from the bytes kept at part_path
+                data = fetch_bytes(url, session=get_session(DOWNLOAD_CONNECTIONS_PER_HOST),
+                                   cache_dir=HTTP_CACHE_FOLDER, cache_max_bytes=HTTP_CACHE_MAX_BYTES,
+                                   part_path=partial_download.part_path_for(PARTIAL_DOWNLOAD_FOLDER, url))
+                break
+            except (requests.exceptions.RequestException, partial_download.ChecksumError) as e:
+                if attempt == DOWNLOAD_ATTEMPTS:
+                    raise
+                logging.warning(f"Download of {name} failed (attempt {attempt}/{DOWNLOAD_ATTEMPTS}), retrying: {e}")
+                time.sleep(attempt)
+        image_format, (width, height) = verify_image(data)
+        print(f"Downloaded {image_format} image {width}x{height} for {name}")
+        if not KEEP_ORIGINAL_DOWNLOADS:
+            return data
         
         image_path = os.path.join(download_folder, f"{name}.png")
         with open(image_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-                
+            f.write(data)
         print(f"Image saved to {image_path}")
-        
-        # Create tiled version
-        tiled_path = os.path.join(download_folder, f"{name}_{tile_size}.png")
-        original_image = Image.open(image_path)
-        width, height = original_image.size
-        tiled_image = Image.new('RGB', (width * tile_size, height * tile_size))
-        for i in range(tile_size):
-            for j in range(tile_size):
-                tiled_image.paste(original_image, (i * width, j * height))
-        tiled_image.save(tiled_path)
-        print(f"Tiled image saved to {tiled_path}")
-        
-        return tiled_path
+        return image_path
         
     except requests.exceptions.RequestException as e:
         logging.error(f"Error downloading image {name}: {e}")
@@ -190,224 +227,347 @@ def download_and_tile_image(url, name, tile_size):
         logging.error(f"Error processing image {name}: {e}")
         return None
 
+def link_tile_set(from_name, to_name, tile_size):
+    """
+    Give *to_name* the tiles (and sidecars) already built for *from_name*
+    from the same artwork, and return the path of its main tile.
+    """
+    sources = product_tile_specs(download_folder, from_name, tile_size, INTERMEDIATE_ENCODE_PROFILE)
+    targets = product_tile_specs(download_folder, to_name, tile_size, INTERMEDIATE_ENCODE_PROFILE)
+    for source, target in zip(sources, targets):
+        link_or_copy(source['path'], target['path'])
+        remove_sidecar(target['path'])
+        if os.path.exists(sidecar_path(source['path'])):
+            link_or_copy(sidecar_path(source['path']), sidecar_path(target['path']))
+    return targets[0]['path']
+
 def upload_to_s3_and_make_public(local_file, bucket_name, s3_key):
     """Upload file to S3 and set ACL to public-read."""
     try:
         print(f"Uploading {local_file} to S3 bucket {bucket_name}...")
-        extra_args = {'ACL': 'public-read', 'ContentType': 'image/png'}
-        s3.upload_file(local_file, bucket_name, s3_key, ExtraArgs=extra_args)
-        location = s3.get_bucket_location(Bucket=bucket_name)['LocationConstraint']
-        if location is None:
-            location = 'us-east-1'
-        # Append a unix timestamp query param so browsers always fetch the
-        # latest upload instead of serving a cached copy.
-        timestamp = int(datetime.now().timestamp())
-        url = f"https://{bucket_name}.s3-{location}.amazonaws.com/{s3_key}?v={timestamp}"
+        if IMMUTABLE_S3_KEYS:
+            # The URL changes with the content, so it can be cached for good
+            url = s3_publisher.upload_immutable(local_file, bucket_name, s3_key, content_type='image/png',
+                                                config=s3_transfer)
+        else:
+            url = s3_publisher.upload_file(local_file, bucket_name, s3_key, content_type='image/png', config=s3_transfer)
+            # Append a unix timestamp query param so browsers always fetch the
+            # latest upload instead of serving a cached copy.
+            timestamp = int(datetime.now().timestamp())
+            url = f"{url}?v={timestamp}"
         print(f"Uploaded to {url}")
         return url
     except Exception as e:
         print(f"Upload error: {e}")
         return None
 
-def upload_photoshop_outputs(output_folder, aa_id: str | None = None):
-    """Scan the Output folder for image files and upload them to S3."""
+# Photoshop output types published under wrappingpaper/new_uploads, in upload order
+PHOTOSHOP_OUTPUT_TYPES = ['hero', 'rolled', '011', '05-(2)', '04-(2)', 'bag1', 'bag2', 'bag3', 'tissue1', 'tissue2', 'tissue3', 'tablerunner1', 'tablerunner2', 'tablerunner3']
+
+def photoshop_output_key(file_name, aa_ids=None):
+    """S3 key of the Photoshop output *file_name* under new_uploads.
+    *aa_ids* maps the lower-cased handles of the batch to their AA ids."""
+    # --- Rename outputs when the original prefix is an AA ID ---
+    # The Photoshop output filenames are like '<prefix>_6_hero.png' or '<prefix>_6_011.png'.
+    # If <prefix> looks like an AA product ID (aa123456) we convert it to uppercase and
+    # remove the '_' before the tile size so the key becomes 'AA12345606_hero.png'.
+    prefix, rest = file_name.split('_6_', 1) if '_6_' in file_name else (None, None)
+
+    # A prefix that is the handle of a product with an AA id takes that
+    # product's id, otherwise we fall back to any AA-looking prefix
+    # already present in the file name.  If neither is available we keep
+    # the original name so legacy products continue to work.
+    chosen_aa = parse_aa_id((aa_ids or {}).get(prefix.lower())) if prefix else None
+    if not chosen_aa and prefix and prefix.lower().startswith('aa') and prefix[2:].isdigit():
+        chosen_aa = prefix.upper()
+
+    if chosen_aa and rest:
+        s3_file_name = f"{chosen_aa}06_{rest}"
+    else:
+        s3_file_name = file_name
+
+    return f"wrappingpaper/new_uploads/{s3_file_name}"
+
+def watch_photoshop_outputs(output_folder, aa_ids=None):
+    """Start uploading Photoshop outputs to their new_uploads keys as they
+    land in *output_folder*; stop() the returned watcher when the run is done."""
+    def key_for(path):
+        file_name = os.path.basename(path)
+        if classify(file_name) in PHOTOSHOP_OUTPUT_TYPES:
+            return photoshop_output_key(file_name, aa_ids)
+        return None
+
+    def upload(path, s3_key):
+        publish = s3_publisher.upload_immutable if IMMUTABLE_S3_KEYS else s3_publisher.upload_file
+        publish(path, BUCKET_NAME, s3_key, content_type='image/png', config=s3_transfer)
+
+    return OutputWatcher(output_folder, key_for, upload, S3_OUTPUT_UPLOAD_WORKERS, OUTPUT_WATCH_INTERVAL).start()
+
+def upload_photoshop_outputs(output_folder, aa_ids=None, manifest=None, published=None):
+    """Upload the Photoshop outputs in the Output folder to S3.
+
+    *aa_ids* maps lower-cased handles to AA ids (see photoshop_output_key).
+    *manifest* is the folder's output index (see output_index.py; scanned
+    here when not given).  *published* lists uploads already made by the
+    SKU uploaders (dicts with local_path, bucket and s3_key); those files
+    are copied to their new_uploads key inside S3 instead of sent again.
+    """
     uploaded_files = []
-    print(f"Scanning {output_folder} for output files...")
+    if manifest is None:
+        print(f"Scanning {output_folder} for output files...")
+        manifest = index_outputs(output_folder)
     
     # Define the order of image types for consistent processing
-    image_types = ['hero', 'rolled', '011', '05-(2)', '04-(2)', 'bag1', 'bag2', 'bag3', 'tissue1', 'tissue2', 'tissue3', 'tablerunner1', 'tablerunner2', 'tablerunner3']
+    image_types = PHOTOSHOP_OUTPUT_TYPES
+    files_by_type = {image_type: manifest.get(image_type, []) for image_type in image_types}
     
-    # First, collect all files and sort them by type
-    files_by_type = {type: [] for type in image_types}
-    for root, dirs, files in os.walk(output_folder):
-        for file in files:
-            if file.endswith(('.png', '.jpg', '.jpeg')):
-                # Determine the type of image
-                image_type = None
-                if '_6_hero.png' in file:
-                    image_type = 'hero'
-                elif '_rolled.png' in file:
-                    image_type = 'rolled'
-                elif '_011.png' in file:
-                    image_type = '011'
-                elif '_05-(2).png' in file:
-                    image_type = '05-(2)'
-                elif '_04-(2).png' in file:
-                    image_type = '04-(2)'
-                elif '_bag1.png' in file:
-                    image_type = 'bag1'
-                elif '_bag2.png' in file:
-                    image_type = 'bag2'
-                elif '_bag3.png' in file:
-                    image_type = 'bag3'
-                elif '_tissue1.png' in file:
-                    image_type = 'tissue1'
-                elif '_tissue2.png' in file:
-                    image_type = 'tissue2'
-                elif '_tissue3.png' in file:
-                    image_type = 'tissue3'
-                elif '_tablerunner1.png' in file:
-                    image_type = 'tablerunner1'
-                elif '_tablerunner2.png' in file:
-                    image_type = 'tablerunner2'
-                elif '_tablerunner3.png' in file:
-                    image_type = 'tablerunner3'
-                
-                if image_type:
-                    files_by_type[image_type].append(os.path.join(root, file))
+    # Where each file already is in S3, if one of the SKU uploaders sent it
+    in_s3 = {record['local_path']: (record['bucket'], record['s3_key'])
+             for record in published or [] if record.get('bucket')}
     
-    # Process files in the defined order
+    # Work out every S3 key first, in the defined order
+    planned = []
     for image_type in image_types:
         for file_path in files_by_type[image_type]:
             file_name = os.path.basename(file_path)
-            # --- Rename outputs when the original prefix is an AA ID ---
-            # The Photoshop output filenames are like '<prefix>_6_hero.png' or '<prefix>_6_011.png'.
-            # If <prefix> looks like an AA product ID (aa123456) we convert it to uppercase and
-            # remove the '_' before the tile size so the key becomes 'AA12345606_hero.png'.
-            prefix, rest = file_name.split('_6_', 1) if '_6_' in file_name else (None, None)
-
-            # If the caller provided an AA id we prefer that, otherwise we
-            # fall back to any AA-looking prefix already present in the file
-            # name.  If neither is available we keep the original name so
-            # legacy products continue to work.
-
-            chosen_aa = None
-            if aa_id and aa_id.upper().startswith('AA') and aa_id[2:].isdigit():
-                chosen_aa = aa_id.upper()
-            elif prefix and prefix.lower().startswith('aa') and prefix[2:].isdigit():
-                chosen_aa = prefix.upper()
-
-            if chosen_aa and rest:
-                s3_file_name = f"{chosen_aa}06_{rest}"
-            else:
-                s3_file_name = file_name
-
-            s3_key = f"wrappingpaper/new_uploads/{s3_file_name}"
-            uploaded_url = upload_to_s3_and_make_public(file_path, BUCKET_NAME, s3_key)
-            if uploaded_url:
-                uploaded_files.append({
-                    "file": file_name,
-                    "url": uploaded_url,
-                    "type": "photoshop_output",
-                    "image_type": image_type  # Add image type to the output
-                })
+            planned.append((file_path, file_name, image_type, photoshop_output_key(file_name, aa_ids)))
+
+    # Upload in parallel.  When several files map to the same key only the
+    # last one is sent, which is what the one-at-a-time loop left in S3.
+    last_file = {s3_key: file_path for file_path, _, _, s3_key in planned}
+    keys = list(last_file)
+    urls = s3_publisher.upload_many([(last_file[key], BUCKET_NAME, key, in_s3.get(last_file[key])) for key in keys],
+                                    S3_OUTPUT_UPLOAD_WORKERS, s3_transfer, immutable=IMMUTABLE_S3_KEYS)
+    url_for_key = dict(zip(keys, urls))
+
+    # Same cache-busting query parameter as upload_to_s3_and_make_public
+    # (content-hashed URLs need none)
+    version = "" if IMMUTABLE_S3_KEYS else f"?v={int(datetime.now().timestamp())}"
+    for file_path, file_name, image_type, s3_key in planned:
+        if url_for_key[s3_key]:
+            uploaded_files.append({
+                "file": file_name,
+                "url": f"{url_for_key[s3_key]}{version}",
+                "type": "photoshop_output",
+                "image_type": image_type  # Add image type to the output
+            })
     
     return uploaded_files
 
 def fetch_aa_id_from_shopify(product_handle: str) -> str | None:
     """Return AA product ID (basesku metafield) for a Shopify product handle, or None."""
+    # Network issues should not break the whole pipeline – the cache logs
+    # them and gives None
+    return aa_id_cache.lookup(product_handle,
+                              lambda handle: fetch_aa_id(shopify, handle))
+
+# --------------------------------------------------------------
+# Per-row pipeline stages used by process_images().  Each takes the job
+# dict from the stage before and returns it (or None to drop the row,
+# after logging why).
+# --------------------------------------------------------------
+
+def resolve_row(aa_ids, entry):
+    """Validate a CSV row and work out its handle and base SKU.  *aa_ids* is
+    the batch's handle -> AA id map (see shopify_lookup.py); handles missing
+    from it are looked up on their own."""
+    index, row = entry
+    if not row or len(row) < 2:
+        logging.warning(f"Skipping line {index}: insufficient data {row}")
+        return None
+    
+    url = row[0].strip()
+    raw_sku = row[1].strip()
+
+    # --------------------------------------------------------------
+    # ALWAYS use a consistent, shop-style handle for *both* `handle`
+    # and `base_sku` so every run of the same product name produces
+    # identical filenames and S3 keys (e.g. "afinaltesting_6_hero.png").
+    # --------------------------------------------------------------
+
+    handle = derive_handle(raw_sku)
+
+    # ----------------------------------------------------------
+    # Attempt to fetch the previously-stored AA product id for
+    # this pattern from Shopify.  If we find one it will become
+    # the authoritative *base_sku* value for the remainder of
+    # the pipeline (metafield update, S3 filenames, etc.).
+    # ----------------------------------------------------------
+
+    aa_id = aa_ids[handle] if handle in aa_ids else fetch_aa_id_from_shopify(handle)
+
+    # If Shopify returned something that looks like a valid AA id
+    # ("AA" followed by 6 digits) we use that.  Otherwise we fall
+    # back to the kebab-case handle which preserves legacy
+    # behaviour for products that do not yet have an AA id.
+    if aa_id:
+        base_sku = aa_id
+    else:
+        base_sku = handle
+
+    logging.info(f"Processing image {index}: URL = {url}, Raw SKU = '{raw_sku}', Base SKU = '{base_sku}'")
+    return {'index': index, 'url': url, 'source_key': normalize_url(url),
+            'raw_sku': raw_sku, 'handle': handle, 'base_sku': base_sku}
+
+def fetch_source(url, name):
+    """Download one source and hash its content; returns (source, hash) or None."""
+    source = download_image(url, name)
+    if source is None:
+        return None
+    return source, hash_file(source) if isinstance(source, str) else hash_bytes(source)
+
+def download_row(downloads, job):
+    """Download the artwork under the existing pipeline handle so downstream
+    processes (Photoshop, Illustrator, etc.) continue to work unchanged.
+    Rows listing the same URL share a single download."""
+    shared, owner = downloads.run(job['source_key'], fetch_source, job['url'], job['handle'])
+    if shared is None:
+        if not owner:
+            logging.error(f"Error downloading image {job['handle']}: shared download of {job['url']} failed")
+        return None
+    job['source'], job['source_hash'] = shared
+    if not owner:
+        logging.info(f"Reusing download of {job['url']} for {job['handle']}")
+        if isinstance(job['source'], str):
+            link_or_copy(job['source'], os.path.join(download_folder, f"{job['handle']}.png"))
+    return job
+
+def tile_source(pool, source, source_hash, name):
+    """
+    Write every tile a product needs from its downloaded original (a path or
+    the encoded bytes) in a tiling worker; returns (main tile path, name).
+    """
+    # Decode once and write every grid this product needs: the main tile
+    # plus the 3x3/4x4 bag tiles that bag_processor.py would otherwise
+    # rebuild from the same original after Photoshop finishes.  Tiles for
+    # artwork we have processed before come straight from the tile cache.
+    # With RASTER_SIDECARS the main tile (and a saved original) also get a
+    # raw pixel sidecar that bag_processor.py and the PDF generator map directly.
+    # The worker runs tiling.create_tile_set, so nothing of this module runs there.
+    specs = product_tile_specs(download_folder, name, 6, INTERMEDIATE_ENCODE_PROFILE)
+    specs[0]['sidecar'] = RASTER_SIDECARS
+    tiled_path = pool.submit(
+        create_tile_set,
+        source,
+        specs,
+        cache_dir=TILE_CACHE_FOLDER,
+        cache_max_bytes=TILE_CACHE_MAX_BYTES,
+        source_hash=source_hash,
+        source_sidecar=RASTER_SIDECARS,
+    ).result()[0]
+    print(f"Tiled image saved to {tiled_path}")
+    return tiled_path, name
+
+def tile_row(pool, tiles, job):
+    """Build the product's tiles in a tiling worker process.  Rows whose
+    artwork has the same content are tiled once and get links to those tiles."""
     try:
-        url = f"{SHOPIFY_API_BASE}/products.json?handle={product_handle}"
-        resp = requests.get(url, headers=SHOPIFY_HEADERS, timeout=15)
-        resp.raise_for_status()
-        products = resp.json().get('products', [])
-        if not products:
-            return None
-        product_id = products[0]['id']
-        metafields_url = f"{SHOPIFY_API_BASE}/products/{product_id}/metafields.json"
-        mf_resp = requests.get(metafields_url, headers=SHOPIFY_HEADERS, timeout=15)
-        mf_resp.raise_for_status()
-        for mf in mf_resp.json().get('metafields', []):
-            if mf.get('namespace') == 'custom' and mf.get('key') in ('basesku', 'base_sku'):
-                val = mf.get('value', '').strip().upper()
-                if val.startswith('AA') and val[2:].isdigit():
-                    return val
+        source_hash = job.pop('source_hash')
+        (tiled_path, tiled_name), owner = tiles.run(
+            source_hash, tile_source, pool, job.pop('source'), source_hash, job['handle'])
+        if not owner:
+            logging.info(f"Reusing tiles of {tiled_name} for {job['handle']}")
+        job['image_path'] = tiled_path if owner else link_tile_set(tiled_name, job['handle'], 6)
+        return job
+    except Exception as e:
+        logging.error(f"Error processing image {job['handle']}: {e}")
         return None
-    except Exception as _e:
-        # Network issues should not break the whole pipeline – just ignore
+
+def upload_row(job):
+    """Create the base-SKU copy and upload the main tile; returns the product record."""
+    raw_sku, handle, base_sku, image_path = job['raw_sku'], job['handle'], job['base_sku'], job['image_path']
+    try:
+        # Duplicate the tiled image so that a copy exists on disk using the base SKU name
+        # (e.g. ABC_6.png). This satisfies the new requirement without disrupting the
+        # existing naming convention that other scripts rely on.
+        try:
+            # Keep base-SKU copies in a separate folder so they are not picked up by downstream
+            # Photoshop processing (which scans only the top-level of the Download folder).
+            base_dir = os.path.join(os.path.dirname(image_path), "tiles_by_sku")
+            os.makedirs(base_dir, exist_ok=True)
+            base_tiled_path = os.path.join(base_dir, f"{handle}_6.png")
+            if not os.path.exists(base_tiled_path):
+                link_or_copy(image_path, base_tiled_path)
+                logging.info(f"Created base SKU copy: {base_tiled_path}")
+        except Exception as copy_err:
+            logging.warning(f"Could not create base SKU copy for {raw_sku}: {copy_err}")
+
+        formatted_tile = f"{6:02d}"
+        if base_sku.startswith('AA') and len(base_sku) >= 8 and base_sku[2:].isdigit():
+            # Use the AA product id directly, ensure it stays uppercase in the key
+            s3_filename = f"{base_sku}{formatted_tile}.png"
+        else:
+            # Fallback to the previous handle logic (kebab-case name with _6)
+            s3_filename = f"{handle}_{6}.png"
+
+        s3_key = f"wrappingpaper/new_uploads/{s3_filename}"
+        uploaded_url = upload_to_s3_and_make_public(image_path, BUCKET_NAME, s3_key)
+
+        if not uploaded_url:
+            return None
+        return {
+            "name": raw_sku,
+            "handle": handle,  # Shopify/product handle
+            "base_sku": base_sku,
+            "s3_url": uploaded_url
+        }
+    except Exception as e:
+        logging.error(f"Error processing {raw_sku}: {e}")
         return None
 
 def process_images(csv_data):
     """Process images with improved error handling and logging."""
     try:
         csv_data = csv_data.replace('\\n', '\n')
-        csv_reader = csv.reader(io.StringIO(csv_data))
-        processed_products = []
-        
-        for index, row in enumerate(csv_reader, start=1):
-            if not row or len(row) < 2:
-                logging.warning(f"Skipping line {index}: insufficient data {row}")
-                continue
-                
-            url = row[0].strip()
-            raw_sku = row[1].strip()
-
-            # --------------------------------------------------------------
-            # ALWAYS use a consistent, shop-style handle for *both* `handle`
-            # and `base_sku` so every run of the same product name produces
-            # identical filenames and S3 keys (e.g. "afinaltesting_6_hero.png").
-            # --------------------------------------------------------------
-
-            handle = derive_handle(raw_sku)
-
-            # ----------------------------------------------------------
-            # Attempt to fetch the previously-stored AA product id for
-            # this pattern from Shopify.  If we find one it will become
-            # the authoritative *base_sku* value for the remainder of
-            # the pipeline (metafield update, S3 filenames, etc.).
-            # ----------------------------------------------------------
-
-            aa_id = fetch_aa_id_from_shopify(handle)
+        rows = list(csv.reader(io.StringIO(csv_data)))
+
+        # The same artwork is often listed under several product names.  Each
+        # distinct URL is downloaded once, and each distinct image (by content
+        # hash, so different URLs serving the same file count too) is tiled
+        # once; every other row gets links to those files under its own name.
+        partial_download.prune(PARTIAL_DOWNLOAD_FOLDER)
+        downloads = SharedWork('download')
+        tiles = SharedWork('tile')
+        for row in rows:
+            if row and len(row) >= 2:
+                downloads.expect(normalize_url(row[0]))
+
+        # Every row's AA id from the cache, the rest in a few bulk queries
+        # instead of two requests per row
+        handles = [derive_handle(row[1].strip()) for row in rows if row and len(row) >= 2]
+        aa_ids = aa_id_cache.get_many(handles)
+        fetched = resolve_aa_ids(shopify, [handle for handle in handles if handle not in aa_ids])
+        aa_id_cache.put_many(fetched)
+        aa_ids.update(fetched)
+
+        # Rows flow through lookup -> download -> tile -> upload stages joined
+        # by bounded queues, so the network and CPU work overlap; products
+        # come back in CSV order.
+        with tile_pool(TILING_WORKERS, TILING_WORKER_MAX_BYTES) as pool:
+            stages = [
+                Stage('lookup', partial(resolve_row, aa_ids), LOOKUP_WORKERS),
+                Stage('download', partial(download_row, downloads), DOWNLOAD_CONCURRENCY),
+                Stage('tile', partial(tile_row, pool, tiles), TILING_WORKERS or default_workers()),
+                Stage('upload', upload_row, UPLOAD_WORKERS),
+            ]
+            processed_products = run_pipeline(enumerate(rows, start=1), stages)
+        downloads.log_stats()
+        tiles.log_stats()
+        shopify.log_stats()
 
-            # If Shopify returned something that looks like a valid AA id
-            # ("AA" followed by 6 digits) we use that.  Otherwise we fall
-            # back to the kebab-case handle which preserves legacy
-            # behaviour for products that do not yet have an AA id.
-            if aa_id:
-                base_sku = aa_id
-            else:
-                base_sku = handle
-
-            logging.info(f"Processing image {index}: URL = {url}, Raw SKU = '{raw_sku}', Base SKU = '{base_sku}'")
-            
-            try:
-                # First, create the tiled image using the existing pipeline handle so downstream
-                # processes (Photoshop, Illustrator, etc.) continue to work unchanged.
-                image_path = download_and_tile_image(url, handle, 6)
-                if not image_path:
-                    continue
-                    
-                # Duplicate the tiled image so that a copy exists on disk using the base SKU name
-                # (e.g. ABC_6.png). This satisfies the new requirement without disrupting the
-                # existing naming convention that other scripts rely on.
-                try:
-                    # Keep base-SKU copies in a separate folder so they are not picked up by downstream
-                    # Photoshop processing (which scans only the top-level of the Download folder).
-                    base_dir = os.path.join(os.path.dirname(image_path), "tiles_by_sku")
-                    os.makedirs(base_dir, exist_ok=True)
-                    base_tiled_path = os.path.join(base_dir, f"{handle}_6.png")
-                    if not os.path.exists(base_tiled_path):
-                        shutil.copy2(image_path, base_tiled_path)
-                        logging.info(f"Created base SKU copy: {base_tiled_path}")
-                except Exception as copy_err:
-                    logging.warning(f"Could not create base SKU copy for {raw_sku}: {copy_err}")
-                    
-                formatted_tile = f"{6:02d}"
-                if base_sku.startswith('AA') and len(base_sku) >= 8 and base_sku[2:].isdigit():
-                    # Use the AA product id directly, ensure it stays uppercase in the key
-                    s3_filename = f"{base_sku}{formatted_tile}.png"
-                else:
-                    # Fallback to the previous handle logic (kebab-case name with _6)
-                    s3_filename = f"{handle}_{6}.png"
-
-                s3_key = f"wrappingpaper/new_uploads/{s3_filename}"
-                uploaded_url = upload_to_s3_and_make_public(image_path, BUCKET_NAME, s3_key)
-                
-                if uploaded_url:
-                    processed_products.append({
-                        "name": raw_sku,
-                        "handle": handle,  # Shopify/product handle
-                        "base_sku": base_sku,
-                        "s3_url": uploaded_url
-                    })
-                    
-            except Exception as e:
-                logging.error(f"Error processing {raw_sku}: {e}")
-                continue
-        
         if not processed_products:
             logging.error("No products were successfully processed")
             return
+
+        # Each Photoshop output is uploaded under the AA id of the product
+        # whose handle its file name starts with
+        aa_ids_by_handle = {product['handle'].lower(): product['base_sku'] for product in processed_products
+                            if parse_aa_id(product['base_sku'])}
+
+        # Upload the outputs while Photoshop and the processors are still
+        # producing the rest; the end-of-run upload then finds them in the
+        # upload manifest and only confirms them
+        watcher = watch_photoshop_outputs(output_folder, aa_ids_by_handle) if WATCH_OUTPUTS and upload_manifest else None
             
         logging.info("Starting Photoshop JSX processing...")
         photoshop_ok = run_photoshop_jsx()
@@ -422,6 +582,10 @@ def process_images(csv_data):
             # *_bag3.png files in the same Output/<ts> directory).
             # ----------------------------------------------------------
 
+            # The SKU uploads run once every processor has finished (see below)
+            bags_ready = tissues_ready = tablerunners_ready = False
+            bag_uploads, tissue_uploads, tablerunner_uploads = [], [], []
+
             try:
                 logging.info("Starting bag processing…")
                 bag_processor_path = os.path.join(os.path.dirname(__file__), "bag_processor.py")
@@ -435,36 +599,7 @@ def process_images(csv_data):
                         if result.stdout:
                             logging.debug(result.stdout)
                             
-                        # Upload bag files to S3 with SKU naming convention
-                        logging.info("Starting bag file upload to S3...")
-                        try:
-                            # Pass the products data so we can use the Shopify SKUs
-                            bag_uploads = upload_bag_files_to_s3(output_folder, processed_products)
-                            
-                            if bag_uploads:
-                                logging.info(f"Successfully uploaded {len(bag_uploads)} bag files to S3")
-                                
-                                # Log the SKUs for reference
-                                for upload in bag_uploads:
-                                    logging.info(f"Uploaded bag: {upload['sku']} -> {upload['public_url']}")
-                                    
-                                # Add bag upload info to processed products for tracking
-                                for upload in bag_uploads:
-                                    processed_products.append({
-                                        "file": upload['original_file'],
-                                        "url": upload['public_url'],
-                                        "type": "bag_output",
-                                        "sku": upload['sku'],
-                                        "base_sku": upload['base_sku'],
-                                        "bag_type": upload['bag_type'],
-                                        "product_name": upload['product_name']
-                                    })
-                            else:
-                                logging.warning("No bag files were uploaded to S3")
-                                
-                        except Exception as upload_error:
-                            logging.error(f"Error uploading bag files to S3: {upload_error}")
-                            # Don't fail the entire process if bag upload fails
+                        bags_ready = True
                             
                     else:
                         logging.error(f"Bag processor exited with code {result.returncode}")
@@ -489,35 +624,7 @@ def process_images(csv_data):
                         if result.returncode == 0:
                             logger.info("Tissue processing completed successfully")
                             
-                            # Upload tissue files to S3 with SKUs
-                            logger.info("Starting tissue file upload to S3...")
-                            try:
-                                # Pass the products data so we can use the Shopify SKUs
-                                tissue_uploads = upload_tissue_files_to_s3(output_folder, processed_products)
-                                
-                                if tissue_uploads:
-                                    logger.info(f"Successfully uploaded {len(tissue_uploads)} tissue files to S3")
-                                    
-                                    # Log the SKUs for reference
-                                    for upload in tissue_uploads:
-                                        logger.info(f"Uploaded tissue: {upload['sku']} -> {upload['public_url']}")
-                                        
-                                    # Add tissue upload info to processed products for tracking
-                                    for upload in tissue_uploads:
-                                        processed_products.append({
-                                            "file": upload['original_file'],
-                                            "url": upload['public_url'],
-                                            "type": "tissue_output",
-                                            "sku": upload['sku'],
-                                            "base_sku": upload['base_sku'],
-                                            "tissue_type": upload.get('tissue_type', 'unknown'),
-                                            "product_name": upload['product_name']
-                                        })
-                                else:
-                                    logger.warning("No tissue files were uploaded to S3")
-                                    
-                            except Exception as upload_error:
-                                logger.error(f"Error uploading tissue files to S3: {upload_error}")
+                            tissues_ready = True
                         
                         else:
                             logger.error(f"Tissue processing failed with return code {result.returncode}")
@@ -546,35 +653,7 @@ def process_images(csv_data):
                         if result.returncode == 0:
                             logger.info("Table runner processing completed successfully")
                             
-                            # Upload table runner files to S3 with SKUs
-                            logger.info("Starting table runner file upload to S3...")
-                            try:
-                                # Pass the products data so we can use the Shopify SKUs
-                                tablerunner_uploads = upload_tablerunner_files_to_s3(output_folder, processed_products)
-                                
-                                if tablerunner_uploads:
-                                    logger.info(f"Successfully uploaded {len(tablerunner_uploads)} table runner files to S3")
-                                    
-                                    # Log the SKUs for reference
-                                    for upload in tablerunner_uploads:
-                                        logger.info(f"Uploaded table runner: {upload['sku']} -> {upload['public_url']}")
-                                        
-                                    # Add table runner upload info to processed products for tracking
-                                    for upload in tablerunner_uploads:
-                                        processed_products.append({
-                                            "file": upload['original_file'],
-                                            "url": upload['public_url'],
-                                            "type": "tablerunner_output",
-                                            "sku": upload['sku'],
-                                            "base_sku": upload['base_sku'],
-                                            "tablerunner_type": upload.get('tablerunner_type', 'unknown'),
-                                            "product_name": upload['product_name']
-                                        })
-                                else:
-                                    logger.warning("No table runner files were uploaded to S3")
-                                    
-                            except Exception as upload_error:
-                                logger.error(f"Error uploading table runner files to S3: {upload_error}")
+                            tablerunners_ready = True
                         
                         else:
                             logger.error(f"Table runner processing failed with return code {result.returncode}")
@@ -588,11 +667,115 @@ def process_images(csv_data):
                     logger.error(f"Error in table runner processing: {e}")
                     # Don't fail the entire process if table runner processing fails
 
+                if watcher:
+                    watcher.stop()
+
+                # Every processor has run: index the Output folder once and
+                # upload from that manifest.  Files the SKU uploaders send
+                # are copied server-side for the new_uploads set below.
+                outputs = index_outputs(output_folder)
+
+                if bags_ready:
+                    # Upload bag files to S3 with SKU naming convention
+                    logging.info("Starting bag file upload to S3...")
+                    try:
+                        # Pass the products data so we can use the Shopify SKUs
+                        bag_uploads = upload_bag_files_to_s3(output_folder, processed_products, manifest=outputs)
+
+                        if bag_uploads:
+                            logging.info(f"Successfully uploaded {len(bag_uploads)} bag files to S3")
+
+                            # Log the SKUs for reference
+                            for upload in bag_uploads:
+                                logging.info(f"Uploaded bag: {upload['sku']} -> {upload['public_url']}")
+
+                            # Add bag upload info to processed products for tracking
+                            for upload in bag_uploads:
+                                processed_products.append({
+                                    "file": upload['original_file'],
+                                    "url": upload['public_url'],
+                                    "type": "bag_output",
+                                    "sku": upload['sku'],
+                                    "base_sku": upload['base_sku'],
+                                    "bag_type": upload['bag_type'],
+                                    "product_name": upload['product_name']
+                                })
+                        else:
+                            logging.warning("No bag files were uploaded to S3")
+
+                    except Exception as upload_error:
+                        logging.error(f"Error uploading bag files to S3: {upload_error}")
+                        # Don't fail the entire process if bag upload fails
+
+                if tissues_ready:
+                    # Upload tissue files to S3 with SKUs
+                    logger.info("Starting tissue file upload to S3...")
+                    try:
+                        # Pass the products data so we can use the Shopify SKUs
+                        tissue_uploads = upload_tissue_files_to_s3(output_folder, processed_products, manifest=outputs)
+
+                        if tissue_uploads:
+                            logger.info(f"Successfully uploaded {len(tissue_uploads)} tissue files to S3")
+
+                            # Log the SKUs for reference
+                            for upload in tissue_uploads:
+                                logger.info(f"Uploaded tissue: {upload['sku']} -> {upload['public_url']}")
+
+                            # Add tissue upload info to processed products for tracking
+                            for upload in tissue_uploads:
+                                processed_products.append({
+                                    "file": upload['original_file'],
+                                    "url": upload['public_url'],
+                                    "type": "tissue_output",
+                                    "sku": upload['sku'],
+                                    "base_sku": upload['base_sku'],
+                                    "tissue_type": upload.get('tissue_type', 'unknown'),
+                                    "product_name": upload['product_name']
+                                })
+                        else:
+                            logger.warning("No tissue files were uploaded to S3")
+
+                    except Exception as upload_error:
+                        logger.error(f"Error uploading tissue files to S3: {upload_error}")
+
+                if tablerunners_ready:
+                    # Upload table runner files to S3 with SKUs
+                    logger.info("Starting table runner file upload to S3...")
+                    try:
+                        # Pass the products data so we can use the Shopify SKUs
+                        tablerunner_uploads = upload_tablerunner_files_to_s3(output_folder, processed_products, manifest=outputs)
+
+                        if tablerunner_uploads:
+                            logger.info(f"Successfully uploaded {len(tablerunner_uploads)} table runner files to S3")
+
+                            # Log the SKUs for reference
+                            for upload in tablerunner_uploads:
+                                logger.info(f"Uploaded table runner: {upload['sku']} -> {upload['public_url']}")
+
+                            # Add table runner upload info to processed products for tracking
+                            for upload in tablerunner_uploads:
+                                processed_products.append({
+                                    "file": upload['original_file'],
+                                    "url": upload['public_url'],
+                                    "type": "tablerunner_output",
+                                    "sku": upload['sku'],
+                                    "base_sku": upload['base_sku'],
+                                    "tablerunner_type": upload.get('tablerunner_type', 'unknown'),
+                                    "product_name": upload['product_name']
+                                })
+                        else:
+                            logger.warning("No table runner files were uploaded to S3")
+
+                    except Exception as upload_error:
+                        logger.error(f"Error uploading table runner files to S3: {upload_error}")
+
                 # After all Photoshop work (regular + (attempted) bags + tissue + table runners) is done,
                 # upload every PNG once so there are no duplicates.
                 all_outputs = upload_photoshop_outputs(
                     output_folder,
-                    aa_id=base_sku if base_sku.startswith('AA') else None
+                    aa_ids=aa_ids_by_handle,
+                    manifest=outputs,
+                    published=bag_uploads + tissue_uploads + tablerunner_uploads
                 )
                 processed_products.extend(all_outputs)
 
@@ -601,6 +784,11 @@ def process_images(csv_data):
             except Exception as bag_err:
                 logging.error(f"Unexpected error while running bag processor: {bag_err}")
 
+        if watcher:
+            watcher.stop()
+        if upload_manifest:
+            logger.info(upload_manifest.summary())
+
         # Create CSV file list
         csv_path = os.path.join(BASE_FOLDER, 'printpanels', 'csv', 'meta_file_list.csv')
         os.makedirs(os.path.dirname(csv_path), exist_ok=True)
@@ -637,6 +825,7 @@ if __name__ == "__main__":
             print("Usage: python images.py <csv_data>")
             sys.exit(1)
             
+        setup_run()
         process_images(sys.argv[1])
         
     except Exception as e:
@@ -0,0 +1,57 @@
+"""
+One pass over a run's Output folder.
+
+The S3 uploaders used to walk the folder separately, each picking out its
+own files by suffix.  index_outputs() walks it once and sorts every output
+into a typed manifest that they all share.
+"""
+
+import os
+
+# Output types in upload order, with the file-name suffix that identifies each
+OUTPUT_TYPES = [
+    ('hero', '_6_hero.png'),
+    ('rolled', '_rolled.png'),
+    ('011', '_011.png'),
+    ('05-(2)', '_05-(2).png'),
+    ('04-(2)', '_04-(2).png'),
+    *[(f'bag{n}', f'_bag{n}.png') for n in range(1, 8)],
+    *[(f'tissue{n}', f'_tissue{n}.png') for n in range(1, 4)],
+    *[(f'tablerunner{n}', f'_tablerunner{n}.png') for n in range(1, 4)],
+]
+
+BAG_TYPES = [f'bag{n}' for n in range(1, 8)]
+TISSUE_TYPES = [f'tissue{n}' for n in range(1, 4)]
+TABLERUNNER_TYPES = [f'tablerunner{n}' for n in range(1, 4)]
+
+
+def classify(filename):
+    """Output type of *filename*, or None if it is not a known output."""
+    for output_type, suffix in OUTPUT_TYPES:
+        if filename.endswith(suffix):
+            return output_type
+    return None
+
+
+def index_outputs(output_folder):
+    """
+    Walk *output_folder* once and group its outputs by type.
+
+    Returns:
+        Dict of output type -> sorted list of file paths, with an entry
+        (possibly empty) for every type in OUTPUT_TYPES
+    """
+    manifest = {output_type: [] for output_type, _ in OUTPUT_TYPES}
+    for root, _, files in os.walk(output_folder):
+        for file in files:
+            output_type = classify(file)
+            if output_type:
+                manifest[output_type].append(os.path.join(root, file))
+    for paths in manifest.values():
+        paths.sort()
+    return manifest
+
+
+def files_of(manifest, output_types):
+    """Paths of the given types from *manifest*, in type order."""
+    return [path for output_type in output_types for path in manifest.get(output_type, [])]
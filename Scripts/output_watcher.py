@@ -0,0 +1,101 @@
+"""
+Upload outputs while the run is still producing them.
+
+Photoshop and the bag / tissue / table runner processors run one after the
+other for most of a run, and the uploads used to start only after all of
+them.  OutputWatcher polls the run's Output folder from a background thread
+and hands each output file to an upload function as soon as it has stopped
+changing (same size and modification time over consecutive polls), so the
+upload bandwidth is used while the processors work.
+
+Polling rather than OS change notifications keeps this dependency-free and
+works the same on local disks and network shares; a poll of a run folder is
+a few dozen stat calls.
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 2.0
+DEFAULT_STABLE_POLLS = 2
+
+
+class OutputWatcher:
+    """
+    Watch *folder* and call upload(path, key) for every file key_for(path)
+    gives a key, once the file is stable.  A file that changes after being
+    uploaded is uploaded again.
+    """
+
+    def __init__(self, folder, key_for, upload, workers=4, interval=DEFAULT_INTERVAL,
+                 stable_polls=DEFAULT_STABLE_POLLS):
+        self.folder = folder
+        self.key_for = key_for
+        self.upload = upload
+        self.interval = interval
+        self.stable_polls = stable_polls
+        self.uploaded = 0
+        self.failed = 0
+        self._seen = {}       # path -> (size, mtime, polls unchanged)
+        self._submitted = {}  # path -> (size, mtime) handed to upload
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='watch-upload')
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='output-watcher', daemon=True)
+        self._lock = threading.Lock()
+
+    def start(self):
+        logger.info(f"Watching {self.folder} for finished outputs")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Poll one last time, then wait for the uploads in flight.  Calling
+        it again does nothing."""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join()
+        self._poll()
+        self._executor.shutdown(wait=True)
+        logger.info(f"Output watcher uploaded {self.uploaded} files while the run was working"
+                    + (f", {self.failed} failed" if self.failed else ""))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self._poll()
+            except Exception as e:
+                logger.warning(f"Output watcher poll failed: {e}")
+
+    def _poll(self):
+        for root, _, files in os.walk(self.folder):
+            for file in files:
+                path = os.path.join(root, file)
+                key = self.key_for(path)
+                if not key:
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                state = (stat.st_size, stat.st_mtime)
+                size, mtime, polls = self._seen.get(path, (None, None, 0))
+                polls = polls + 1 if (size, mtime) == state else 0
+                self._seen[path] = (*state, polls)
+                if polls >= self.stable_polls and stat.st_size and self._submitted.get(path) != state:
+                    self._submitted[path] = state
+                    self._executor.submit(self._upload, path, key)
+
+    def _upload(self, path, key):
+        try:
+            self.upload(path, key)
+            with self._lock:
+                self.uploaded += 1
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            logger.error(f"Output watcher could not upload {path}: {e}")
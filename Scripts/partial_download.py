@@ -0,0 +1,257 @@
+"""
+Resumable response bodies for large artwork downloads.
+
+Bodies are read into memory.  When the stream breaks part-way (read timeout,
+dropped connection) the download continues with an HTTP Range request from
+the last byte received, guarded by If-Range so a file that changed on the
+server starts over instead of being spliced.  If it still cannot finish, the
+bytes received so far are kept in ``<file>.part`` (validators in
+``<file>.part.json``) and the next attempt resumes from there, so a retry
+only costs the missing bytes.  part_path_for() names that file after the
+URL, so a later run finds it too; prune() clears out abandoned ones.
+
+Before a body is returned its size is checked against the length the server
+announced, and its MD5 against Content-MD5, or against the ETag when S3
+served a single-part object (S3 ETags are then the hex MD5 of the body).
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+PART_SUFFIX = '.part'
+
+# Times a broken stream is resumed within one call before giving up
+DEFAULT_MAX_RESUMES = 3
+
+# Partial downloads nobody resumed within this time are deleted by prune()
+DEFAULT_PART_MAX_AGE = 7 * 24 * 3600
+
+_RESUMABLE_ERRORS = (
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+_CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+_S3_MD5_ETAG = re.compile(r'"?([0-9a-f]{32})"?')
+
+
+class ChecksumError(ValueError):
+    """The received body does not match the size or digest the server announced."""
+
+
+def _meta_path(part_path):
+    return f"{part_path}.json"
+
+
+def _validator(response):
+    return response.headers.get('ETag') or response.headers.get('Last-Modified')
+
+
+def part_path_for(folder, url):
+    """Where the partial download of *url* is kept in *folder*."""
+    return os.path.join(folder, hashlib.sha256(url.encode('utf-8')).hexdigest() + PART_SUFFIX)
+
+
+def prune(folder, max_age=DEFAULT_PART_MAX_AGE):
+    """Delete partial downloads in *folder* older than *max_age* seconds, and
+    any .part / .part.json file whose partner is missing."""
+    try:
+        names = set(os.listdir(folder))
+    except FileNotFoundError:
+        return
+    cutoff = time.time() - max_age
+    removed = 0
+    parts = {name[:-len('.json')] if name.endswith('.json') else name
+             for name in names if name.endswith(PART_SUFFIX) or name.endswith(f"{PART_SUFFIX}.json")}
+    for part in parts:
+        part_path = os.path.join(folder, part)
+        try:
+            stale = f"{part}.json" not in names or part not in names or os.path.getmtime(part_path) < cutoff
+        except OSError:
+            stale = True
+        if stale:
+            discard(part_path)
+            removed += 1
+    if removed:
+        logger.info(f"Removed {removed} abandoned partial downloads from {folder}")
+
+
+def discard(part_path):
+    """Remove a partial download and its metadata."""
+    for path in (part_path, _meta_path(part_path)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def resume_headers(url, part_path):
+    """
+    Range / If-Range headers that continue the partial download at
+    *part_path*, or {} when there is nothing usable to resume.
+    """
+    if not part_path:
+        return {}
+    try:
+        with open(_meta_path(part_path), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        size = os.path.getsize(part_path)
+    except (OSError, ValueError):
+        return {}
+    if meta.get('url') != url or not meta.get('validator') or not size:
+        discard(part_path)
+        return {}
+    return {'Range': f"bytes={size}-", 'If-Range': meta['validator']}
+
+
+def open_response(session, url, part_path=None, headers=None, timeout=30):
+    """
+    Start a streamed GET for *url*, continuing the partial download at
+    *part_path* when there is one.  *headers* (e.g. conditional-GET headers)
+    are sent as well; the server applies those before the range.
+    """
+    headers = dict(headers or {})
+    range_headers = resume_headers(url, part_path)
+    response = session.get(url, headers={**headers, **range_headers}, stream=True, timeout=timeout)
+    if response.status_code == 416 and range_headers:
+        # The partial file is no longer a prefix of the body; start over
+        response.close()
+        discard(part_path)
+        response = session.get(url, headers=headers, stream=True, timeout=timeout)
+    return response
+
+
+def _spill(part_path, url, validator, data):
+    if not (part_path and validator and data):
+        return
+    try:
+        with open(part_path, 'wb') as f:
+            f.write(data)
+        with open(_meta_path(part_path), 'w', encoding='utf-8') as f:
+            json.dump({'url': url, 'validator': validator}, f)
+        logger.info(f"Kept {len(data):,} bytes of {url} in {part_path} for the next attempt")
+    except OSError as e:
+        logger.warning(f"Could not keep partial download {part_path}: {e}")
+
+
+def _range_start(response):
+    match = _CONTENT_RANGE.match(response.headers.get('Content-Range', ''))
+    return int(match.group(1)) if match else None
+
+
+def _expected_size(response, offset):
+    match = _CONTENT_RANGE.match(response.headers.get('Content-Range', ''))
+    if match and match.group(3) != '*':
+        return int(match.group(3))
+    length = response.headers.get('Content-Length')
+    if length and not response.headers.get('Content-Encoding'):
+        return offset + int(length)
+    return None
+
+
+def _expected_md5(response):
+    # Content-MD5 on a 206 covers only the range; S3 ETags cover the object
+    content_md5 = response.headers.get('Content-MD5') if response.status_code == 200 else None
+    if content_md5:
+        try:
+            return base64.b64decode(content_md5).hex()
+        except ValueError:
+            return None
+    if 'x-amz-request-id' in response.headers or response.headers.get('Server') == 'AmazonS3':
+        match = _S3_MD5_ETAG.fullmatch(response.headers.get('ETag', ''))
+        if match:
+            return match.group(1)
+    return None
+
+
+def verify(data, expected_size=None, expected_md5=None):
+    """Raise ChecksumError unless *data* matches the announced size and MD5."""
+    if expected_size is not None and len(data) != expected_size:
+        raise ChecksumError(f"expected {expected_size:,} bytes, received {len(data):,}")
+    if expected_md5 and hashlib.md5(data).hexdigest() != expected_md5:
+        raise ChecksumError(f"MD5 mismatch (expected {expected_md5})")
+
+
+def read_body(session, url, response, part_path=None, timeout=30, chunk_size=1024 * 1024,
+              max_resumes=DEFAULT_MAX_RESUMES):
+    """
+    Read the body of *response* (a streamed 200 or 206 for *url*), resuming
+    with Range requests when the stream breaks, and verify it.
+
+    Args:
+        session: Session used for resume requests
+        url: URL the response belongs to
+        response: Open streamed response; a 206 continues *part_path*
+        part_path: Where a partial body is kept between attempts, or None
+        timeout: Timeout for resume requests
+        chunk_size: Bytes per read
+        max_resumes: Range requests to try before giving up
+
+    Returns:
+        The complete body as bytes
+
+    Raises:
+        requests.exceptions.RequestException: When the download cannot finish
+        ChecksumError: When the finished body fails verification
+    """
+    buffer = bytearray()
+    if response.status_code == 206:
+        start = _range_start(response)
+        try:
+            with open(part_path, 'rb') as f:
+                buffer += f.read()
+        except (OSError, TypeError):
+            buffer = bytearray()
+        if start != len(buffer):
+            raise requests.exceptions.ContentDecodingError(
+                f"Range response for {url} starts at {start}, expected {len(buffer)}")
+        logger.info(f"Resuming {url} at byte {len(buffer):,}")
+    if part_path:
+        discard(part_path)
+
+    validator = _validator(response)
+    expected_size = _expected_size(response, len(buffer))
+    expected_md5 = _expected_md5(response)
+    resumes = 0
+    while True:
+        try:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                buffer += chunk
+            break
+        except _RESUMABLE_ERRORS as e:
+            response.close()
+            if resumes >= max_resumes or not validator:
+                _spill(part_path, url, validator, buffer)
+                raise
+            resumes += 1
+            logger.warning(f"Download of {url} broke at byte {len(buffer):,} ({e}); "
+                           f"resuming ({resumes}/{max_resumes})")
+            try:
+                response = session.get(url, headers={'Range': f"bytes={len(buffer)}-", 'If-Range': validator},
+                                       stream=True, timeout=timeout)
+                response.raise_for_status()
+            except requests.exceptions.RequestException:
+                _spill(part_path, url, validator, buffer)
+                raise
+            if response.status_code == 200:
+                # Ranges unsupported or the file changed: start over
+                buffer = bytearray()
+                validator = _validator(response)
+                expected_size = _expected_size(response, 0)
+                expected_md5 = _expected_md5(response)
+            elif _range_start(response) != len(buffer):
+                response.close()
+                raise requests.exceptions.ContentDecodingError(f"Unexpected Content-Range resuming {url}")
+    response.close()
+
+    verify(buffer, expected_size, expected_md5)
+    return bytes(buffer)
@@ -0,0 +1,176 @@
+"""
+Small threaded stage pipeline.
+
+Items flow through a list of stages, each with its own worker threads,
+connected by bounded queues.  A full queue blocks the stage feeding it, so a
+slow stage holds back the ones before it instead of letting work (and memory)
+pile up, and with enough workers per stage the run takes about as long as the
+slowest stage rather than the sum of all of them.
+
+Stage functions take one item and return the item for the next stage, or
+None to drop it.  They should log their own per-item errors; an exception
+that escapes is logged here and the item is dropped.
+
+SharedWork lets items that need the same expensive result (the same source
+URL, the same image bytes) compute it once: the first item to ask runs it,
+the others wait for and reuse that result.
+"""
+
+from concurrent.futures import Future
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class Stage:
+    """One step of a pipeline: *func* run by *workers* threads."""
+
+    def __init__(self, name, func, workers=1, queue_size=None):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        # Items waiting for this stage; defaults to two per worker
+        self.queue_size = queue_size or 2 * self.workers
+        self.processed = 0
+        self.dropped = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def _record(self, elapsed, dropped):
+        with self._lock:
+            self.processed += 1
+            self.dropped += dropped
+            self.busy += elapsed
+
+
+class SharedWork:
+    """
+    Run a function once per key, however many pipeline items ask for it.
+
+    Call expect() for every item up front so a result is released as soon as
+    the last item using it has picked it up, instead of being held (e.g. a
+    whole image in memory) until the run ends.  Results for keys nobody
+    registered are kept for the whole run.  Exceptions are shared too.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.computed = 0
+        self.shared = 0
+        self._pending = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def expect(self, key):
+        """Register one more item that will call run() with *key*."""
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + 1
+
+    def run(self, key, func, *args):
+        """
+        Return func(*args) for the first caller with *key*; later callers
+        wait for and get the same result (or exception).
+
+        Returns:
+            (result, owner) where owner is True for the caller that ran func
+        """
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = self._futures[key] = Future()
+                self.computed += 1
+            else:
+                self.shared += 1
+        if owner:
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+        try:
+            return future.result(), owner
+        finally:
+            self._release(key)
+
+    def _release(self, key):
+        with self._lock:
+            if key not in self._pending:
+                return
+            remaining = self._pending[key] - 1
+            if remaining > 0:
+                self._pending[key] = remaining
+            else:
+                self._pending.pop(key, None)
+                self._futures.pop(key, None)
+
+    def log_stats(self):
+        if self.shared:
+            logger.info(f"Shared '{self.name}': {self.computed} computed, {self.shared} reused")
+
+
+def _run_worker(stage, inbox, outbox, results, results_lock):
+    while True:
+        entry = inbox.get()
+        if entry is _DONE:
+            return
+        index, item = entry
+        start = time.perf_counter()
+        try:
+            result = stage.func(item)
+        except Exception as e:
+            logger.error(f"Pipeline stage '{stage.name}' failed on item {index}: {e}")
+            result = None
+        stage._record(time.perf_counter() - start, result is None)
+        if result is None:
+            continue
+        if outbox is None:
+            with results_lock:
+                results[index] = result
+        else:
+            outbox.put((index, result))
+
+
+def run_pipeline(items, stages):
+    """
+    Push *items* through *stages* and return the final results in input order
+    (dropped items are left out).
+    """
+    inboxes = [queue.Queue(maxsize=stage.queue_size) for stage in stages]
+    results = {}
+    results_lock = threading.Lock()
+    started = time.perf_counter()
+
+    workers = []
+    for position, stage in enumerate(stages):
+        outbox = inboxes[position + 1] if position + 1 < len(stages) else None
+        threads = [
+            threading.Thread(target=_run_worker, name=f"{stage.name}-{n}", daemon=True,
+                             args=(stage, inboxes[position], outbox, results, results_lock))
+            for n in range(stage.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        workers.append(threads)
+
+    for index, item in enumerate(items):
+        inboxes[0].put((index, item))
+
+    # Close the stages front to back: once every worker of a stage has
+    # finished, nothing more can reach the next one.
+    for position, stage in enumerate(stages):
+        for _ in workers[position]:
+            inboxes[position].put(_DONE)
+        for thread in workers[position]:
+            thread.join()
+
+    elapsed = time.perf_counter() - started
+    for stage in stages:
+        logger.info(f"Pipeline stage '{stage.name}': {stage.processed} items, {stage.dropped} dropped, "
+                    f"{stage.busy:.1f}s busy across {stage.workers} worker(s)")
+    logger.info(f"Pipeline finished {len(results)} items in {elapsed:.1f}s")
+    return [results[index] for index in sorted(results)]
@@ -0,0 +1,142 @@
+"""
+Raw raster sidecars: decoded pixels stored next to a PNG so later Python
+stages can memory-map them instead of inflating the PNG again.
+
+``<image>.png.raster`` holds a 64-byte header followed by the pixel rows,
+uncompressed.  A tiled PNG stores only its source tile plus the grid, so the
+sidecar of a 6x6 tile is the size of one repeat; readers rebuild the canvas
+with tiling.tile_image.  The PNG is still written for Photoshop and S3; the
+sidecar is an optional shortcut that readers fall back from silently.
+
+L and RGBA buffers are handed to Pillow without a copy.  Pillow stores RGB at
+4 bytes per pixel, so RGB (and LA) cost one memcpy-speed unpack, still far
+cheaper than inflating and unfiltering the PNG.
+"""
+
+import logging
+import os
+import struct
+import uuid
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+SIDECAR_EXT = '.raster'
+
+_MAGIC = b'AARASTR1'
+# magic, mode, width, height, cols, rows, byte size of the image it mirrors
+_HEADER = struct.Struct('<8s8sIIIIQ')
+HEADER_SIZE = 64
+
+_BANDS = {'L': 1, 'LA': 2, 'RGB': 3, 'RGBA': 4}
+_MAPPED = ('L', 'RGBA')
+
+
+def sidecar_path(image_path):
+    """Path of the sidecar for *image_path*."""
+    return f"{image_path}{SIDECAR_EXT}"
+
+
+def remove_sidecar(image_path):
+    """Delete the sidecar of *image_path*, if any (call before rewriting the image)."""
+    try:
+        os.remove(sidecar_path(image_path))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Could not remove raster sidecar for {image_path}: {e}")
+
+
+def write_sidecar(image_path, img, cols=1, rows=1):
+    """
+    Store the pixels of *img* as the sidecar of the already written *image_path*.
+
+    Args:
+        image_path: The PNG (or other file) the sidecar stands in for
+        img: Loaded PIL image in L, LA, RGB or RGBA mode; for a tiled image
+             this is the source tile, not the canvas
+        cols: Horizontal repeats of *img* in *image_path*
+        rows: Vertical repeats of *img* in *image_path*
+
+    Returns:
+        The sidecar path, or None if the mode is not supported or writing failed
+    """
+    if img.mode not in _BANDS:
+        logger.debug(f"No raster sidecar for mode {img.mode}: {image_path}")
+        return None
+
+    path = sidecar_path(image_path)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        header = _HEADER.pack(_MAGIC, img.mode.encode('ascii'), img.width, img.height,
+                              cols, rows, os.path.getsize(image_path))
+        with open(tmp, 'wb') as f:
+            f.write(header.ljust(HEADER_SIZE, b'\x00'))
+            f.write(np.asarray(img).tobytes())
+        os.replace(tmp, path)
+        return path
+    except OSError as e:
+        logger.warning(f"Could not write raster sidecar for {image_path}: {e}")
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return None
+
+
+def open_sidecar(image_path):
+    """
+    Memory-map the sidecar of *image_path*.
+
+    Returns:
+        (pixels, mode, cols, rows), where pixels is a read-only
+        (height, width[, bands]) array backed by the file, or None when there
+        is no valid sidecar for the current image
+    """
+    path = sidecar_path(image_path)
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER.size)
+        magic, mode, width, height, cols, rows, image_size = _HEADER.unpack(header)
+        mode = mode.rstrip(b'\x00').decode('ascii')
+        if magic != _MAGIC or mode not in _BANDS:
+            raise ValueError("not a raster sidecar")
+        if image_size != os.path.getsize(image_path):
+            logger.info(f"Ignoring stale raster sidecar: {path}")
+            return None
+        bands = _BANDS[mode]
+        shape = (height, width) if bands == 1 else (height, width, bands)
+        pixels = np.memmap(path, dtype=np.uint8, mode='r', offset=HEADER_SIZE, shape=shape)
+        return pixels, mode, cols, rows
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, struct.error) as e:
+        logger.warning(f"Ignoring unreadable raster sidecar {path}: {e}")
+        return None
+
+
+def load_sidecar(image_path, tiled=True):
+    """
+    PIL image for *image_path* built from its sidecar, or None without one.
+
+    With *tiled* the full canvas is rebuilt from the stored tile and grid;
+    otherwise the single stored tile is returned.
+    """
+    opened = open_sidecar(image_path)
+    if opened is None:
+        return None
+    pixels, mode, cols, rows = opened
+    height, width = pixels.shape[:2]
+    if mode in _MAPPED:
+        img = Image.frombuffer(mode, (width, height), pixels, 'raw', mode, 0, 1)
+    else:
+        img = Image.fromarray(np.asarray(pixels))
+
+    if tiled and (cols > 1 or rows > 1):
+        # Imported here: tiling imports this module
+        from tiling import tile_image
+        img = tile_image(img, cols, rows)
+    logger.info(f"Loaded {os.path.basename(image_path)} from raster sidecar")
+    return img
@@ -0,0 +1,341 @@
+"""
+One place to publish files to S3.
+
+Every uploader used to build its own boto3 client (some per call), ask S3 for
+the bucket's region after every file to build the public URL, and confirm
+each upload with a HEAD request.  Here the client is created once per
+process with a connection pool sized for the concurrent upload stages and
+shared by all threads (boto3 clients are thread-safe), the region is looked
+up once per bucket, and an upload is validated from its own PutObject
+response: the request carries Content-MD5, which S3 checks before storing
+the object, and the returned ETag is compared with the local digest.  Files
+above a TransferConfig's multipart threshold go up as parallel multipart
+uploads instead, each part carrying a CRC32 checksum that S3 verifies.
+upload_many() runs a batch of uploads on a thread pool and reports the
+throughput; a file that is already in S3 under another key is copied there
+server-side instead of being sent again.  With enable_upload_manifest(),
+files S3 already holds unchanged are skipped altogether.
+
+upload_immutable() publishes a file under a content-hashed key
+(hero.<md5 prefix>.png) with a year-long immutable Cache-Control, so CDNs
+and browsers can cache it for good and identical files share one URL; the
+plain key is kept as a short-lived alias holding the same bytes.
+
+Credentials and the client region come from the usual environment variables
+(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION), read when the client
+is first needed so callers can load their .env file first.
+"""
+
+import atexit
+import base64
+import functools
+import hashlib
+import logging
+import math
+import mimetypes
+import os
+import posixpath
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+from upload_manifest import UploadManifest
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REGION = 'us-east-2'
+
+# Connections kept open to S3; enough for the upload stages running at once
+# (upload_many workers x TransferConfig max_concurrency)
+MAX_POOL_CONNECTIONS = 32
+
+MB = 1024 * 1024
+
+# What upload_file(..., report=True) did with a file
+UPLOADED, COPIED, SKIPPED = 'uploaded', 'copied', 'skipped'
+
+# Cache-Control of content-hashed keys (never change) and of their aliases
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+ALIAS_CACHE_CONTROL = 'public, max-age=300'
+
+# Characters of the MD5 put into a content-hashed key
+HASH_LENGTH = 12
+
+_HASH_SUFFIX = re.compile(r'\.[0-9a-f]{%d}(?=\.[^./]+$)' % HASH_LENGTH)
+
+_client = None
+_client_lock = threading.Lock()
+_manifest = None
+
+
+def get_client():
+    """The process-wide S3 client (created on first use)."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = boto3.client(
+                's3',
+                aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+                aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+                region_name=os.getenv('AWS_REGION', DEFAULT_REGION),
+                config=Config(
+                    max_pool_connections=MAX_POOL_CONNECTIONS,
+                    retries={'max_attempts': 5, 'mode': 'standard'},
+                    tcp_keepalive=True,
+                ),
+            )
+        return _client
+
+
+@functools.lru_cache(maxsize=None)
+def bucket_region(bucket_name):
+    """Region of *bucket_name*, asked of S3 once per process."""
+    location = get_client().get_bucket_location(Bucket=bucket_name).get('LocationConstraint')
+    return location or 'us-east-1'
+
+
+def public_url(bucket_name, s3_key):
+    """Public URL of *s3_key*, in the format the storefront already uses."""
+    return f"https://{bucket_name}.s3-{bucket_region(bucket_name)}.amazonaws.com/{s3_key}"
+
+
+def transfer_config(multipart_threshold=16 * MB, multipart_chunksize=16 * MB, max_concurrency=4):
+    """TransferConfig for upload_file(): files at or above *multipart_threshold*
+    are sent in *multipart_chunksize* parts, *max_concurrency* at a time."""
+    return TransferConfig(
+        multipart_threshold=multipart_threshold,
+        multipart_chunksize=multipart_chunksize,
+        max_concurrency=max_concurrency,
+        use_threads=max_concurrency > 1,
+    )
+
+
+def _file_digests(path, part_size=None, chunk_size=1024 * 1024):
+    """
+    MD5 of the file at *path*, plus the ETag S3 gives it when uploaded in
+    *part_size* parts (MD5 of the part MD5s, "-<parts>"), or None.
+    """
+    digest = hashlib.md5()
+    part_digests = []
+    part, part_left = hashlib.md5(), part_size
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+            while part_size and chunk:
+                piece, chunk = chunk[:part_left], chunk[part_left:]
+                part.update(piece)
+                part_left -= len(piece)
+                if not part_left:
+                    part_digests.append(part.digest())
+                    part, part_left = hashlib.md5(), part_size
+    if not part_size:
+        return digest, None
+    if part_left != part_size:
+        part_digests.append(part.digest())
+    return digest, f"{hashlib.md5(b''.join(part_digests)).hexdigest()}-{len(part_digests)}"
+
+
+def enable_upload_manifest(path):
+    """
+    Skip uploads whose content S3 already holds, tracked in the manifest at
+    *path* (see upload_manifest.py).  Returns the manifest, whose summary()
+    reports what was saved.
+    """
+    global _manifest
+    with _client_lock:
+        if _manifest is None or _manifest.path != path:
+            _manifest = UploadManifest(path)
+            atexit.register(_manifest.save)
+        return _manifest
+
+
+def upload_file(local_file, bucket_name, s3_key, content_type=None, acl='public-read', extra_args=None,
+                config=None, report=False):
+    """
+    Upload *local_file* to S3 and return its public URL.  With an upload
+    manifest enabled, a file S3 already holds unchanged is not sent again.
+
+    Args:
+        local_file: File to upload
+        bucket_name: Destination bucket
+        s3_key: Destination key
+        content_type: Content-Type to store; guessed from the file name if None
+        acl: Canned ACL (public-read by default, as the storefront links to it)
+        extra_args: Further PutObject parameters (e.g. CacheControl)
+        config: TransferConfig (see transfer_config()); files at or above its
+                multipart threshold are uploaded in parallel parts
+        report: Return (url, action) instead, action being UPLOADED when the
+                bytes were sent, COPIED or SKIPPED when they were not
+
+    Returns:
+        The object's public URL
+
+    Raises:
+        FileNotFoundError: If *local_file* does not exist
+        botocore.exceptions.BotoCoreError, ClientError: If the upload fails
+        ValueError: If the ETag S3 returned does not match the file
+    """
+    size = os.path.getsize(local_file)
+    multipart = bool(config) and size >= config.multipart_threshold
+    if multipart and not _manifest:
+        digest = multipart_etag = None
+    else:
+        digest, multipart_etag = _file_digests(local_file, config.multipart_chunksize if multipart else None)
+
+    if _manifest and _manifest.unchanged(get_client(), bucket_name, s3_key, size, digest.hexdigest()):
+        requests = 2 + math.ceil(size / config.multipart_chunksize) if multipart else 1
+        _manifest.count_skip(size, requests)
+        url = public_url(bucket_name, s3_key)
+        logger.info(f"Skipped {local_file}: {url} is unchanged")
+        return (url, SKIPPED) if report else url
+
+    metadata = {'ContentType': content_type or mimetypes.guess_type(local_file)[0] or 'application/octet-stream'}
+    metadata.update(extra_args or {})
+
+    # The same bytes already published under another key this run: copy them
+    source_key = _manifest.find_copy(bucket_name, s3_key, size, digest.hexdigest()) if _manifest else None
+    if source_key:
+        try:
+            url = copy_object(bucket_name, source_key, bucket_name, s3_key, acl, metadata)
+            _manifest.record(bucket_name, s3_key, size, digest.hexdigest(), digest.hexdigest())
+            _manifest.count_copy(size)
+            return (url, COPIED) if report else url
+        except Exception as e:
+            logger.warning(f"Server-side copy of {source_key} to {s3_key} failed, uploading instead: {e}")
+
+    params = {'ACL': acl, **metadata}
+
+    if multipart:
+        get_client().upload_file(local_file, bucket_name, s3_key,
+                                 ExtraArgs={**params, 'ChecksumAlgorithm': 'CRC32'}, Config=config)
+        etag = multipart_etag
+    else:
+        params.update(Bucket=bucket_name, Key=s3_key, ContentMD5=base64.b64encode(digest.digest()).decode('ascii'))
+        with open(local_file, 'rb') as body:
+            response = get_client().put_object(Body=body, **params)
+
+        # With SSE-KMS the ETag is not the MD5; S3 has already checked Content-MD5
+        etag = response.get('ETag', '').strip('"')
+        if response.get('ServerSideEncryption') != 'aws:kms' and etag != digest.hexdigest():
+            raise ValueError(f"Upload of {s3_key} returned ETag {etag}, expected {digest.hexdigest()}")
+
+    if _manifest:
+        _manifest.record(bucket_name, s3_key, size, digest.hexdigest(), etag)
+    url = public_url(bucket_name, s3_key)
+    logger.info(f"Uploaded {local_file} to {url}" + (" (multipart)" if multipart else ""))
+    return (url, UPLOADED) if report else url
+
+
+def hashed_key(s3_key, md5_hex):
+    """*s3_key* with the content hash before its extension (a/b.png -> a/b.<hash>.png)."""
+    stem, ext = posixpath.splitext(s3_key)
+    return f"{stem}.{md5_hex[:HASH_LENGTH]}{ext}"
+
+
+def stable_key(s3_key):
+    """Inverse of hashed_key(): the alias name of a content-hashed key.
+    Works on URLs too; other keys are returned unchanged."""
+    return _HASH_SUFFIX.sub('', s3_key, count=1)
+
+
+def upload_immutable(local_file, bucket_name, s3_key, content_type=None, acl='public-read', config=None,
+                     report=False):
+    """
+    Upload *local_file* under a content-hashed version of *s3_key* with an
+    immutable Cache-Control, point *s3_key* itself at the same bytes, and
+    return the hashed key's public URL.
+
+    The alias is a server-side copy with a short Cache-Control, for
+    consumers that build URLs from the plain name.  Failing to update it is
+    logged, not raised: the returned URL is already complete.
+
+    With *report*, returns (url, action) as upload_file() does, for the
+    content-hashed upload.
+
+    Raises:
+        As upload_file(), for the content-hashed upload
+    """
+    digest, _ = _file_digests(local_file)
+    key = hashed_key(s3_key, digest.hexdigest())
+    url, action = upload_file(local_file, bucket_name, key, content_type, acl,
+                              {'CacheControl': IMMUTABLE_CACHE_CONTROL}, config, report=True)
+    try:
+        if _manifest:
+            # Skipped when the alias is unchanged, otherwise copied from *key*
+            upload_file(local_file, bucket_name, s3_key, content_type, acl,
+                        {'CacheControl': ALIAS_CACHE_CONTROL}, config)
+        else:
+            copy_object(bucket_name, key, bucket_name, s3_key, acl, {
+                'ContentType': content_type or mimetypes.guess_type(local_file)[0] or 'application/octet-stream',
+                'CacheControl': ALIAS_CACHE_CONTROL,
+            })
+    except Exception as e:
+        logger.warning(f"Could not point {s3_key} at {key}: {e}")
+    return (url, action) if report else url
+
+
+def copy_object(source_bucket, source_key, bucket_name, s3_key, acl='public-read', metadata=None):
+    """
+    Copy an object inside S3 (no data passes through this machine) and
+    return the copy's public URL.  Content-Type and metadata are kept unless
+    *metadata* (ContentType, CacheControl, ...) replaces them.
+    """
+    get_client().copy_object(
+        Bucket=bucket_name,
+        Key=s3_key,
+        CopySource={'Bucket': source_bucket, 'Key': source_key},
+        ACL=acl,
+        **({'MetadataDirective': 'REPLACE', **metadata} if metadata else {'MetadataDirective': 'COPY'}),
+    )
+    url = public_url(bucket_name, s3_key)
+    logger.info(f"Copied s3://{source_bucket}/{source_key} to {url}")
+    return url
+
+
+def upload_many(uploads, workers=8, config=None, immutable=False):
+    """
+    Upload a batch of files on a thread pool, then log the throughput.
+
+    Args:
+        uploads: (local_file, bucket_name, s3_key) tuples.  A fourth element
+                 (source_bucket, source_key) names an object already holding
+                 the file; it is then copied server-side instead of uploaded.
+        workers: Files uploaded at once
+        config: TransferConfig passed to upload_file()
+        immutable: Publish through upload_immutable() (content-hashed keys)
+
+    Returns:
+        Public URL of each upload, in the order given; None where it failed
+    """
+    def upload(entry):
+        local_file, bucket_name, s3_key, *copy_from = entry
+        try:
+            # With a manifest upload_file() skips or copies on its own, and
+            # knows whether the key already holds the file
+            if copy_from and copy_from[0] and not _manifest and not immutable:
+                return copy_object(*copy_from[0], bucket_name, s3_key), 0, COPIED
+            publish = upload_immutable if immutable else upload_file
+            url, action = publish(local_file, bucket_name, s3_key, config=config, report=True)
+            return url, os.path.getsize(local_file) if action == UPLOADED else 0, action
+        except Exception as e:
+            logger.error(f"Upload of {local_file} to {s3_key} failed: {e}")
+            return None, 0, None
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(executor.map(upload, uploads))
+    elapsed = max(time.perf_counter() - started, 1e-6)
+
+    # Only files whose bytes were sent count towards the transfer rate
+    counts = {action: sum(1 for _, _, done in results if done == action) for action in (UPLOADED, COPIED, SKIPPED)}
+    failed = sum(1 for url, _, _ in results if not url)
+    total = sum(size for _, size, _ in results)
+    logger.info(f"Uploaded {counts[UPLOADED]} files, {total / MB:.1f} MB in {elapsed:.1f}s: "
+                f"{total / MB / elapsed:.1f} MB/s, {counts[UPLOADED] / elapsed:.1f} files/s; "
+                f"{counts[COPIED]} copied server-side, {counts[SKIPPED]} unchanged, {failed} failed")
+    return [url for url, _, _ in results]
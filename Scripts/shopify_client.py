@@ -0,0 +1,239 @@
+"""
+One Shopify Admin API client for every script.
+
+The scripts used to call requests.get/put/post directly: a new connection
+per call, and no notice taken of Shopify's rate limits, so running calls in
+parallel meant a storm of 429s.  ShopifyClient keeps a pooled keep-alive
+session and paces calls with two leaky buckets kept in step with what
+Shopify reports:
+
+* REST: X-Shopify-Shop-Api-Call-Limit ("used/size") after every call; the
+  bucket drains at REST_LEAK_RATE calls a second.
+* GraphQL: extensions.cost.throttleStatus (points available, maximum and
+  restore rate) after every query.
+
+A 429 (or a THROTTLED GraphQL error) waits Retry-After or until the bucket
+has room; 5xx responses and connection errors are retried with jittered
+exponential backoff.  Only idempotent calls (GET, PUT, DELETE, GraphQL
+queries, or a call made with idempotent=True) are retried once they may
+have reached Shopify; any other POST or mutation is retried only when it
+never got a connection, so an image is never attached twice.  stats()
+counts calls, throttles, retries and the time spent waiting.
+"""
+
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_VERSION = '2025-01'
+
+# Standard plan REST bucket: 40 calls, draining at 2 a second
+REST_BUCKET_SIZE = 40
+REST_LEAK_RATE = 2.0
+
+# GraphQL cost assumed for a query before Shopify has reported one
+DEFAULT_QUERY_COST = 50
+
+RETRY_STATUSES = {500, 502, 503, 504}
+
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'DELETE'}
+
+
+class ShopifyClient:
+    """Rate-limited, pooled client for one store's Admin API (thread-safe)."""
+
+    def __init__(self, store, access_token, api_version=DEFAULT_API_VERSION, pool_size=10,
+                 max_retries=5, timeout=30):
+        self.api_base = f"https://{store}.myshopify.com/admin/api/{api_version}"
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'X-Shopify-Access-Token': access_token,
+            'Content-Type': 'application/json',
+        })
+        self._lock = threading.Lock()
+        # REST bucket: calls in it as of _rest_stamp
+        self._rest_used, self._rest_size, self._rest_stamp = 0.0, REST_BUCKET_SIZE, time.monotonic()
+        # GraphQL bucket: points available as of _gql_stamp
+        self._gql_available, self._gql_max, self._gql_restore = None, None, None
+        self._gql_stamp = time.monotonic()
+        self.calls = self.throttled = self.retries = 0
+        self.wait_seconds = 0.0
+
+    def url(self, path):
+        """Absolute URL of an API *path* ('products.json'); URLs pass through."""
+        return path if path.startswith('http') else f"{self.api_base}/{path.lstrip('/')}"
+
+    # -- rate limiting ------------------------------------------------------
+
+    def _sleep(self, seconds):
+        if seconds > 0:
+            with self._lock:
+                self.wait_seconds += seconds
+            time.sleep(seconds)
+
+    def _reserve_rest(self):
+        """Take a slot in the REST bucket, waiting for one to drain if it is full."""
+        with self._lock:
+            now = time.monotonic()
+            self._rest_used = max(0.0, self._rest_used - (now - self._rest_stamp) * REST_LEAK_RATE)
+            self._rest_stamp = now
+            # Keep one slot spare for other processes sharing the store's bucket
+            wait = max(0.0, (self._rest_used + 2 - self._rest_size) / REST_LEAK_RATE)
+            self._rest_used += 1
+        self._sleep(wait)
+
+    def _update_rest(self, response):
+        limit = response.headers.get('X-Shopify-Shop-Api-Call-Limit')
+        if not limit:
+            return
+        try:
+            used, size = (int(n) for n in limit.split('/'))
+        except ValueError:
+            return
+        with self._lock:
+            self._rest_used, self._rest_size, self._rest_stamp = float(used), size, time.monotonic()
+
+    def _reserve_graphql(self, cost):
+        """Wait until the GraphQL bucket has restored *cost* points, and take them."""
+        with self._lock:
+            if self._gql_available is None:
+                return
+            now = time.monotonic()
+            self._gql_available = min(self._gql_max,
+                                      self._gql_available + (now - self._gql_stamp) * self._gql_restore)
+            self._gql_stamp = now
+            wait = max(0.0, (cost - self._gql_available) / self._gql_restore)
+            self._gql_available -= cost
+        self._sleep(wait)
+
+    def _update_graphql(self, body):
+        status = ((body.get('extensions') or {}).get('cost') or {}).get('throttleStatus')
+        if not status:
+            return
+        with self._lock:
+            self._gql_available = float(status['currentlyAvailable'])
+            self._gql_max = float(status['maximumAvailable'])
+            self._gql_restore = float(status['restoreRate']) or 1.0
+            self._gql_stamp = time.monotonic()
+
+    def _backoff(self, attempt):
+        """Jittered exponential backoff: up to 0.5s, 1s, 2s, ... capped at 30s."""
+        self._sleep(random.uniform(0, min(30.0, 0.5 * 2 ** attempt)))
+
+    # -- requests -----------------------------------------------------------
+
+    def request(self, method, path, idempotent=None, **kwargs):
+        """
+        Send a REST request within the rate limit and return the response.
+        429s are retried up to max_retries times; 5xx and connection errors
+        too if the request is *idempotent* (by default: GET, PUT, DELETE),
+        otherwise only connect timeouts, which never reached Shopify.
+        Other error statuses are returned for the caller to check.
+
+        Raises:
+            requests.RequestException: If the last attempt failed to connect
+        """
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        return self._send(method, self.url(path), idempotent, rest=True, **kwargs)
+
+    def _send(self, method, url, idempotent, rest, **kwargs):
+        """request() without the defaults; *rest* paces it with the REST bucket."""
+        kwargs.setdefault('timeout', self.timeout)
+        for attempt in range(self.max_retries + 1):
+            if rest:
+                self._reserve_rest()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # A read timeout or dropped connection may have been processed
+                if attempt == self.max_retries or not (idempotent or isinstance(e, requests.ConnectTimeout)):
+                    raise
+                self._count_retry()
+                self._backoff(attempt)
+                continue
+            finally:
+                with self._lock:
+                    self.calls += 1
+            if rest:
+                self._update_rest(response)
+            if response.status_code == 429 and attempt < self.max_retries:
+                with self._lock:
+                    self.throttled += 1
+                self._sleep(float(response.headers.get('Retry-After') or 2.0))
+                continue
+            if response.status_code in RETRY_STATUSES and idempotent and attempt < self.max_retries:
+                self._count_retry()
+                self._backoff(attempt)
+                continue
+            return response
+        return response
+
+    def _count_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    def graphql(self, query, variables=None, cost=DEFAULT_QUERY_COST, idempotent=None):
+        """
+        Run a GraphQL query within the query-cost budget and return its data.
+        A THROTTLED response waits for the bucket to refill and is retried.
+        GraphQL has its own limit, so this stays out of the REST bucket.
+        Mutations are retried after connection errors only if *idempotent*.
+
+        Raises:
+            requests.RequestException: If the request failed
+            RuntimeError: If the query returned errors
+        """
+        if idempotent is None:
+            idempotent = not query.lstrip().startswith('mutation')
+        for attempt in range(self.max_retries + 1):
+            self._reserve_graphql(cost)
+            response = self._send('POST', self.url('graphql.json'), idempotent, rest=False,
+                                  json={'query': query, 'variables': variables or {}})
+            response.raise_for_status()
+            body = response.json()
+            self._update_graphql(body)
+            errors = body.get('errors') or []
+            if any((e.get('extensions') or {}).get('code') == 'THROTTLED' for e in errors) \
+                    and attempt < self.max_retries:
+                with self._lock:
+                    self.throttled += 1
+                # The next attempt waits until the bucket can pay the full cost
+                cost = ((body.get('extensions') or {}).get('cost') or {}).get('requestedQueryCost', cost)
+                continue
+            if errors:
+                raise RuntimeError(f"GraphQL errors: {errors}")
+            return body['data']
+
+    def stats(self):
+        """Counters so far: calls, throttled, retries, wait_seconds."""
+        with self._lock:
+            return {'calls': self.calls, 'throttled': self.throttled, 'retries': self.retries,
+                    'wait_seconds': round(self.wait_seconds, 2)}
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(f"Shopify: {stats['calls']} calls, {stats['throttled']} throttled, "
+                    f"{stats['retries']} retried, {stats['wait_seconds']}s waiting for the rate limit")
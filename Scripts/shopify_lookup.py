@@ -0,0 +1,123 @@
+"""
+Resolve the AA product ids (custom.basesku metafield) of a whole batch of
+Shopify handles at once.
+
+Looking each handle up over REST takes two serial round trips per CSV row
+(products.json?handle=, then the product's metafields.json).  Here up to
+HANDLES_PER_QUERY handles are looked up in one GraphQL query, one aliased
+productByIdentifier field per handle, every product coming back with its
+base SKU metafields, so a 300-row batch needs a handful of requests.
+These are exact lookups, not a products(query:) search: the search index
+is updated asynchronously and can miss a product created moments ago,
+which would be reported as not found and cached as having no AA id.
+fetch_aa_id() is the single-handle REST lookup, for handles a bulk query
+could not answer.  Both go through a ShopifyClient (see shopify_client.py).
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Handles looked up in one query; each costs about 3 points of the query budget
+HANDLES_PER_QUERY = 50
+POINTS_PER_HANDLE = 3
+
+PRODUCT_FIELDS = """
+      id
+      legacyResourceId
+      title
+      handle
+      basesku: metafield(namespace: "custom", key: "basesku") { value }
+      base_sku: metafield(namespace: "custom", key: "base_sku") { value }
+"""
+
+
+def parse_aa_id(value):
+    """*value* as an AA id ('AA' followed by digits, upper-cased), or None."""
+    value = (value or '').strip().upper()
+    return value if value.startswith('AA') and value[2:].isdigit() else None
+
+
+def fetch_aa_id(client, handle):
+    """
+    AA id of one handle over REST (product by handle, then its metafields),
+    or None if the product or its AA id does not exist.
+
+    Raises:
+        requests.RequestException: If Shopify could not be asked
+    """
+    resp = client.get('products.json', params={'handle': handle})
+    resp.raise_for_status()
+    products = resp.json().get('products', [])
+    if not products:
+        return None
+    mf_resp = client.get(f"products/{products[0]['id']}/metafields.json")
+    mf_resp.raise_for_status()
+    for mf in mf_resp.json().get('metafields', []):
+        if mf.get('namespace') == 'custom' and mf.get('key') in ('basesku', 'base_sku'):
+            aa_id = parse_aa_id(mf.get('value'))
+            if aa_id:
+                return aa_id
+    return None
+
+
+def _lookup(client, handles):
+    """Products with these exact *handles*: handle -> product node or None."""
+    params = ', '.join(f'$h{i}: String!' for i in range(len(handles)))
+    fields = ''.join(f'  p{i}: productByIdentifier(identifier: {{handle: $h{i}}}) {{{PRODUCT_FIELDS}  }}\n'
+                     for i in range(len(handles)))
+    data = client.graphql(f"query ({params}) {{\n{fields}}}",
+                          {f'h{i}': handle for i, handle in enumerate(handles)},
+                          cost=POINTS_PER_HANDLE * len(handles))
+    return {handle: data.get(f'p{i}') for i, handle in enumerate(handles)}
+
+
+def node_aa_id(node):
+    """AA id of a product node from find_products(), or None."""
+    return next((aa_id for aa_id in (parse_aa_id((node.get(key) or {}).get('value'))
+                                     for key in ('basesku', 'base_sku')) if aa_id), None)
+
+
+def find_products(client, handles):
+    """
+    Look up the products with these *handles* in a few GraphQL queries.
+
+    Args:
+        client: ShopifyClient of the store
+        handles: Product handles (duplicates are looked up once)
+
+    Returns:
+        Dict of handle -> product node (id, legacyResourceId, title, handle
+        and the basesku / base_sku metafields as {'value': ...} or None), or
+        None when no product has that handle.  Handles in a batch whose query
+        failed are left out, so callers can fall back to looking them up one
+        by one.
+    """
+    unique = list(dict.fromkeys(handle for handle in handles if handle))
+    products = {}
+    for start in range(0, len(unique), HANDLES_PER_QUERY):
+        batch = unique[start:start + HANDLES_PER_QUERY]
+        try:
+            found = _lookup(client, batch)
+        except Exception as e:
+            logger.warning(f"Bulk product lookup failed for {len(batch)} handles: {e}")
+            continue
+        products.update(found)
+    return products
+
+
+def resolve_aa_ids(client, handles):
+    """
+    Look up the AA ids of *handles* in a few GraphQL queries.
+
+    Returns:
+        Dict of handle -> AA id, or None for a product without one (or no
+        product with that handle).  Handles in a batch whose query failed are
+        left out, as in find_products().
+    """
+    aa_ids = {handle: node_aa_id(node) if node else None
+              for handle, node in find_products(client, handles).items()}
+    unique = len(set(filter(None, handles)))
+    logger.info(f"Resolved {sum(1 for aa_id in aa_ids.values() if aa_id)} AA ids for "
+                f"{unique} handles in {-(-unique // HANDLES_PER_QUERY)} batches")
+    return aa_ids
@@ -0,0 +1,133 @@
+"""
+Persistent, content-addressed cache for generated tiles.
+
+Entries are keyed by the SHA-256 of the source image bytes plus everything
+that changes the output (grid, downscale cap, mode, encoder options).  Hits are
+hard-linked into the run folder (falling back to a copy across volumes), and
+the cache is trimmed least-recently-used first once it grows past its size
+limit.  An entry's mtime records its last use.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Bump when tiling output changes so stale entries stop matching.
+CACHE_VERSION = 2
+
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3  # 20 GB
+
+# Files another thread or process is still writing or resuming; evict() skips them
+IN_PROGRESS_SUFFIXES = ('.tmp', '.part', '.part.json')
+
+_HASH_CHUNK = 1024 * 1024
+
+
+def hash_file(path):
+    """SHA-256 hex digest of the file at *path*."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_bytes(data):
+    """SHA-256 hex digest of an in-memory source."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def tile_key(source_hash, spec):
+    """Cache key for one tile spec (see tiling.create_tile_set) of a given source."""
+    fields = {
+        'version': CACHE_VERSION,
+        'source': source_hash,
+        'grid': [spec['cols'], spec['rows']],
+        'max_dimension': spec.get('max_dimension'),
+        'mode': spec.get('mode'),
+        'save': spec.get('save', {}),
+        'ext': os.path.splitext(spec['path'])[1].lower(),
+    }
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _entry_path(cache_dir, key, ext):
+    return os.path.join(cache_dir, key[:2], f"{key}{ext}")
+
+
+def link_or_copy(src, dst):
+    """Hard-link *src* to *dst* (replacing dst), copying when linking is not possible."""
+    tmp = f"{dst}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
+
+def fetch(cache_dir, key, dest):
+    """Place the cached entry for *key* at *dest*. Returns True on a hit."""
+    entry = _entry_path(cache_dir, key, os.path.splitext(dest)[1].lower())
+    if not os.path.exists(entry):
+        return False
+    try:
+        link_or_copy(entry, dest)
+        now = time.time()
+        os.utime(entry, (now, now))
+        return True
+    except OSError as e:
+        logger.warning(f"Tile cache read failed for {entry}: {e}")
+        return False
+
+
+def store(cache_dir, key, path):
+    """Add the freshly written tile at *path* to the cache under *key*."""
+    entry = _entry_path(cache_dir, key, os.path.splitext(path)[1].lower())
+    try:
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        link_or_copy(path, entry)
+    except OSError as e:
+        logger.warning(f"Could not add {path} to tile cache: {e}")
+
+
+def evict(cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Delete least-recently-used files until *cache_dir* fits in *max_bytes*.
+    Also used for the download cache (http_cache.py).  Files still being
+    written (.tmp) or resumed (.part) are neither counted nor deleted.
+    """
+    entries = []
+    total = 0
+    for root, dirs, files in os.walk(cache_dir):
+        for file in files:
+            if file.endswith(IN_PROGRESS_SUFFIXES):
+                continue
+            path = os.path.join(root, file)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+    if total <= max_bytes:
+        return 0
+
+    removed = 0
+    for mtime, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            removed += 1
+        except OSError as e:
+            logger.warning(f"Could not evict {path} from tile cache: {e}")
+    logger.info(f"Cache {cache_dir}: evicted {removed} entries, {total / 1024 ** 2:.0f} MB remaining")
+    return removed
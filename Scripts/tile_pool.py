@@ -0,0 +1,115 @@
+"""
+Process pool for tiling work.
+
+Decoding, resizing and encoding tiles is CPU-bound and holds the GIL, so the
+batch scripts fan tiling out to worker processes.  The pool is bounded by a
+worker count, and every worker can cap its own address space so one oversized
+artwork fails with a MemoryError (reported for that image) instead of pushing
+the box into swap.
+
+Workers are started with the platform default method; on Windows that is
+spawn, which re-imports the calling script, so callers must keep their entry
+point behind ``if __name__ == "__main__"``.
+"""
+
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def default_workers():
+    """One worker per CPU core."""
+    return os.cpu_count() or 1
+
+
+def _limit_memory_posix(max_bytes):
+    import resource
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        max_bytes = min(max_bytes, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (max_bytes, hard))
+
+
+def _limit_memory_windows(max_bytes):
+    # Put the worker in its own job object with a per-process commit limit.
+    import ctypes
+    from ctypes import wintypes
+
+    class IO_COUNTERS(ctypes.Structure):
+        _fields_ = [(name, ctypes.c_ulonglong) for name in (
+            'ReadOperationCount', 'WriteOperationCount', 'OtherOperationCount',
+            'ReadTransferCount', 'WriteTransferCount', 'OtherTransferCount')]
+
+    class JOBOBJECT_BASIC_LIMIT_INFORMATION(ctypes.Structure):
+        _fields_ = [
+            ('PerProcessUserTimeLimit', ctypes.c_int64),
+            ('PerJobUserTimeLimit', ctypes.c_int64),
+            ('LimitFlags', wintypes.DWORD),
+            ('MinimumWorkingSetSize', ctypes.c_size_t),
+            ('MaximumWorkingSetSize', ctypes.c_size_t),
+            ('ActiveProcessLimit', wintypes.DWORD),
+            ('Affinity', ctypes.c_size_t),
+            ('PriorityClass', wintypes.DWORD),
+            ('SchedulingClass', wintypes.DWORD),
+        ]
+
+    class JOBOBJECT_EXTENDED_LIMIT_INFORMATION(ctypes.Structure):
+        _fields_ = [
+            ('BasicLimitInformation', JOBOBJECT_BASIC_LIMIT_INFORMATION),
+            ('IoInfo', IO_COUNTERS),
+            ('ProcessMemoryLimit', ctypes.c_size_t),
+            ('JobMemoryLimit', ctypes.c_size_t),
+            ('PeakProcessMemoryUsed', ctypes.c_size_t),
+            ('PeakJobMemoryUsed', ctypes.c_size_t),
+        ]
+
+    JOB_OBJECT_LIMIT_PROCESS_MEMORY = 0x100
+    JOB_OBJECT_EXTENDED_LIMIT_INFORMATION_CLASS = 9
+
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    kernel32.CreateJobObjectW.restype = wintypes.HANDLE
+    kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+
+    job = kernel32.CreateJobObjectW(None, None)
+    if not job:
+        raise ctypes.WinError(ctypes.get_last_error())
+    info = JOBOBJECT_EXTENDED_LIMIT_INFORMATION()
+    info.BasicLimitInformation.LimitFlags = JOB_OBJECT_LIMIT_PROCESS_MEMORY
+    info.ProcessMemoryLimit = max_bytes
+    if not kernel32.SetInformationJobObject(job, JOB_OBJECT_EXTENDED_LIMIT_INFORMATION_CLASS,
+                                            ctypes.byref(info), ctypes.sizeof(info)):
+        raise ctypes.WinError(ctypes.get_last_error())
+    if not kernel32.AssignProcessToJobObject(job, kernel32.GetCurrentProcess()):
+        raise ctypes.WinError(ctypes.get_last_error())
+
+
+def _init_worker(max_bytes):
+    if not max_bytes:
+        return
+    try:
+        if sys.platform == 'win32':
+            _limit_memory_windows(max_bytes)
+        else:
+            _limit_memory_posix(max_bytes)
+    except Exception as e:
+        logger.warning(f"Could not cap tiling worker memory at {max_bytes / 1024 ** 3:.1f} GB: {e}")
+
+
+def tile_pool(workers=None, max_worker_memory=None):
+    """
+    Create the executor used for tiling jobs.
+
+    Args:
+        workers: Number of worker processes (defaults to one per CPU core)
+        max_worker_memory: Per-worker memory cap in bytes, or None for no cap
+
+    Returns:
+        A ProcessPoolExecutor; use it as a context manager
+    """
+    workers = max(1, workers or default_workers())
+    logger.info(f"Starting tiling pool with {workers} worker(s)"
+                + (f", {max_worker_memory / 1024 ** 3:.1f} GB cap each" if max_worker_memory else ""))
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(max_worker_memory,))
@@ -0,0 +1,257 @@
+"""
+Streaming writers for tiled canvases.
+
+A 6x6 tile of a 4000px pattern is a 24000x24000 canvas (~1.7 GB as RGB) if it
+is built in memory before encoding.  The writers here encode the repeated
+pattern strip by strip instead, so peak memory is the source tile plus one
+strip of output rows.
+
+The PNG writer reproduces Pillow's encoder: the same adaptive filter choice
+per scanline, the same zlib parameters (including the Z_FILTERED strategy)
+and the same IDAT chunk size, so the file is byte for byte what
+``tile_image(...).save(path)`` writes.  ``image_benchmarks.py stream``
+checks this.
+"""
+
+import logging
+import struct
+import zlib
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Modes the streaming writers handle: 8 bits per sample, PNG colour type.
+PNG_COLOR_TYPES = {'L': 0, 'LA': 4, 'RGB': 2, 'RGBA': 6}
+
+# Pillow's ImageFile.MAXBLOCK; each encoder buffer becomes one IDAT chunk.
+_PNG_BLOCK_SIZE = 65536
+
+# Source rows filtered and compressed per step.
+DEFAULT_STRIP_HEIGHT = 64
+
+
+def _source_pixels(source):
+    """Return (pixels, bands) for a PIL image as a (height, width * bands) uint8 array."""
+    if source.mode not in PNG_COLOR_TYPES:
+        raise ValueError(f"Streaming writer does not support mode {source.mode}")
+    pixels = np.asarray(source)
+    bands = 1 if pixels.ndim == 2 else pixels.shape[2]
+    return pixels.reshape(pixels.shape[0], -1), bands
+
+
+def _png_cost(filtered):
+    """Pillow's filter heuristic: sum of |v| with bytes read as signed."""
+    values = filtered.astype(np.int32)
+    return np.minimum(values, 256 - values).sum(axis=1)
+
+
+def _png_filters(rows, prev, left, upper_left, optimize):
+    """
+    Candidate filtered rows, in the order Pillow tries them (None, Up, Sub,
+    [Average,] Paeth).  *left*/*upper_left* hold the neighbour bytes, so the
+    same code serves the first tile of a row (zeros) and the wrapped repeats.
+    """
+    rows16 = rows.astype(np.int16)
+    a = left.astype(np.int16)
+    b = prev.astype(np.int16)
+    c = upper_left.astype(np.int16)
+
+    candidates = [rows, rows - prev, rows - left]
+    if optimize:
+        candidates.append((rows16 - (a + b) // 2).astype(np.uint8))
+
+    p = a + b - c
+    pa = np.abs(p - a)
+    pb = np.abs(p - b)
+    pc = np.abs(p - c)
+    predictor = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+    candidates.append((rows16 - predictor).astype(np.uint8))
+    return candidates
+
+
+def _filter_strip(rows, prev, bands, cols, optimize):
+    """
+    Filter a strip of source rows as they appear repeated *cols* times across
+    the canvas and return the PNG scanlines (filter byte + data) as bytes.
+    """
+    # Neighbour to the left: zeros for the first tile, the end of the same
+    # row for every repeat after it.
+    left_wrap = np.roll(rows, bands, axis=1)
+    upper_left_wrap = np.roll(prev, bands, axis=1)
+    left_first = left_wrap.copy()
+    left_first[:, :bands] = 0
+    upper_left_first = upper_left_wrap.copy()
+    upper_left_first[:, :bands] = 0
+
+    first = _png_filters(rows, prev, left_first, upper_left_first, optimize)
+    wrap = _png_filters(rows, prev, left_wrap, upper_left_wrap, optimize) if cols > 1 else first
+
+    costs = np.stack([
+        _png_cost(f) + (cols - 1) * _png_cost(w) for f, w in zip(first, wrap)
+    ])
+    # argmin keeps the first minimum, matching Pillow's strict "<" comparisons
+    choice = np.argmin(costs, axis=0)
+    filter_types = [0, 2, 1, 3, 4] if optimize else [0, 2, 1, 4]
+
+    height, width = rows.shape
+    out = np.empty((height, 1 + width * cols), dtype=np.uint8)
+    for index, filter_type in enumerate(filter_types):
+        selected = choice == index
+        if not selected.any():
+            continue
+        out[selected, 0] = filter_type
+        out[selected, 1:1 + width] = first[index][selected]
+        if cols > 1:
+            out[selected, 1 + width:] = np.tile(wrap[index][selected], (1, cols - 1))
+    return out.tobytes()
+
+
+def _png_chunk(fp, chunk_type, data):
+    fp.write(struct.pack('>I', len(data)) + chunk_type + data)
+    fp.write(struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+
+def write_tiled_png(source, path, cols, rows=None, compress_level=6, optimize=False,
+                    strip_height=DEFAULT_STRIP_HEIGHT):
+    """
+    Encode *source* repeated in a cols x rows grid straight to a PNG file.
+
+    Args:
+        source: PIL image in L, LA, RGB or RGBA mode
+        path: Output .png path
+        cols: Number of times to repeat the image horizontally
+        rows: Number of times to repeat the image vertically (defaults to cols)
+        compress_level: zlib level, as for Image.save (ignored with optimize)
+        optimize: Same as Image.save(optimize=True): level 9 and the extra
+                  Average filter candidate
+        strip_height: Source rows processed per step
+
+    Returns:
+        *path*
+    """
+    rows = cols if rows is None else rows
+    pixels, bands = _source_pixels(source)
+    height, row_bytes = pixels.shape
+    width = row_bytes // bands
+    level = 9 if optimize else compress_level
+
+    # Pillow's PNG encoder compresses with the Z_FILTERED strategy
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, 9, zlib.Z_FILTERED)
+    block_size = max(_PNG_BLOCK_SIZE, width * cols * 4)
+    pending = bytearray()
+
+    with open(path, 'wb') as fp:
+        fp.write(PNG_SIGNATURE)
+        _png_chunk(fp, b'IHDR', struct.pack('>IIBBBBB', width * cols, height * rows, 8,
+                                            PNG_COLOR_TYPES[source.mode], 0, 0, 0))
+
+        # Row above each source row; the canvas starts from a row of zeros,
+        # every later repeat continues from the last source row.
+        wrapped_prev = np.roll(pixels, 1, axis=0)
+        for repeat in range(rows):
+            for top in range(0, height, strip_height):
+                strip = pixels[top:top + strip_height]
+                prev = wrapped_prev[top:top + strip_height]
+                if repeat == 0 and top == 0:
+                    prev = prev.copy()
+                    prev[0] = 0
+                pending += compressor.compress(_filter_strip(strip, prev, bands, cols, optimize))
+                while len(pending) >= block_size:
+                    _png_chunk(fp, b'IDAT', bytes(pending[:block_size]))
+                    del pending[:block_size]
+
+        pending += compressor.flush()
+        while pending:
+            _png_chunk(fp, b'IDAT', bytes(pending[:block_size]))
+            del pending[:block_size]
+        _png_chunk(fp, b'IEND', b'')
+
+    return path
+
+
+def write_tiled_tiff(source, path, cols, rows=None, strip_height=DEFAULT_STRIP_HEIGHT):
+    """
+    Write *source* repeated in a cols x rows grid as an uncompressed,
+    strip-organised little-endian TIFF.  Arguments match write_tiled_png.
+    """
+    rows = cols if rows is None else rows
+    pixels, bands = _source_pixels(source)
+    height, row_bytes = pixels.shape
+    width = row_bytes // bands
+    canvas_width, canvas_height = width * cols, height * rows
+    canvas_row_bytes = row_bytes * cols
+
+    strip_sizes = []
+    for top in range(0, canvas_height, strip_height):
+        strip_sizes.append(min(strip_height, canvas_height - top) * canvas_row_bytes)
+
+    photometric = 2 if source.mode in ('RGB', 'RGBA') else 1
+    entries = [
+        (256, 4, [canvas_width]),                  # ImageWidth
+        (257, 4, [canvas_height]),                 # ImageLength
+        (258, 3, [8] * bands),                     # BitsPerSample
+        (259, 3, [1]),                             # Compression: none
+        (262, 3, [photometric]),                   # PhotometricInterpretation
+        (273, 4, None),                            # StripOffsets (filled below)
+        (277, 3, [bands]),                         # SamplesPerPixel
+        (278, 4, [strip_height]),                  # RowsPerStrip
+        (279, 4, strip_sizes),                     # StripByteCounts
+        (284, 3, [1]),                             # PlanarConfiguration: chunky
+    ]
+    if source.mode in ('LA', 'RGBA'):
+        entries.append((338, 3, [2]))              # ExtraSamples: unassociated alpha
+
+    # Layout: header, IFD, out-of-line tag values, pixel data.
+    ifd_offset = 8
+    values_offset = ifd_offset + 2 + 12 * len(entries) + 4
+    strip_count = len(strip_sizes)
+    out_of_line = {}
+    cursor = values_offset
+    for tag, field_type, values in entries:
+        count = strip_count if tag == 273 else len(values)
+        size = count * (4 if field_type == 4 else 2)
+        if size > 4:
+            out_of_line[tag] = cursor
+            cursor += size
+    data_offset = cursor
+    strip_offsets = []
+    offset = data_offset
+    for size in strip_sizes:
+        strip_offsets.append(offset)
+        offset += size
+
+    with open(path, 'wb') as fp:
+        fp.write(b'II*\x00' + struct.pack('<I', ifd_offset))
+        fp.write(struct.pack('<H', len(entries)))
+        blobs = []
+        for tag, field_type, values in entries:
+            if tag == 273:
+                values = strip_offsets
+            fmt = '<%d%s' % (len(values), 'I' if field_type == 4 else 'H')
+            packed = struct.pack(fmt, *values)
+            if tag in out_of_line:
+                fp.write(struct.pack('<HHII', tag, field_type, len(values), out_of_line[tag]))
+                blobs.append(packed)
+            else:
+                fp.write(struct.pack('<HHI', tag, field_type, len(values)) + packed.ljust(4, b'\x00'))
+        fp.write(struct.pack('<I', 0))
+        for blob in blobs:
+            fp.write(blob)
+
+        for top in range(0, canvas_height, strip_height):
+            source_rows = np.arange(top, min(top + strip_height, canvas_height)) % height
+            fp.write(np.tile(pixels[source_rows], (1, cols)).tobytes())
+
+    return path
+
+
+def write_tiled(source, path, cols, rows=None, **save_options):
+    """Dispatch on the file extension (.png or .tif/.tiff)."""
+    if str(path).lower().endswith(('.tif', '.tiff')):
+        save_options.pop('optimize', None)
+        save_options.pop('compress_level', None)
+        return write_tiled_tiff(source, path, cols, rows, **save_options)
+    return write_tiled_png(source, path, cols, rows, **save_options)
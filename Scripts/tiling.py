@@ -0,0 +1,337 @@
+"""
+Grid tiling helpers shared by every tile producer (images.py, bag_processor.py,
+Images_1.py and the root-level bag scripts).
+
+For modes Pillow can wrap around an external buffer (see Image.frombuffer) the
+decoded pixels are repeated once with NumPy and the result is handed back to
+Pillow without another copy.
+
+RGB, the mode of every product tile (<handle>_6.png), keeps the paste loop and
+is no faster than before.  Pillow stores RGB as 4 bytes per pixel and each
+paste is already a straight row copy at memory speed; tiling a 3-band array,
+or an RGBX copy mapped back as RGB, measured no faster (image_benchmarks.py
+tiling).  What product tiles gain here is that one decode serves every grid
+size (create_tile_set), not a faster repeat.
+"""
+
+import io
+import logging
+import os
+
+import numpy as np
+from PIL import Image
+
+import raster_sidecar
+import tile_cache
+from tile_writer import PNG_COLOR_TYPES, write_tiled
+
+logger = logging.getLogger(__name__)
+
+# Modes Image.frombuffer() maps onto a NumPy buffer without unpacking it.
+_MAPPED_MODES = ('L', 'P', 'RGBA', 'CMYK', 'I;16')
+
+# Bag tiles are built from a source capped at this edge length to keep the
+# 3x3/4x4 canvases manageable in Photoshop.
+BAG_TILE_MAX_DIMENSION = 1000
+
+# Encoder settings by artifact class.  'final' is for files that are uploaded
+# or read by several stages and keeps Pillow's default PNG settings.  The rest
+# are for intermediates Photoshop reads once and the run then throws away:
+#   optimized - what the bag tiles historically used (level 9 + filter search)
+#   default   - zlib level 6, no optimize
+#   fast      - zlib level 1
+#   tiff      - uncompressed TIFF, no deflate at all
+ENCODE_PROFILES = {
+    'final': {'ext': '.png', 'save': {}},
+    'optimized': {'ext': '.png', 'save': {'optimize': True}},
+    'default': {'ext': '.png', 'save': {}},
+    'fast': {'ext': '.png', 'save': {'compress_level': 1}},
+    'tiff': {'ext': '.tif', 'save': {}},
+}
+DEFAULT_INTERMEDIATE_PROFILE = 'fast'
+
+# Downscales first shrink by an integer factor with Image.reduce (box filter)
+# while the image is still at least this many times the target size, then
+# finish with LANCZOS; see Image.resize(reducing_gap=...).  3.0 is visually
+# indistinguishable from a full LANCZOS pass.
+REDUCING_GAP = 3.0
+
+# Canvases of at least this many pixels are encoded strip by strip
+# (tile_writer.py) instead of being assembled in memory first.
+STREAM_MIN_PIXELS = 50_000_000
+
+
+def tile_array(pixels, cols, rows):
+    """Repeat a (height, width[, bands]) pixel array into a rows x cols grid."""
+    reps = (rows, cols) + (1,) * (pixels.ndim - 2)
+    return np.tile(pixels, reps)
+
+
+def _tile_with_paste(img, cols, rows):
+    width, height = img.size
+    tiled_img = Image.new(img.mode, (width * cols, height * rows))
+    for y in range(rows):
+        for x in range(cols):
+            tiled_img.paste(img, (x * width, y * height))
+    return tiled_img
+
+
+def _tile_with_numpy(img, cols, rows):
+    width, height = img.size
+    tiled = tile_array(np.asarray(img), cols, rows)
+    tiled_img = Image.frombuffer(img.mode, (width * cols, height * rows), tiled, 'raw', img.mode, 0, 1)
+    if img.mode == 'P':
+        tiled_img.putpalette(img.getpalette())
+        if 'transparency' in img.info:
+            tiled_img.info['transparency'] = img.info['transparency']
+    return tiled_img
+
+
+def tile_image(img, cols, rows=None, mode=None):
+    """
+    Return *img* repeated in a cols x rows grid.
+
+    Args:
+        img: Source PIL image (opened lazily is fine, it is loaded here)
+        cols: Number of times to repeat the image horizontally
+        rows: Number of times to repeat the image vertically (defaults to cols)
+        mode: Convert the source to this mode first (e.g. 'RGB' or 'RGBA'),
+              matching the old ``Image.new(mode, ...)`` + ``paste`` behaviour
+
+    Returns:
+        A new PIL image of size (width * cols, height * rows)
+    """
+    rows = cols if rows is None else rows
+    if cols < 1 or rows < 1:
+        raise ValueError(f"Invalid tile grid {cols}x{rows}")
+
+    if mode and img.mode != mode:
+        img = img.convert(mode)
+
+    if img.mode in _MAPPED_MODES:
+        return _tile_with_numpy(img, cols, rows)
+    return _tile_with_paste(img, cols, rows)
+
+
+def _target_size(size, max_dimension=None, max_pixels=None):
+    """Largest size within the edge and pixel caps, keeping the aspect ratio."""
+    width, height = size
+    ratio = 1.0
+    if max_dimension and (width > max_dimension or height > max_dimension):
+        ratio = min(max_dimension / width, max_dimension / height)
+    if max_pixels and width * height > max_pixels:
+        ratio = min(ratio, (max_pixels / (width * height)) ** 0.5)
+    if ratio >= 1.0:
+        return size
+    return (int(width * ratio), int(height * ratio))
+
+
+def _downscale(img, size):
+    if size == img.size:
+        return img
+    return img.resize(size, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+
+
+def fit_within(img, max_dimension):
+    """Downscale *img* so neither side exceeds *max_dimension*."""
+    return _downscale(img, _target_size(img.size, max_dimension))
+
+
+def open_image(source, max_dimension=None, max_pixels=None):
+    """
+    Open and load *source*, decoding no more pixels than the caps need.
+
+    A raster sidecar next to a path (see raster_sidecar.py) is memory-mapped
+    instead of decoding the file.  JPEGs are decoded at a reduced DCT scale
+    (Image.draft) that still covers the target size; other formats decode in
+    full.  The result is not resized, so it may still be larger than the caps
+    (see load_at_size).
+    """
+    if isinstance(source, (str, os.PathLike)):
+        sidecar = raster_sidecar.load_sidecar(source)
+        if sidecar is not None:
+            return sidecar
+    img = source if isinstance(source, Image.Image) else Image.open(source)
+    try:
+        target = _target_size(img.size, max_dimension, max_pixels)
+        if target != img.size and img.format == 'JPEG':
+            img.draft(img.mode, target)
+        img.load()
+    except Exception:
+        if img is not source:
+            img.close()
+        raise
+    return img
+
+
+def load_at_size(source, max_dimension=None, max_pixels=None):
+    """
+    Load *source* no larger than *max_dimension* per side and *max_pixels* in
+    total: draft decode, integer pre-shrink with Image.reduce, then LANCZOS.
+
+    Args:
+        source: Path or file object of the image, or an opened image that
+                has not been loaded yet
+        max_dimension: Cap on the longer edge, or None
+        max_pixels: Cap on width * height, or None
+
+    Returns:
+        A loaded PIL image (the caller owns it and should close it)
+    """
+    img = open_image(source, max_dimension, max_pixels)
+    resized = _downscale(img, _target_size(img.size, max_dimension, max_pixels))
+    if resized is not img:
+        img.close()
+    return resized
+
+
+def bag_tile_specs(output_dir, base_name, profile=DEFAULT_INTERMEDIATE_PROFILE):
+    """
+    Specs for the 3x3 (Bags 1, 3, 7) and 4x4 (Bags 4, 5, 6) tiles read by bags.jsx.
+    *profile* is one of ENCODE_PROFILES; these tiles are intermediates.
+    """
+    encode = ENCODE_PROFILES[profile]
+    return [
+        {
+            'cols': n,
+            'rows': n,
+            'max_dimension': BAG_TILE_MAX_DIMENSION,
+            'save': dict(encode['save']),
+            'path': os.path.join(output_dir, f"{base_name}_{n}{encode['ext']}"),
+        }
+        for n in (3, 4)
+    ]
+
+
+def product_tile_specs(output_dir, base_name, tile_size=6, intermediate_profile=DEFAULT_INTERMEDIATE_PROFILE):
+    """
+    Every tile one product needs: the RGB tile_size x tile_size tile used by
+    source3.jsx, tissues.jsx, tablerunners.jsx and the PDF generator, followed
+    by the bag tiles.  The main tile is always first in the list.
+
+    The main tile is also uploaded to S3, so it keeps the 'final' profile;
+    *intermediate_profile* only applies to the bag tiles.
+    """
+    specs = [{
+        'cols': tile_size,
+        'rows': tile_size,
+        'mode': 'RGB',
+        'save': dict(ENCODE_PROFILES['final']['save']),
+        'path': os.path.join(output_dir, f"{base_name}_{tile_size}{ENCODE_PROFILES['final']['ext']}"),
+    }]
+    specs.extend(spec for spec in bag_tile_specs(output_dir, base_name, intermediate_profile)
+                 if spec['cols'] != tile_size)
+    return specs
+
+
+def _should_stream(img, spec):
+    """Stream large canvases unless the spec says otherwise ('stream': True/False)."""
+    streamable = (
+        img.mode in PNG_COLOR_TYPES
+        and spec['path'].lower().endswith(('.png', '.tif', '.tiff'))
+        and set(spec.get('save', {})) <= {'optimize', 'compress_level'}
+    )
+    if spec.get('stream') is not None:
+        return spec['stream'] and streamable
+    return streamable and img.width * spec['cols'] * img.height * spec['rows'] >= STREAM_MIN_PIXELS
+
+
+def create_tile_set(source, specs, cache_dir=None, cache_max_bytes=None, source_hash=None,
+                    source_sidecar=False):
+    """
+    Decode *source* once and write every requested grid from that one buffer.
+
+    Args:
+        source: Path to the source image, its encoded bytes (e.g. straight
+                from a download), or an already opened PIL image
+        specs: List of dicts with 'cols', 'rows' and 'path', plus optional
+               'max_dimension' (cap on the source edge before tiling), 'mode',
+               'save' (extra keyword arguments for Image.save), 'stream'
+               (force or disable the strip writer; default is by canvas size)
+               and 'sidecar' (also write a raster sidecar for the tile)
+        cache_dir: Tile cache folder (see tile_cache.py); None disables caching
+        cache_max_bytes: Size limit enforced on the cache after new entries
+        source_hash: SHA-256 of the source bytes; computed from the file when
+                     *source* is a path or bytes and caching is enabled
+        source_sidecar: Write a raster sidecar for the source file when it is
+                        decoded here at full resolution
+
+    Returns:
+        List of written paths, in the same order as *specs*
+    """
+    is_path = isinstance(source, (str, os.PathLike))
+    is_bytes = isinstance(source, (bytes, bytearray))
+
+    # Sidecars describe the file they sit next to; drop them before any
+    # tile is replaced (a cache hit swaps the file without a decode).
+    for spec in specs:
+        raster_sidecar.remove_sidecar(spec['path'])
+
+    # Serve what we can from the cache; only the misses need a decode.
+    keys = {}
+    pending = list(specs)
+    if cache_dir and (source_hash or is_path or is_bytes):
+        if not source_hash:
+            source_hash = tile_cache.hash_bytes(source) if is_bytes else tile_cache.hash_file(source)
+        pending = []
+        for spec in specs:
+            keys[spec['path']] = tile_cache.tile_key(source_hash, spec)
+            if tile_cache.fetch(cache_dir, keys[spec['path']], spec['path']):
+                logger.info(f"Tile cache hit for {spec['cols']}x{spec['rows']} tile: {spec['path']}")
+                if spec.get('sidecar'):
+                    tile_cache.fetch(cache_dir, keys[spec['path']], raster_sidecar.sidecar_path(spec['path']))
+            else:
+                pending.append(spec)
+
+    if pending:
+        if is_path or is_bytes:
+            # Draft-decode JPEGs straight to the cap when no spec needs the
+            # full resolution (e.g. bag tiles only).
+            caps = [spec.get('max_dimension') for spec in pending]
+            full_resolution = not all(caps)
+            img = open_image(io.BytesIO(source) if is_bytes else source, None if full_resolution else max(caps))
+            if source_sidecar and is_path and full_resolution and img.format is not None:
+                raster_sidecar.write_sidecar(source, img)
+        else:
+            img = source
+        try:
+            img.load()
+            # Downscaled / converted sources are shared between specs that ask for
+            # the same cap and mode (e.g. the 3x3 and 4x4 bag tiles).
+            variants = {}
+            for spec in pending:
+                key = (spec.get('max_dimension'), spec.get('mode'))
+                if key not in variants:
+                    variant = img
+                    if key[0]:
+                        variant = fit_within(variant, key[0])
+                    if key[1] and variant.mode != key[1]:
+                        variant = variant.convert(key[1])
+                    variants[key] = variant
+
+                if spec['path'] in keys and os.path.exists(spec['path']):
+                    # May be a hard link into the cache; never write through it
+                    os.remove(spec['path'])
+
+                if _should_stream(variants[key], spec):
+                    write_tiled(variants[key], spec['path'], spec['cols'], spec['rows'], **spec.get('save', {}))
+                else:
+                    tiled = tile_image(variants[key], spec['cols'], spec['rows'])
+                    tiled.save(spec['path'], **spec.get('save', {}))
+                sidecar = None
+                if spec.get('sidecar'):
+                    sidecar = raster_sidecar.write_sidecar(spec['path'], variants[key], spec['cols'], spec['rows'])
+                logger.info(f"Created {spec['cols']}x{spec['rows']} tile: {spec['path']}")
+
+                if spec['path'] in keys:
+                    tile_cache.store(cache_dir, keys[spec['path']], spec['path'])
+                    if sidecar:
+                        tile_cache.store(cache_dir, keys[spec['path']], sidecar)
+        finally:
+            if img is not source:
+                img.close()
+
+        if keys:
+            tile_cache.evict(cache_dir, cache_max_bytes or tile_cache.DEFAULT_MAX_BYTES)
+
+    return [spec['path'] for spec in specs]
@@ -0,0 +1,153 @@
+"""
+Local record of what is already in S3, so unchanged files are not uploaded
+again.
+
+For every key we have published the manifest keeps (size, MD5, ETag).
+Before the first check under a prefix in a run, that prefix is listed once
+with ListObjectsV2 (a page per 1,000 keys) and the records are reconciled
+with it: an object whose ETag and size still match keeps its MD5, a
+single-part object's ETag is its MD5 and is taken as is, and anything else
+(changed multipart objects, deleted keys) is forgotten.  A file is skipped
+only when its size and MD5 match a reconciled record, and a file whose
+bytes are already in the bucket under another key confirmed this run (a
+listed prefix, or an upload made by this process) can be copied there
+server-side with find_copy().
+
+The manifest is a JSON file shared by every script that publishes through
+s3_publisher.py.  It is written when the process exits.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+_MD5_ETAG = re.compile(r'[0-9a-f]{32}')
+
+
+def _prefix_of(s3_key):
+    return s3_key.rsplit('/', 1)[0] + '/' if '/' in s3_key else ''
+
+
+class UploadManifest:
+    """(size, MD5, ETag) of published objects, keyed by bucket and key."""
+
+    def __init__(self, path):
+        self.path = path
+        self.objects = {}
+        self.skipped = 0
+        self.bytes_saved = 0
+        self.requests_saved = 0
+        self.copied = 0
+        self.list_requests = 0
+        self._dirty = False
+        self._listed = {}
+        self._verified = set()  # records confirmed against S3 this run
+        self._lock = threading.Lock()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == MANIFEST_VERSION:
+                self.objects = data.get('objects', {})
+        except (OSError, ValueError):
+            pass
+
+    def _refresh(self, client, bucket_name, prefix):
+        """List *prefix* once and reconcile the records under it.  Returns
+        False when the listing failed, in which case nothing there is trusted."""
+        listed = {}
+        try:
+            paginator = client.get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+                self.list_requests += 1
+                for obj in page.get('Contents', []):
+                    listed[obj['Key']] = (obj['Size'], obj['ETag'].strip('"'))
+        except Exception as e:
+            logger.warning(f"Could not list s3://{bucket_name}/{prefix}; uploading everything there: {e}")
+            return False
+
+        base = f"{bucket_name}/{prefix}"
+        for name in [name for name in self.objects if name.startswith(base)]:
+            if name[len(bucket_name) + 1:] not in listed:
+                del self.objects[name]
+        for key, (size, etag) in listed.items():
+            name = f"{bucket_name}/{key}"
+            record = self.objects.get(name)
+            if record and record['etag'] == etag and record['size'] == size:
+                continue
+            if _MD5_ETAG.fullmatch(etag):
+                self.objects[name] = {'size': size, 'md5': etag, 'etag': etag}
+            else:
+                self.objects.pop(name, None)
+        self._verified.update(f"{bucket_name}/{key}" for key in listed)
+        self._dirty = True
+        return True
+
+    def unchanged(self, client, bucket_name, s3_key, size, md5):
+        """True when S3 already holds exactly this file at *s3_key*."""
+        prefix = _prefix_of(s3_key)
+        with self._lock:
+            if (bucket_name, prefix) not in self._listed:
+                self._listed[(bucket_name, prefix)] = self._refresh(client, bucket_name, prefix)
+            if not self._listed[(bucket_name, prefix)]:
+                return False
+            record = self.objects.get(f"{bucket_name}/{s3_key}")
+            return bool(record) and record['size'] == size and record['md5'] == md5
+
+    def record(self, bucket_name, s3_key, size, md5, etag):
+        """Note a completed upload."""
+        with self._lock:
+            self.objects[f"{bucket_name}/{s3_key}"] = {'size': size, 'md5': md5, 'etag': etag.strip('"')}
+            self._verified.add(f"{bucket_name}/{s3_key}")
+            self._dirty = True
+
+    def find_copy(self, bucket_name, s3_key, size, md5):
+        """Another key in *bucket_name* confirmed this run to hold exactly
+        these bytes, or None."""
+        with self._lock:
+            for name in self._verified:
+                record = self.objects.get(name)
+                if (record and record['size'] == size and record['md5'] == md5
+                        and name.startswith(f"{bucket_name}/") and name != f"{bucket_name}/{s3_key}"):
+                    return name[len(bucket_name) + 1:]
+        return None
+
+    def count_skip(self, size, requests):
+        with self._lock:
+            self.skipped += 1
+            self.bytes_saved += size
+            self.requests_saved += requests
+
+    def count_copy(self, size):
+        with self._lock:
+            self.copied += 1
+            self.bytes_saved += size
+
+    def save(self):
+        """Write the manifest if it changed (atomically, so a crash never
+        leaves half a file)."""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            data = {'version': MANIFEST_VERSION, 'objects': dict(self.objects)}
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp = f"{self.path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save upload manifest {self.path}: {e}")
+
+    def summary(self):
+        """One-line report of what skipping unchanged files saved."""
+        return (f"Skipped {self.skipped} unchanged uploads and copied {self.copied} inside S3: "
+                f"{self.bytes_saved / 1024 ** 2:.1f} MB and {self.requests_saved} requests saved, "
+                f"{self.list_requests} list requests made")
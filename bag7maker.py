@@ -1,5 +1,6 @@
 from PIL import Image
 import os
+import sys
 import time
 import subprocess
 import logging
@@ -8,6 +9,10 @@ import traceback
 from pathlib import Path
 from config import BASE_FOLDER, OUTPUT_BASE_FOLDER, BAGS_FOLDER
 
+# The shared tiling engine lives in Scripts/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Scripts'))
+from tiling import tile_image
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -36,20 +41,8 @@ def create_image_tile(input_image_path, width_count, height_count, output_filena
         logging.error(f"Error opening image: {e}")
         return None
     
-    # Get original image dimensions
-    orig_width, orig_height = original_img.size
-    
-    # Calculate the dimensions for the new tiled image
-    new_width = orig_width * width_count
-    new_height = orig_height * height_count
-    
-    # Create a new blank image with the calculated dimensions
-    tiled_img = Image.new('RGBA', (new_width, new_height), (0, 0, 0, 0))
-    
-    # Paste the original image multiple times to create the tile pattern
-    for y in range(height_count):
-        for x in range(width_count):
-            tiled_img.paste(original_img, (x * orig_width, y * orig_height))
+    # Repeat the original image in a width_count x height_count grid
+    tiled_img = tile_image(original_img, width_count, height_count, mode='RGBA')
     
     # Save the resulting image
     tiled_img.save(output_filename)
@@ -1,5 +1,10 @@
 from PIL import Image
 import os
+import sys
+
+# The shared tiling engine lives in Scripts/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Scripts'))
+from tiling import create_tile_set, tile_image
 
 def create_image_tile(input_image_path, width_count, height_count, output_filename):
     """
@@ -18,20 +23,8 @@ def create_image_tile(input_image_path, width_count, height_count, output_filena
         print(f"Error opening image: {e}")
         return
     
-    # Get original image dimensions
-    orig_width, orig_height = original_img.size
-    
-    # Calculate the dimensions for the new tiled image
-    new_width = orig_width * width_count
-    new_height = orig_height * height_count
-    
-    # Create a new blank image with the calculated dimensions
-    tiled_img = Image.new('RGBA', (new_width, new_height), (0, 0, 0, 0))
-    
-    # Paste the original image multiple times to create the tile pattern
-    for y in range(height_count):
-        for x in range(width_count):
-            tiled_img.paste(original_img, (x * orig_width, y * orig_height))
+    # Repeat the original image in a width_count x height_count grid
+    tiled_img = tile_image(original_img, width_count, height_count, mode='RGBA')
     
     # Save the resulting image
     tiled_img.save(output_filename)
@@ -46,11 +39,12 @@ def main():
     filename_4x4 = os.path.join(directory, "Sleigh_Ball_4x4_tile.png")
     filename_1x3 = os.path.join(directory, "Sleigh_Ball_1x3_tile.png")
     
-    # Create the 4x4 tiled image
-    create_image_tile(input_image_path, 4, 4, filename_4x4)
-    
-    # Create the 1x3 tiled image
-    create_image_tile(input_image_path, 1, 3, filename_1x3)
+    # Create the 4x4 and 1x3 tiled images from a single decode
+    create_tile_set(input_image_path, [
+        {'cols': 4, 'rows': 4, 'mode': 'RGBA', 'path': filename_4x4},
+        {'cols': 1, 'rows': 3, 'mode': 'RGBA', 'path': filename_1x3},
+    ])
+    print(f"Created tiled images: {filename_4x4}, {filename_1x3}")
     
     print("All tiling operations completed!")
 
@@ -1,5 +1,6 @@
 from PIL import Image
 import os
+import sys
 import time
 import subprocess
 import logging
@@ -7,6 +8,10 @@ import datetime
 import traceback
 from pathlib import Path
 
+# The shared tiling engine lives in Scripts/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Scripts'))
+from tiling import create_tile_set, tile_image
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -35,20 +40,8 @@ def create_image_tile(input_image_path, width_count, height_count, output_filena
         logging.error(f"Error opening image: {e}")
         return None
     
-    # Get original image dimensions
-    orig_width, orig_height = original_img.size
-    
-    # Calculate the dimensions for the new tiled image
-    new_width = orig_width * width_count
-    new_height = orig_height * height_count
-    
-    # Create a new blank image with the calculated dimensions
-    tiled_img = Image.new('RGBA', (new_width, new_height), (0, 0, 0, 0))
-    
-    # Paste the original image multiple times to create the tile pattern
-    for y in range(height_count):
-        for x in range(width_count):
-            tiled_img.paste(original_img, (x * orig_width, y * orig_height))
+    # Repeat the original image in a width_count x height_count grid
+    tiled_img = tile_image(original_img, width_count, height_count, mode='RGBA')
     
     # Save the resulting image
     tiled_img.save(output_filename)
@@ -618,12 +611,12 @@ def process_all_bag_templates(input_image_path):
         output_bag5_path = os.path.join(input_dir, f"{filename_without_ext}_bag5.png")
         output_bag6_path = os.path.join(input_dir, f"{filename_without_ext}_bag6.png")
         
-        # Create the tiled images
-        logging.info("Creating 4x4 tiled image...")
-        create_image_tile(input_image_path, 4, 4, image_4x4_path)
-        
-        logging.info("Creating 1x3 tiled image...")
-        create_image_tile(input_image_path, 1, 3, image_1x3_path)
+        # Create the 4x4 and 1x3 tiled images from a single decode
+        logging.info("Creating 4x4 and 1x3 tiled images...")
+        create_tile_set(input_image_path, [
+            {'cols': 4, 'rows': 4, 'mode': 'RGBA', 'path': image_4x4_path},
+            {'cols': 1, 'rows': 3, 'mode': 'RGBA', 'path': image_1x3_path},
+        ])
         
         # Create JSX script
         jsx_script = create_jsx_script(image_4x4_path, image_1x3_path, input_dir, filename_without_ext)
@@ -1,5 +1,6 @@
 from PIL import Image
 import os
+import sys
 import time
 import subprocess
 import json
@@ -11,6 +12,10 @@ import datetime
 import traceback
 from config import BASE_FOLDER, OUTPUT_BASE_FOLDER, BAGS_FOLDER
 
+# The shared tiling engine lives in Scripts/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Scripts'))
+from tiling import tile_image
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -24,18 +29,8 @@ logging.basicConfig(
 def create_tiled_image(original_img, tile_size):
     """Create a tiled image with specified tile size (e.g., 3x3 or 6x6)"""
     try:
-        # Get the dimensions of the original image
-        width, height = original_img.size
-        
-        # Create a new image that is tile_size times as large in both dimensions
-        tiled_img = Image.new(original_img.mode, (width * tile_size, height * tile_size))
-        
-        # Paste the original image into a tile_size x tile_size grid
-        for i in range(tile_size):
-            for j in range(tile_size):
-                tiled_img.paste(original_img, (i * width, j * height))
-        
-        return tiled_img
+        # Repeat the original image into a tile_size x tile_size grid
+        return tile_image(original_img, tile_size)
     except Exception as e:
         logging.error(f"Error creating tiled image: {e}")
         logging.exception("Exception details:")
@@ -1,8 +1,12 @@
 import requests
 import json
 import os
+import sys
 from dotenv import load_dotenv
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Scripts'))
+from shopify_client import ShopifyClient
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -16,11 +20,9 @@ SHOPIFY_API_VERSION = os.getenv('SHOPIFY_API_VERSION', '2025-01')  # Default to
 if not all([SHOPIFY_API_KEY, SHOPIFY_PASSWORD, SHOPIFY_STORE_NAME]):
     raise RuntimeError("Missing one or more required Shopify environment variables: SHOPIFY_API_KEY, SHOPIFY_PASSWORD, SHOPIFY_STORE")
 
-SHOPIFY_API_BASE = f"https://{SHOPIFY_STORE_NAME}.myshopify.com/admin/api/{SHOPIFY_API_VERSION}"
-SHOPIFY_HEADERS = {
-    'X-Shopify-Access-Token': SHOPIFY_PASSWORD,
-    'Content-Type': 'application/json'
-}
+# Pooled, rate-limited client for every Shopify call (see Scripts/shopify_client.py)
+shopify = ShopifyClient(SHOPIFY_STORE_NAME, SHOPIFY_PASSWORD, SHOPIFY_API_VERSION)
+SHOPIFY_API_BASE = shopify.api_base
 
 def check_product_metafields(handle):
     """Check all metafields for a product by handle"""
@@ -28,7 +30,7 @@ def check_product_metafields(handle):
     # First get the product
     url = f'{SHOPIFY_API_BASE}/products.json?handle={handle}'
     try:
-        response = requests.get(url, headers=SHOPIFY_HEADERS, timeout=30)
+        response = shopify.get(url)
         response.raise_for_status()
         products = response.json().get('products', [])
         
@@ -42,7 +44,7 @@ def check_product_metafields(handle):
         
         # Get all metafields for this product
         metafields_url = f'{SHOPIFY_API_BASE}/products/{product_id}/metafields.json'
-        meta_response = requests.get(metafields_url, headers=SHOPIFY_HEADERS, timeout=30)
+        meta_response = shopify.get(metafields_url)
         meta_response.raise_for_status()
         metafields = meta_response.json().get('metafields', [])
         
@@ -1,11 +1,20 @@
 import sys
 import json
+import importlib.util
 import requests
 import logging
 import re
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
+SCRIPTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Scripts')
+sys.path.append(SCRIPTS_FOLDER)
+from aa_id_cache import AaIdCache
+from shopify_client import ShopifyClient
+from shopify_lookup import find_products, node_aa_id, parse_aa_id
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -19,29 +28,162 @@ SHOPIFY_API_VERSION = os.getenv('SHOPIFY_API_VERSION', '2025-01')  # Default to
 if not all([SHOPIFY_API_KEY, SHOPIFY_PASSWORD, SHOPIFY_STORE_NAME]):
     raise RuntimeError("Missing one or more required Shopify environment variables: SHOPIFY_API_KEY, SHOPIFY_PASSWORD, SHOPIFY_STORE")
 
-SHOPIFY_API_BASE = f"https://{SHOPIFY_STORE_NAME}.myshopify.com/admin/api/{SHOPIFY_API_VERSION}"
-SHOPIFY_HEADERS = {
-    'X-Shopify-Access-Token': SHOPIFY_PASSWORD,
-    'Content-Type': 'application/json'
+# Pooled, rate-limited client for every Shopify call (see Scripts/shopify_client.py)
+shopify = ShopifyClient(SHOPIFY_STORE_NAME, SHOPIFY_PASSWORD, SHOPIFY_API_VERSION)
+SHOPIFY_API_BASE = shopify.api_base
+
+# Products whose mock-ups are attached at once
+PRODUCT_WORKERS = 4
+
+# basesku metafields written per metafieldsSet mutation (Shopify's maximum)
+METAFIELDS_PER_MUTATION = 25
+
+# Print every metafield of each product after the update (one more request
+# per product); set DEBUG_METAFIELDS=1 to enable
+DEBUG_METAFIELDS = os.getenv('DEBUG_METAFIELDS', '').lower() in ('1', 'true', 'yes')
+
+METAFIELDS_SET_MUTATION = """
+mutation ($metafields: [MetafieldsSetInput!]!) {
+  metafieldsSet(metafields: $metafields) {
+    metafields { owner { ... on Product { id } } key value }
+    userErrors { field message code }
+  }
 }
+"""
+
+_print_lock = threading.Lock()
+
+def load_scripts_config():
+    """Scripts/config.py, loaded by path: the config.py next to this script
+    would shadow it on an ordinary import."""
+    spec = importlib.util.spec_from_file_location('scripts_config', os.path.join(SCRIPTS_FOLDER, 'config.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+scripts_config = load_scripts_config()
+
+# AA ids written here go straight into the lookup cache the other stages read
+aa_id_cache = AaIdCache(scripts_config.AA_ID_CACHE_PATH, scripts_config.AA_ID_CACHE_TTL,
+                        scripts_config.AA_ID_CACHE_NEGATIVE_TTL)
 
 def print_json(data):
     """Print JSON data for the Node.js server to parse"""
-    print(json.dumps(data, separators=(',', ':')))
-    sys.stdout.flush()
+    line = json.dumps(data, separators=(',', ':'))
+    # Products are processed on several threads; keep each line whole
+    with _print_lock:
+        print(line)
+        sys.stdout.flush()
 
-def get_or_create_metafield(product_id, base_sku_value):
-    """Get existing metafield or create new one with basesku key (no underscore!)"""
-    
-    # Get all metafields for the product
+def basesku_value(existing_value, base_sku_value):
+    """
+    Value to write to custom.basesku (no underscore!), or None to leave it.
+
+    An existing AA product ID is never overwritten with a product name, and
+    the value is cut or space-padded to exactly 8 characters.
+    """
+    if existing_value is not None:
+        existing = existing_value.strip()
+        print_json({"debug": f"Found existing basesku metafield: {existing}"})
+
+        # If the existing value is an AA product ID (starts with AA and has 6+ chars), keep it
+        # If the new value is just a product name, don't overwrite the AA product ID
+        if existing.startswith('AA') and len(existing) >= 8:
+            if base_sku_value == existing:
+                print_json({"debug": "Values match, no update needed"})
+                return None
+            elif not base_sku_value.startswith('AA'):
+                print_json({"debug": f"Keeping existing AA product ID '{existing}' instead of overwriting with '{base_sku_value}'"})
+                return None
+    else:
+        print_json({"debug": "No existing basesku metafield found, creating new one"})
+
+    # Ensure value is exactly 8 characters but preserve meaningful content
+    if len(base_sku_value) > 8:
+        adjusted_value = base_sku_value[:8]  # Truncate if too long
+    elif len(base_sku_value) < 8:
+        # Pad with spaces instead of zeros to preserve readability
+        adjusted_value = base_sku_value.ljust(8, ' ')
+    else:
+        adjusted_value = base_sku_value  # Perfect length
+
+    if adjusted_value == existing_value:
+        print_json({"debug": "Values match, no update needed"})
+        return None
+    return adjusted_value
+
+def set_basesku_metafields(updates):
+    """
+    Upsert custom.basesku on many products with metafieldsSet, up to
+    METAFIELDS_PER_MUTATION per request.
+
+    Args:
+        updates: Dict of product GID -> value
+
+    Returns:
+        Dict of product GID -> None when the mutation response confirms the
+        value, else an error message
+    """
+    results = {}
+    pending = list(updates.items())
+    for start in range(0, len(pending), METAFIELDS_PER_MUTATION):
+        batch = pending[start:start + METAFIELDS_PER_MUTATION]
+        # The mutation is all or nothing: on validation errors, drop the
+        # inputs they name and send the rest once more
+        for attempt in range(2):
+            if not batch:
+                break
+            inputs = [{
+                'ownerId': owner_id,
+                'namespace': 'custom',
+                'key': 'basesku',  # Changed from base_sku to basesku
+                'value': value,
+                'type': 'single_line_text_field',
+            } for owner_id, value in batch]
+            print_json({"debug": f"Setting basesku on {len(inputs)} products with metafieldsSet"})
+            try:
+                # metafieldsSet is an upsert, so a resend after a dropped connection is harmless
+                data = shopify.graphql(METAFIELDS_SET_MUTATION, {'metafields': inputs}, cost=10,
+                                       idempotent=True)['metafieldsSet']
+            except Exception as e:
+                for owner_id, _ in batch:
+                    results[owner_id] = f"metafieldsSet failed: {str(e)}"
+                break
+
+            errors = data.get('userErrors') or []
+            if not errors:
+                saved = {mf['owner']['id']: mf['value'] for mf in data.get('metafields') or [] if mf.get('owner')}
+                for owner_id, value in batch:
+                    # Shopify may trim the padding; compare the content
+                    if (saved.get(owner_id) or '').strip() == value.strip():
+                        results[owner_id] = None
+                    else:
+                        results[owner_id] = f"metafieldsSet returned {saved.get(owner_id)!r}, expected {value!r}"
+                break
+
+            failed = set()
+            for error in errors:
+                field = error.get('field') or []
+                index = int(field[1]) if len(field) > 1 and str(field[1]).isdigit() else None
+                if index is not None and index < len(batch):
+                    failed.add(index)
+                    results[batch[index][0]] = f"{error.get('code')}: {error.get('message')}"
+            if not failed or attempt:
+                for owner_id, _ in batch:
+                    results.setdefault(owner_id, f"metafieldsSet errors: {errors}")
+                break
+            batch = [entry for index, entry in enumerate(batch) if index not in failed]
+    return results
+
+def dump_metafields(product_id):
+    """Print every metafield of the product (DEBUG_METAFIELDS only)."""
     metafields_url = f'{SHOPIFY_API_BASE}/products/{product_id}/metafields.json'
-    response = requests.get(metafields_url, headers=SHOPIFY_HEADERS, timeout=30)
+    response = shopify.get(metafields_url)
     response.raise_for_status()
     metafields = response.json().get('metafields', [])
-    
+
     print_json({"debug": f"ALL_METAFIELDS", "product_id": product_id, "count": len(metafields)})
-    
-    # Print all metafields for debugging
+
     for mf in metafields:
         print_json({
             "debug": "METAFIELD_DETAIL",
@@ -50,169 +192,99 @@ def get_or_create_metafield(product_id, base_sku_value):
             "value": mf.get('value'),
             "type": mf.get('type')
         })
-    
-    # Look for existing basesku metafield (without underscore!)
-    existing_metafield = None
-    for mf in metafields:
-        if mf.get('namespace') == 'custom' and mf.get('key') == 'basesku':  # Changed from base_sku to basesku
-            existing_metafield = mf
-            break
-    
-    if existing_metafield:
-        existing_value = existing_metafield['value'].strip()
-        print_json({"debug": f"Found existing basesku metafield: {existing_value}"})
-        
-        # If the existing value is an AA product ID (starts with AA and has 6+ chars), keep it
-        # If the new value is just a product name, don't overwrite the AA product ID
-        if existing_value.startswith('AA') and len(existing_value) >= 8:
-            if base_sku_value == existing_value:
-                print_json({"debug": "Values match, no update needed"})
-                return existing_metafield
-            elif not base_sku_value.startswith('AA'):
-                print_json({"debug": f"Keeping existing AA product ID '{existing_value}' instead of overwriting with '{base_sku_value}'"})
-                return existing_metafield
-        
-        # Update the existing metafield
-        metafield_id = existing_metafield['id']
-        update_url = f'{SHOPIFY_API_BASE}/metafields/{metafield_id}.json'
-        
-        # Ensure value is exactly 8 characters but preserve meaningful content
-        if len(base_sku_value) > 8:
-            adjusted_value = base_sku_value[:8]  # Truncate if too long
-        elif len(base_sku_value) < 8:
-            # Pad with spaces instead of zeros to preserve readability
-            adjusted_value = base_sku_value.ljust(8, ' ')
-        else:
-            adjusted_value = base_sku_value  # Perfect length
-        
-        update_data = {
-            'metafield': {
-                'id': metafield_id,
-                'value': adjusted_value,
-                'type': 'single_line_text_field'
-            }
-        }
-        
-        print_json({"debug": f"Updating metafield {metafield_id} with data: {update_data}"})
-        
-        response = requests.put(update_url, json=update_data, headers=SHOPIFY_HEADERS, timeout=30)
-        print_json({"debug": f"PUT response status: {response.status_code}"})
-        print_json({"debug": f"PUT response body: {response.text}"})
-        
-        if response.status_code == 200:
-            return response.json()['metafield']
-        else:
-            print_json({"error": f"Failed to update metafield: {response.status_code} - {response.text}"})
-            return None
-    else:
-        print_json({"debug": "No existing basesku metafield found, creating new one"})
-        
-        # Create new metafield with basesku key (no underscore!)
-        create_url = f'{SHOPIFY_API_BASE}/products/{product_id}/metafields.json'
-        
-        # Ensure value is exactly 8 characters but preserve meaningful content
-        if len(base_sku_value) > 8:
-            adjusted_value = base_sku_value[:8]  # Truncate if too long
-        elif len(base_sku_value) < 8:
-            # Pad with spaces instead of zeros to preserve readability
-            adjusted_value = base_sku_value.ljust(8, ' ')
-        else:
-            adjusted_value = base_sku_value  # Perfect length
-        
-        create_data = {
-            'metafield': {
-                'namespace': 'custom',
-                'key': 'basesku',  # Changed from base_sku to basesku
-                'value': adjusted_value,
-                'type': 'single_line_text_field'
-            }
-        }
-        
-        print_json({"debug": f"Creating metafield with data: {create_data}"})
-        
-        response = requests.post(create_url, json=create_data, headers=SHOPIFY_HEADERS, timeout=30)
-        print_json({"debug": f"POST response status: {response.status_code}"})
-        print_json({"debug": f"POST response body: {response.text}"})
-        
-        if response.status_code == 201:
-            return response.json()['metafield']
-        else:
-            print_json({"error": f"Failed to create metafield: {response.status_code} - {response.text}"})
-            return None
 
-def process_product(product_data):
-    """Process a single product and update its metafields and images"""
-    
+def plan_product(product_data, product):
+    """
+    Print the product's opening status lines and work out its basesku
+    write.  *product* is its node from find_products().  Returns the value
+    to write, or None.
+    """
     product_name = product_data.get('name')
-    product_handle = product_data.get('handle')
     base_sku = product_data.get('base_sku')
-    
+
+    print_json({"status": "processing", "product": product_name})
+    print_json({"debug": f"Found product: {product['title']} (ID: {product['legacyResourceId']})"})
+
     # Skip metafield update if base_sku is just the product name
     # We only want to update if we have an actual AA product ID
     if base_sku == product_name:
         print_json({"debug": f"Skipping metafield update - base_sku '{base_sku}' matches product name"})
-        skip_metafield_update = True
-    else:
-        skip_metafield_update = False
-    
-    print_json({"status": "processing", "product": product_name})
-    print_json({"debug": f"Searching for product with handle: {product_handle}"})
-    
-    # Find the product by handle
-    url = f'{SHOPIFY_API_BASE}/products.json?handle={product_handle}'
+        print_json({"debug": "Skipping metafield update - keeping existing AA product ID"})
+        return None
+
+    return basesku_value((product.get('basesku') or {}).get('value'), base_sku)
+
+def finish_product(product_data, product, written, metafield_error):
+    """Attach the product's mock-ups and print its final status.  *written*
+    is the basesku value set for it (None if left as it was)."""
+    product_name = product_data.get('name')
+    product_id = product['legacyResourceId']
     try:
-        response = requests.get(url, headers=SHOPIFY_HEADERS, timeout=30)
-        response.raise_for_status()
-        products = response.json().get('products', [])
-        
-        if not products:
-            print_json({"debug": f"No product found with handle: {product_handle}"})
-            print_json({"status": "not_found", "product": product_name})
-            return
-            
-        product = products[0]
-        product_id = product['id']
-        print_json({"debug": f"Found product: {product['title']} (ID: {product_id})"})
-        
-        # Only update the metafield if we have a proper AA product ID, not just the product name
-        if not skip_metafield_update:
-            # Update the metafield
-            metafield_result = get_or_create_metafield(product_id, base_sku)
-        else:
-            print_json({"debug": "Skipping metafield update - keeping existing AA product ID"})
-            metafield_result = True  # Simulate success
-        
         # Process mockup images if they exist
         process_product_images(product_data, product_id)
-        
-        if metafield_result:
-            print_json({"debug": "Metafields after update:"})
-            
-            # Verify the update by fetching metafields again
-            metafields_url = f'{SHOPIFY_API_BASE}/products/{product_id}/metafields.json'
-            response = requests.get(metafields_url, headers=SHOPIFY_HEADERS, timeout=30)
-            response.raise_for_status()
-            metafields = response.json().get('metafields', [])
-            
-            print_json({"debug": f"ALL_METAFIELDS", "product_id": product_id, "count": len(metafields)})
-            
-            for mf in metafields:
-                print_json({
-                    "debug": "METAFIELD_DETAIL",
-                    "namespace": mf.get('namespace'),
-                    "key": mf.get('key'),
-                    "value": mf.get('value'),
-                    "type": mf.get('type')
-                })
-            
-            print_json({"status": "updated", "product": product_name})
-        else:
+
+        if metafield_error:
+            print_json({"error": f"Failed to set basesku metafield: {metafield_error}"})
             print_json({"status": "failed", "product": product_name})
-            
+            return
+
+        # The AA id the product now has, for the other stages' lookups
+        aa_id = parse_aa_id(written) if written is not None else node_aa_id(product)
+        if aa_id:
+            aa_id_cache.put(product_data.get('handle'), aa_id)
+
+        if DEBUG_METAFIELDS:
+            print_json({"debug": "Metafields after update:"})
+            dump_metafields(product_id)
+
+        print_json({"status": "updated", "product": product_name})
+
     except requests.RequestException as e:
         print_json({"error": f"Request failed for {product_name}: {str(e)}"})
         print_json({"status": "error", "product": product_name})
 
+def process_products(main_products):
+    """
+    Update every product: one bulk lookup by handle, the basesku metafields
+    in batched metafieldsSet mutations, then each product's mock-ups on the
+    worker pool.
+    """
+    for product_data in main_products:
+        print_json({"debug": f"Found main product: {product_data.get('name')}"})
+        print_json({"debug": f"Searching for product with handle: {product_data.get('handle')}"})
+    found = find_products(shopify, [product_data['handle'] for product_data in main_products])
+
+    ready, updates = [], {}
+    for product_data in main_products:
+        product_name = product_data.get('name')
+        if product_data['handle'] not in found:
+            print_json({"error": f"Request failed for {product_name}: product lookup failed"})
+            print_json({"status": "error", "product": product_name})
+            continue
+        product = found[product_data['handle']]
+        if not product:
+            print_json({"debug": f"No product found with handle: {product_data['handle']}"})
+            print_json({"status": "not_found", "product": product_name})
+            continue
+        value = plan_product(product_data, product)
+        if value is not None:
+            updates[product['id']] = value
+        ready.append((product_data, product))
+
+    errors = set_basesku_metafields(updates)
+
+    def finish(entry):
+        product_data, product = entry
+        try:
+            finish_product(product_data, product, updates.get(product['id']), errors.get(product['id']))
+        except Exception as e:
+            print_json({"error": f"Unexpected error for {product_data.get('name')}: {str(e)}"})
+            print_json({"status": "error", "product": product_data.get('name')})
+
+    # The shared client keeps the calls within Shopify's rate limit
+    with ThreadPoolExecutor(max_workers=PRODUCT_WORKERS) as executor:
+        list(executor.map(finish, ready))
+
 def process_product_images(product_data, product_id):
     """Attach Photoshop mock-ups (hero, 011, etc.) to the Shopify product.
 
@@ -235,7 +307,7 @@ def process_product_images(product_data, product_id):
     # Fetch existing images once so we can avoid duplicates
     try:
         images_endpoint = f"{SHOPIFY_API_BASE}/products/{product_id}/images.json"
-        resp = requests.get(images_endpoint, headers=SHOPIFY_HEADERS, timeout=30)
+        resp = shopify.get(images_endpoint)
         resp.raise_for_status()
         existing_sources = {img.get("src") for img in resp.json().get("images", [])}
     except requests.RequestException as e:
@@ -248,7 +320,7 @@ def process_product_images(product_data, product_id):
             continue
 
         try:
-            resp = requests.post(images_endpoint, json={"image": {"src": url}}, headers=SHOPIFY_HEADERS, timeout=30)
+            resp = shopify.post(images_endpoint, json={"image": {"src": url}})
             if resp.status_code in (200, 201, 202):
                 print_json({"debug": f"Attached mock-up: {url}"})
             else:
@@ -256,6 +328,53 @@ def process_product_images(product_data, product_id):
         except requests.RequestException as e:
             print_json({"error": f"Network error while attaching {url}: {str(e)}"})
 
+def _output_owners(item):
+    """Lower-cased ids a Photoshop output record names its product by, most
+    specific first: the prefix of '<handle or AA id>_6_hero.png', then that
+    of the S3 name 'AA12345606_hero.png'."""
+    owners = []
+    file_name = item.get('file') or ''
+    if '_6_' in file_name:
+        owners.append(file_name.split('_6_', 1)[0].lower())
+    url_name = item['url'].split('?')[0].rsplit('/', 1)[-1]
+    if '06_' in url_name:
+        owners.append(url_name.split('06_', 1)[0].lower())
+    return owners
+
+def group_products(products_data):
+    """
+    The main product records of *products_data* (one per handle, first one
+    wins), each with the URLs of its Photoshop outputs merged in as
+    '<image type>_url' keys for process_product_images.  An output that
+    names no product in the batch goes to the first product, as before.
+    """
+    main_products, by_id = [], {}
+    for item in products_data:
+        if (
+            isinstance(item, dict)
+            and item.get('name')
+            and item.get('handle')
+            and item.get('base_sku') is not None
+        ):
+            if item['handle'].lower() in by_id:
+                continue
+            main_products.append(item)
+            by_id.setdefault(item['handle'].lower(), item)
+            by_id.setdefault(str(item['base_sku']).lower(), item)
+
+    if not main_products:
+        return []
+
+    for item in products_data:
+        if isinstance(item, dict) and item.get('type') == 'photoshop_output' and item.get('url'):
+            owner = next((by_id[owner] for owner in _output_owners(item) if owner in by_id), main_products[0])
+            image_type = item.get('image_type', '').lower() or 'extra'
+            safe_key = re.sub(r'[^a-z0-9]+', '_', image_type) + '_url'
+            # Do not overwrite if the key already exists (idempotent)
+            if safe_key not in owner:
+                owner[safe_key] = item['url']
+    return main_products
+
 def main():
     if len(sys.argv) != 2:
         print_json({"error": "Usage: python process_products.py <processed_products.json>"})
@@ -269,38 +388,18 @@ def main():
         
         print_json({"status": "start", "product_count": len(products_data)})
         
-        # 1) Identify the *main* product record
-        main_product = None
-        for item in products_data:
-            if (
-                isinstance(item, dict)
-                and item.get('name')
-                and item.get('handle')
-                and item.get('base_sku') is not None
-            ):
-                main_product = item
-                break
+        # 1) Group the records by product and merge each product's
+        #    Photoshop output URLs into it
+        main_products = group_products(products_data)
 
-        # 2) Merge any Photoshop output URLs into the main product so
-        #    ``process_product_images`` can pick them up.
-        if main_product:
-            for item in products_data:
-                if item is main_product:
-                    continue
-                if isinstance(item, dict) and item.get('type') == 'photoshop_output' and item.get('url'):
-                    image_type = item.get('image_type', '').lower() or 'extra'
-                    safe_key = re.sub(r'[^a-z0-9]+', '_', image_type) + '_url'
-                    # Do not overwrite if the key already exists (idempotent)
-                    if safe_key not in main_product:
-                        main_product[safe_key] = item['url']
-
-        if main_product:
-            print_json({"debug": f"Found main product: {main_product.get('name')}"})
-            process_product(main_product)
+        # 2) Update them: a few batched requests plus the mock-ups per product
+        if main_products:
+            process_products(main_products)
         else:
             print_json({"error": "No main product data found in the JSON file"})
             print_json({"debug": f"JSON structure: {json.dumps(products_data, indent=2)}"})
         
+        print_json({"debug": "SHOPIFY_STATS", **shopify.stats()})
         print_json({"status": "complete", "message": "All products processed"})
         
     except FileNotFoundError:
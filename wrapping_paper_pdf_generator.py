@@ -38,6 +38,11 @@ try:
 except ImportError:
     sys.exit("[ERROR] Pillow is not installed. Run `pip install Pillow`.\n")
 
+# Shared image helpers live in Scripts/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Scripts'))
+from tiling import load_at_size
+from raster_sidecar import load_sidecar
+
 try:
     from barcode import Code128
     from barcode.writer import ImageWriter
@@ -101,28 +106,27 @@ def validate_and_resize_image(image_path: str, max_pixels: int = MAX_SAFE_PIXELS
         ValueError: If image cannot be processed
     """
     try:
-        # First, get image info without loading the full image
-        with Image.open(image_path) as img_info:
-            width, height = img_info.size
-            total_pixels = width * height
-            
-            print(f"  Image dimensions: {width}x{height} ({total_pixels:,} pixels)")
+        # Prefer the raw raster sidecar written by images.py; otherwise read
+        # the header once and let load_at_size decode from the same handle
+        img = load_sidecar(image_path)
+        if img is None:
+            img = Image.open(image_path)
+        width, height = img.size
+        total_pixels = width * height
+        
+        print(f"  Image dimensions: {width}x{height} ({total_pixels:,} pixels)")
+        
+        if total_pixels > max_pixels:
+            # Calculate resize ratio to stay under the limit
+            ratio = (max_pixels / total_pixels) ** 0.5
+            new_width = int(width * ratio)
+            new_height = int(height * ratio)
             
-            if total_pixels > max_pixels:
-                # Calculate resize ratio to stay under the limit
-                ratio = (max_pixels / total_pixels) ** 0.5
-                new_width = int(width * ratio)
-                new_height = int(height * ratio)
-                
-                print(f"  Resizing large image to {new_width}x{new_height} for safety")
-                
-                # Load and resize the image
-                img = Image.open(image_path)
-                img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                return img
-            else:
-                # Image is safe to load as-is
-                return Image.open(image_path)
+            print(f"  Resizing large image to {new_width}x{new_height} for safety")
+        
+        # Draft decode + integer reduce + LANCZOS for oversized images;
+        # images under the limit are just loaded.
+        return load_at_size(img, max_pixels=max_pixels)
                 
     except Exception as e:
         raise ValueError(f"Cannot process image {image_path}: {e}")
@@ -168,18 +172,25 @@ def create_tiled_image_pdf(
     template_height: float,
     dpi: int = DPI,
     horizontal_repeats: int = HORIZONTAL_REPEATS,
+    image: Image.Image | None = None,
 ) -> bool:
-    """Create a single-page PDF filled with the source image in a tile pattern."""
+    """Create a single-page PDF filled with the source image in a tile pattern.
+
+    Pass an already validated *image* to reuse one decode across several
+    variants; it is left open for the caller to close.
+    """
 
+    owns_image = image is None
     try:
         print(f"  Creating tiled PDF: {os.path.basename(output_pdf_path)}")
         
         # Load and validate the image
-        try:
-            image = validate_and_resize_image(image_path)
-        except ValueError as e:
-            print(f"  Error: {e}")
-            return False
+        if owns_image:
+            try:
+                image = validate_and_resize_image(image_path)
+            except ValueError as e:
+                print(f"  Error: {e}")
+                return False
         
         doc = fitz.open()
         page = doc.new_page(width=template_width, height=template_height)
@@ -222,7 +233,8 @@ def create_tiled_image_pdf(
         doc.close()
         
         # Clean up
-        image.close()
+        if owns_image:
+            image.close()
         if os.path.exists(temp_scaled):
             os.remove(temp_scaled)
             
@@ -332,11 +344,18 @@ def process_wrapping_paper(image_path: str, output_dir: str, footer_path: str) -
     base_name = os.path.splitext(os.path.basename(image_path))[0]
     print(f"\nProcessing wrapping paper: {base_name}")
 
+    # Decode once for both variants
+    try:
+        image = validate_and_resize_image(image_path)
+    except ValueError as e:
+        print(f"  Error: {e}")
+        return
+
     # 6 ft variant
     print("\nGenerating 6ft wrapping paper")
     barcode_6ft = f"{base_name}06"
     pdf6 = os.path.join(output_dir, f"{barcode_6ft}.pdf")
-    if create_tiled_image_pdf(pdf6, image_path, TEMPLATE_6FT_WIDTH, TEMPLATE_6FT_HEIGHT):
+    if create_tiled_image_pdf(pdf6, image_path, TEMPLATE_6FT_WIDTH, TEMPLATE_6FT_HEIGHT, image=image):
         overlay_footer_and_add_text(pdf6, footer_path, pdf6, TEMPLATE_6FT_WIDTH, TEMPLATE_6FT_HEIGHT,
                                    base_name, "30'", "6'", barcode_6ft)
 
@@ -344,10 +363,12 @@ def process_wrapping_paper(image_path: str, output_dir: str, footer_path: str) -
     print("\nGenerating 15ft wrapping paper")
     barcode_15ft = f"{base_name}15"
     pdf15 = os.path.join(output_dir, f"{barcode_15ft}.pdf")
-    if create_tiled_image_pdf(pdf15, image_path, TEMPLATE_15FT_WIDTH, TEMPLATE_15FT_HEIGHT):
+    if create_tiled_image_pdf(pdf15, image_path, TEMPLATE_15FT_WIDTH, TEMPLATE_15FT_HEIGHT, image=image):
         overlay_footer_and_add_text(pdf15, footer_path, pdf15, TEMPLATE_15FT_WIDTH, TEMPLATE_15FT_HEIGHT,
                                    base_name, "30'", "15'", barcode_15ft)
 
+    image.close()
+
     print(f"\nCompleted wrapping paper processing: {base_name}")
 
 def process_tablerunner(image_path: str, output_dir: str, footer_path: str) -> None:
@@ -359,12 +380,19 @@ def process_tablerunner(image_path: str, output_dir: str, footer_path: str) -> N
     base_name = os.path.splitext(os.path.basename(image_path))[0]
     print(f"\nProcessing tablerunner: {base_name}")
 
+    # Decode once for both variants
+    try:
+        image = validate_and_resize_image(image_path)
+    except ValueError as e:
+        print(f"  Error: {e}")
+        return
+
     # 15 ft tablerunner
     print("\nGenerating 15ft tablerunner")
     barcode_15ft = f"{base_name}71"
     pdf15 = os.path.join(output_dir, f"{barcode_15ft}.pdf")
     if create_tiled_image_pdf(pdf15, image_path, TABLERUNNER_15FT_WIDTH, TABLERUNNER_15FT_HEIGHT,
-                             horizontal_repeats=TABLERUNNER_HORIZONTAL_REPEATS):
+                             horizontal_repeats=TABLERUNNER_HORIZONTAL_REPEATS, image=image):
         overlay_footer_and_add_text(pdf15, footer_path, pdf15, TABLERUNNER_15FT_WIDTH, TABLERUNNER_15FT_HEIGHT,
                                    base_name, "20'", "15'", barcode_15ft)
 
@@ -373,10 +401,12 @@ def process_tablerunner(image_path: str, output_dir: str, footer_path: str) -> N
     barcode_30ft = f"{base_name}72"
     pdf30 = os.path.join(output_dir, f"{barcode_30ft}.pdf")
     if create_tiled_image_pdf(pdf30, image_path, TABLERUNNER_30FT_WIDTH, TABLERUNNER_30FT_HEIGHT,
-                             horizontal_repeats=TABLERUNNER_HORIZONTAL_REPEATS):
+                             horizontal_repeats=TABLERUNNER_HORIZONTAL_REPEATS, image=image):
         overlay_footer_and_add_text(pdf30, footer_path, pdf30, TABLERUNNER_30FT_WIDTH, TABLERUNNER_30FT_HEIGHT,
                                    base_name, "20'", "30'", barcode_30ft)
 
+    image.close()
+
     print(f"\nCompleted tablerunner processing: {base_name}")
 
 def process_image(image_path: str, output_dir: str, footer_path: str, is_tablerunner: bool = False) -> None: